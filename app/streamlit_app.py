@@ -10,9 +10,10 @@ if SRC not in sys.path:
 import streamlit as st
 
 from rag_simple.config import Config
-from rag_simple.ingest import ingest_dir
-from rag_simple.generate import answer
-from rag_simple.store import get_collection
+from rag_simple import jobs
+from rag_simple.chat import chat_stream
+from rag_simple.catalog import Filters, list_documents
+from rag_simple.store import get_collection, warmup, invalidate, bump_index_version
 
 DOCS_DIR_DEFAULT = os.path.join(ROOT, "docs")
 
@@ -58,11 +59,15 @@ def index_count(cfg: Config) -> int:
         return -1
 
 def clear_index(cfg: Config):
+    # release the cached client first, it still points at the files we delete
+    invalidate(db_dir=cfg.db_dir)
     # nukes the Chroma persistent dir
     if os.path.isdir(cfg.db_dir):
         shutil.rmtree(cfg.db_dir)
     # small sleep to avoid file-lock races on some OSes
     time.sleep(0.2)
+    # new version token so cached answers for the old index are dropped
+    bump_index_version(cfg)
 
 def save_uploads(files, dest_dir: str):
     ensure_dir(dest_dir)
@@ -93,8 +98,21 @@ def sidebar_controls():
     top_k = st.sidebar.slider("Top-K", min_value=1, max_value=20, value=cfg0.top_k, step=1)
     chunk_size = st.sidebar.slider("Chunk size (chars)", 500, 3000, cfg0.chunk_size, 100)
     chunk_overlap = st.sidebar.slider("Chunk overlap (chars)", 0, 1000, cfg0.chunk_overlap, 50)
+    chunk_tokens = st.sidebar.number_input(
+        "Chunk size (tokens, 0 = use chars)", min_value=0, max_value=8192, value=cfg0.chunk_tokens, step=32,
+    )
 
     embed_model = st.sidebar.text_input("Embedding model", cfg0.embed_model)
+    backends = ["torch", "onnx", "onnx-int8"]
+    embed_backend = st.sidebar.selectbox(
+        "Embedding backend", backends,
+        index=backends.index(cfg0.embed_backend) if cfg0.embed_backend in backends else 0,
+    )
+    stores = ["chroma", "flat"]
+    vector_backend = st.sidebar.selectbox(
+        "Vector store", stores,
+        index=stores.index(cfg0.vector_backend) if cfg0.vector_backend in stores else 0,
+    )
     ollama_host = st.sidebar.text_input("Ollama host", cfg0.ollama_host)
     ollama_model = st.sidebar.text_input("Ollama model", cfg0.ollama_model)
 
@@ -103,19 +121,94 @@ def sidebar_controls():
     cfg = replace(
         cfg0,
         db_dir=db_dir,
+        docs_dir=docs_dir,
         top_k=top_k,
         chunk_size=chunk_size,
         chunk_overlap=chunk_overlap,
+        chunk_tokens=int(chunk_tokens),
         embed_model=embed_model,
+        embed_backend=embed_backend,
+        vector_backend=vector_backend,
         ollama_host=ollama_host,
         ollama_model=ollama_model,
     )
+    sync_store(cfg)
     return cfg, docs_dir
 
+def scope_controls(cfg: Config):
+    """Sidebar filters over the document catalog; returns None when nothing is selected."""
+    docs = list_documents(cfg)
+    if not docs:
+        return None
+    st.sidebar.header("Scope")
+    tags = sorted({t for d in docs for t in d["tags"]})
+    types = sorted({d["type"] for d in docs})
+    sel_tags = st.sidebar.multiselect("Folder tags (all must match)", tags) if tags else []
+    sel_types = st.sidebar.multiselect("Document types", types)
+    shown = list_documents(cfg, type=sel_types, tags=sel_tags)
+    sel_docs = st.sidebar.multiselect(
+        f"Documents ({len(shown)})", [d["source"] for d in shown], format_func=os.path.basename,
+    )
+    f = Filters(source=sel_docs, type=sel_types, tags=sel_tags)
+    return None if f.empty() else f
+
+def sync_store(cfg: Config):
+    """Drop cached store handles when the sidebar switches model or DB dir, and warm
+    the registry for the current settings so the first question is not slow."""
+    prev = st.session_state.get("store_key")
+    cur = (cfg.db_dir, cfg.embed_model, cfg.embed_backend, cfg.vector_backend)
+    if prev is not None and prev != cur:
+        old_db, old_model, old_backend, _ = prev
+        invalidate(
+            db_dir=old_db if old_db != cfg.db_dir else None,
+            embed_model=old_model if (old_model, old_backend) != (cfg.embed_model, cfg.embed_backend) else None,
+        )
+    if prev != cur:
+        try:
+            warmup(cfg)
+        except Exception as e:
+            st.sidebar.warning(f"Could not load index/model: {e}")
+    st.session_state["store_key"] = cur
+
+def _log_index_action(text: str):
+    if "chat" not in st.session_state:
+        st.session_state["chat"] = []
+    st.session_state["chat"].append({"role": "assistant", "content": f"**Index action**\n\n{text}", "sources": []})
+
+def _jobs_panel(cfg: Config):
+    recent = jobs.store(cfg).list(limit=5)
+    if not recent:
+        st.caption("No ingestion jobs yet.")
+        return
+    for job in recent:
+        total = job["files_total"]
+        what = f"{total} file(s)" if total is not None else f"sync of `{job['docs_dir']}`"
+        line = (f"`{job['id']}` {what}: **{job['status']}**, {job['files_done']} done"
+                f"{f' / {total}' if total else ''}, {job['chunks']} chunks, "
+                f"{job['files_per_s']} files/s, {job['chunks_per_s']} chunks/s")
+        if job["error"]:
+            line += f" — {job['error']}"
+        c1, c2 = st.columns([5, 1], vertical_alignment="center")
+        with c1:
+            st.markdown(line)
+            if job["status"] == "running" and total:
+                st.progress(min(1.0, job["files_done"] / total))
+        with c2:
+            if job["status"] in ("queued", "running") and st.button("Cancel", key=f"cancel_{job['id']}"):
+                jobs.store(cfg).cancel(job["id"])
+                st.rerun()
+
+# re-render the jobs panel every 2 s without rerunning the whole app (Streamlit >= 1.37)
+if hasattr(st, "fragment"):
+    _jobs_panel = st.fragment(run_every=2)(_jobs_panel)
+
 def ui():
     st.title("SSED Document Assistant")
 
     cfg, docs_dir = sidebar_controls()
+    filters = scope_controls(cfg)
+    # picks up jobs queued before a restart; questions are answered while a job runs
+    jobs.ensure_worker(cfg)
 
 
     tab_ask, tab_retrain = st.tabs(["Ask", "Re-train (Expert only)"])  # two-tab layout
@@ -146,6 +239,8 @@ def ui():
                                 score = s.get("score")
                                 base = os.path.basename(path) if path else ""
                                 label = (f"• {base} — page {page}, dist {score:.4f}" if score is not None else f"• {base} — page {page}")
+                                if s.get("duplicates"):
+                                    label += f" (+{s['duplicates']} near-duplicate locations)"
                                 st.markdown(label)
 
         # 2) Input stays at the bottom
@@ -162,16 +257,26 @@ def ui():
                 with st.chat_message("user"):
                     st.markdown(user_q)
 
-                # Show only a spinner while we compute (no temporary text block)
+                # Stream tokens into the message as Ollama produces them
                 with st.chat_message("assistant"):
-                    with st.spinner("Working…"):
-                        resp = answer(cfg, user_q.strip())
+                    got = {"sources": []}
+
+                    def tokens():
+                        # one chat session per browser session, so follow-up questions see earlier turns
+                        for ev in chat_stream(cfg, st.session_state.get("chat_session"), user_q.strip(), filters):
+                            if ev["type"] == "sources":
+                                got["sources"] = ev["sources"]
+                                st.session_state["chat_session"] = ev["session"]
+                            elif ev["type"] == "token":
+                                yield ev["text"]
+
+                    text = st.write_stream(tokens())
 
             # Persist assistant message so it renders once in history on rerun
             st.session_state["chat"].append({
                 "role": "assistant",
-                "content": resp.get("answer", ""),
-                "sources": resp.get("sources", []),
+                "content": text if isinstance(text, str) else "".join(map(str, text)),
+                "sources": got["sources"],
             })
 
             # Rerun to display the newly appended assistant message without duplicates
@@ -217,18 +322,9 @@ def ui():
             if st.button("Save uploads to docs/ and Ingest", type="primary", key="btn_upload_ingest"):
                 paths = save_uploads(uploaded, docs_dir)
                 if paths:
-                    with st.spinner("Ingesting..."):
-                        ingest_dir(cfg, docs_dir)
-                    st.success(f"Ingested {len(paths)} file(s).")
-                    # Log to chat
-                    new_count = index_count(cfg)
-                    if "chat" not in st.session_state:
-                        st.session_state["chat"] = []
-                    st.session_state["chat"].append({
-                        "role": "assistant",
-                        "content": f"**Index action**\n\nSaved and ingested {len(paths)} file(s). Collection size: **{new_count}**.",
-                        "sources": [],
-                    })
+                    # only the saved files are ingested, in the background
+                    jid = jobs.submit(cfg, paths)
+                    _log_index_action(f"Saved {len(paths)} file(s); ingest job `{jid}` queued.")
                     st.rerun()
                 else:
                     st.info("Nothing uploaded.")
@@ -236,26 +332,19 @@ def ui():
             if st.button(
                 "Rebuild from docs/ (quick add)",
                 help=(
-                    "Ingests all files under the docs directory. If you already indexed them before, "
-                    "consider clearing the index to avoid duplicate-id errors."
+                    "Syncs the docs directory into the index: new and changed files are (re-)ingested, "
+                    "unchanged files are skipped and deleted files are removed."
                 ),
                 key="btn_rebuild_docs",
             ):
-                with st.spinner("Ingesting docs/ ..."):
-                    ingest_dir(cfg, docs_dir)
-                st.success("Ingestion finished.")
-                # Log to chat
-                new_count = index_count(cfg)
-                if "chat" not in st.session_state:
-                    st.session_state["chat"] = []
-                st.session_state["chat"].append({
-                    "role": "assistant",
-                    "content": f"**Index action**\n\nRe-ingested docs/. Collection size: **{new_count}**.",
-                    "sources": [],
-                })
+                jid = jobs.submit(cfg, docs_dir=docs_dir)
+                _log_index_action(f"Sync of docs/ queued as ingest job `{jid}`.")
                 st.rerun()
 
         st.caption(f"Docs dir: `{docs_dir}`  – You can also populate it manually in Finder/Explorer.")
 
+        st.subheader("Ingestion jobs")
+        _jobs_panel(cfg)
+
 if __name__ == "__main__":
     ui()
\ No newline at end of file
@@ -0,0 +1,70 @@
+"""Deterministic synthetic corpus: text files, multi-page PDFs and scanned pages
+(image-only PDF pages and PNGs, which exercise the OCR path when Tesseract exists)."""
+from __future__ import annotations
+import os
+import random
+from typing import Dict, List
+
+import fitz  # PyMuPDF
+
+SUBJECTS = ["pump", "valve", "interlock", "transmitter", "breaker", "flange", "controller",
+            "heat exchanger", "relay", "compressor", "sensor", "actuator", "panel", "cable tray"]
+VERBS = ["shall be inspected", "is rated", "must be calibrated", "trips", "is isolated",
+         "is torqued", "is replaced", "reports a fault", "is bypassed", "is commissioned"]
+DETAILS = ["every 6 months", "at 40 Nm", "below 12 L/min", "per drawing E-{n}", "within 5 s",
+           "at 480 V", "after revision {n}", "in zone {n}", "at 85 degC", "with a 2 mA deadband"]
+
+
+def sentence(rng: random.Random) -> str:
+    s = f"The {rng.choice(SUBJECTS)} {rng.choice(VERBS)} {rng.choice(DETAILS)}."
+    return s.replace("{n}", str(rng.randint(1, 999)))
+
+
+def paragraph(rng: random.Random, n: int) -> str:
+    return " ".join(sentence(rng) for _ in range(n))
+
+
+def questions(n: int, seed: int = 1) -> List[str]:
+    rng = random.Random(seed)
+    return [f"What is the requirement for the {rng.choice(SUBJECTS)} that {rng.choice(VERBS)}?"
+            for _ in range(n)]
+
+
+def _text_page(page, rng: random.Random) -> None:
+    page.insert_textbox(fitz.Rect(50, 50, 545, 790), paragraph(rng, 30), fontsize=9)
+
+
+def generate(root: str, n_docs: int, seed: int = 0) -> Dict[str, int]:
+    """Write `n_docs` documents under `root` (60% text, 30% PDF, 10% scanned)."""
+    rng = random.Random(seed)
+    os.makedirs(root, exist_ok=True)
+    counts = {"text": 0, "pdf": 0, "scanned": 0, "pages": 0}
+    for i in range(n_docs):
+        kind = rng.random()
+        sub = os.path.join(root, f"dept{i % 4}")
+        os.makedirs(sub, exist_ok=True)
+        if kind < 0.6:
+            with open(os.path.join(sub, f"note_{i:05d}.txt"), "w", encoding="utf-8") as f:
+                f.write("\n\n".join(paragraph(rng, 8) for _ in range(rng.randint(2, 12))))
+            counts["text"] += 1
+        elif kind < 0.9:
+            doc = fitz.open()
+            for _ in range(rng.randint(3, 20)):
+                _text_page(doc.new_page(), rng)
+                counts["pages"] += 1
+            doc.save(os.path.join(sub, f"spec_{i:05d}.pdf"))
+            counts["pdf"] += 1
+        else:
+            # render a text page to pixels, then store only the image
+            src = fitz.open()
+            _text_page(src.new_page(), rng)
+            pix = src[0].get_pixmap(dpi=150)
+            if rng.random() < 0.5:
+                pix.save(os.path.join(sub, f"scan_{i:05d}.png"))
+            else:
+                doc = fitz.open()
+                doc.new_page().insert_image(fitz.Rect(0, 0, 595, 842), pixmap=pix)
+                doc.save(os.path.join(sub, f"scan_{i:05d}.pdf"))
+                counts["pages"] += 1
+            counts["scanned"] += 1
+    return counts
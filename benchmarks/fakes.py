@@ -0,0 +1,147 @@
+"""Offline stand-ins used by the benchmark suite.
+
+- `HashEmbeddingFunction`: deterministic feature-hashed bag-of-words vectors, so
+  retrieval behaves sensibly without downloading or running a model.
+- `StubOllama`: a tiny local HTTP server speaking enough of Ollama's `/api/generate`
+  and `/api/chat` (streaming and non-streaming) for `generate.py`, with a configurable
+  prefill delay and token rate. Like Ollama's KV cache, the prefix shared with the
+  previous prompt is not charged again.
+"""
+from __future__ import annotations
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List
+
+import numpy as np
+from chromadb.api.types import EmbeddingFunction
+
+_TOKEN = re.compile(r"\w+")
+
+
+class HashEmbeddingFunction(EmbeddingFunction):
+    def __init__(self, dim: int = 384):
+        self.dim = dim
+
+    def __call__(self, input: List[str]):
+        out = []
+        for text in input:
+            v = np.zeros(self.dim, dtype=np.float32)
+            for tok in _TOKEN.findall(text.lower()):
+                h = int.from_bytes(hashlib.blake2b(tok.encode(), digest_size=8).digest(), "little")
+                v[h % self.dim] += 1.0 if (h >> 63) else -1.0
+            n = np.linalg.norm(v)
+            out.append(v / n if n else v)
+        return out
+
+    @staticmethod
+    def name() -> str:
+        return "bench_hash"
+
+    def get_config(self):
+        return {"dim": self.dim}
+
+    @staticmethod
+    def build_from_config(config):
+        return HashEmbeddingFunction(config.get("dim", 384))
+
+
+def install_fake_embedder(dim: int = 384) -> None:
+    """Make the store hand out HashEmbeddingFunction for every model/backend."""
+    from rag_simple import store
+    store.make_embedding_function = lambda cfg: HashEmbeddingFunction(dim)
+    store.invalidate()
+
+
+class StubOllama:
+    def __init__(self, prefill_s: float = 0.05, tokens_per_s: float = 200.0, n_tokens: int = 40,
+                 prefill_s_per_1k: float = 0.0):
+        self.prefill_s = prefill_s
+        self.prefill_s_per_1k = prefill_s_per_1k  # extra delay per 1000 prompt tokens
+        self.token_s = 1.0 / tokens_per_s if tokens_per_s > 0 else 0.0
+        self.n_tokens = n_tokens
+        self.requests: list = []  # (prompt tokens, num_ctx) per request
+        self.prefilled: list = []  # prompt tokens not covered by the cached prefix
+        self._last_prompt = ""
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                chat = self.path.startswith("/api/chat")
+                if not (chat or self.path.startswith("/api/generate")):
+                    self.send_response(404)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                prompt = body.get("prompt") or "".join(
+                    f"<{m.get('role')}>{m.get('content', '')}" for m in body.get("messages", []))
+                n_prompt = len(prompt) // 4
+                # like Ollama's KV cache: only the part after the previous prompt's common
+                # prefix needs prefilling
+                with stub._lock:
+                    shared = len(os.path.commonprefix([stub._last_prompt, prompt])) // 4
+                    stub._last_prompt = prompt
+                    stub.requests.append((n_prompt, (body.get("options") or {}).get("num_ctx")))
+                    stub.prefilled.append(n_prompt - shared)
+                time.sleep(stub.prefill_s + stub.prefill_s_per_1k * (n_prompt - shared) / 1000.0)
+                words = [f"tok{i} " for i in range(stub.n_tokens)]
+
+                def msg(text, done):
+                    m = {"model": body.get("model"), "created_at": "1970-01-01T00:00:00Z", "done": done}
+                    if chat:
+                        m["message"] = {"role": "assistant", "content": text}
+                    else:
+                        m["response"] = text
+                    if done:
+                        m["done_reason"] = "stop"
+                        m["prompt_eval_count"] = n_prompt
+                        m["eval_count"] = stub.n_tokens
+                    return m
+
+                if body.get("stream", True):
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/x-ndjson")
+                    self.send_header("Transfer-Encoding", "chunked")
+                    self.end_headers()
+                    for w in words:
+                        time.sleep(stub.token_s)
+                        self._chunk(json.dumps(msg(w, False)) + "\n")
+                    self._chunk(json.dumps(msg("", True)) + "\n")
+                    self.wfile.write(b"0\r\n\r\n")
+                else:
+                    time.sleep(stub.token_s * len(words))
+                    data = json.dumps(msg("".join(words), True)).encode()
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+
+            def _chunk(self, s: str):
+                b = s.encode()
+                self.wfile.write(f"{len(b):x}\r\n".encode() + b + b"\r\n")
+                self.wfile.flush()
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.host = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self) -> "StubOllama":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""Import-time budget check for the CLI entry points.
+
+Each target is imported in a fresh interpreter; the check fails (exit code 1) when an
+import takes longer than its budget or drags in a heavy dependency it should only load
+on first use. Run it in CI or before a release:
+
+    python benchmarks/import_time.py            # default budgets
+    python benchmarks/import_time.py --scale 2  # slower machine: double every budget
+"""
+import os, sys
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+SRC = os.path.join(ROOT, 'src')
+import json
+import argparse
+import subprocess
+
+HEAVY = ("chromadb", "torch", "sentence_transformers", "onnxruntime", "fitz", "pymupdf",
+         "ollama", "fastapi", "numpy", "pytesseract", "PIL", "tqdm")
+
+# module -> (budget in ms, heavy modules it must not import)
+TARGETS = {
+    "rag_simple": (100, HEAVY),
+    "rag_simple.client": (150, HEAVY),
+    "rag_simple.text_extractor": (150, HEAVY),
+}
+
+_PROBE = """
+import sys, time, json
+sys.path.insert(0, {src!r})
+t = time.perf_counter()
+import {mod}
+ms = (time.perf_counter() - t) * 1000
+print(json.dumps({{"ms": ms, "loaded": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def measure(mod: str, heavy, runs: int) -> dict:
+    best = None
+    for _ in range(runs):
+        code = _PROBE.format(src=SRC, mod=mod, heavy=tuple(heavy))
+        out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+        res = json.loads(out.stdout.strip().splitlines()[-1])
+        if best is None or res["ms"] < best["ms"]:
+            best = res
+    return best
+
+
+def main():
+    p = argparse.ArgumentParser(description="Fail if CLI imports exceed their time budget")
+    p.add_argument("--runs", type=int, default=5, help="Fresh interpreters per target (best is kept)")
+    p.add_argument("--scale", type=float, default=1.0, help="Multiply every budget")
+    args = p.parse_args()
+
+    failed = False
+    for mod, (budget, heavy) in TARGETS.items():
+        res = measure(mod, heavy, args.runs)
+        limit = budget * args.scale
+        ok = res["ms"] <= limit and not res["loaded"]
+        failed |= not ok
+        extra = f"; loaded heavy modules: {', '.join(res['loaded'])}" if res["loaded"] else ""
+        print(f"{'ok  ' if ok else 'FAIL'} import {mod}: {res['ms']:.1f} ms (budget {limit:.0f} ms){extra}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
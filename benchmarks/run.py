@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""Reproducible, offline benchmark of the ingest and query paths.
+
+Generates a synthetic corpus per size, ingests it with a deterministic hashing embedder
+(no model download) and answers against a local stub Ollama server (no network), then
+writes one JSON document with:
+
+- ingest: files/s, chunks/s and peak RSS for each worker count;
+- retrieve / answer: p50/p95/p99 latency (ms) and QPS for each concurrency level;
+- chat: per-turn latency of sequential multi-turn sessions and the share of each prompt
+  that had to be prefilled.
+
+Query and answer caches are disabled so every request does the full work.
+
+    python benchmarks/run.py --sizes 50,200 --concurrency 1,4,16 --out bench.json
+"""
+import os, sys
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+SRC = os.path.join(ROOT, 'src')
+for p in (SRC, os.path.dirname(os.path.abspath(__file__))):
+    if p not in sys.path:
+        sys.path.insert(0, p)
+import json
+import time
+import logging
+import shutil
+import platform
+import argparse
+import tempfile
+import resource
+import multiprocessing as mp
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List
+
+import numpy as np
+
+
+def _percentiles(lat: List[float], wall: float) -> Dict[str, float]:
+    a = np.asarray(lat) * 1000.0
+    return {
+        "n": len(lat),
+        "p50_ms": round(float(np.percentile(a, 50)), 3),
+        "p95_ms": round(float(np.percentile(a, 95)), 3),
+        "p99_ms": round(float(np.percentile(a, 99)), 3),
+        "qps": round(len(lat) / wall, 2) if wall > 0 else 0.0,
+    }
+
+
+def _load(fn: Callable[[str], Any], questions: List[str], concurrency: int) -> Dict[str, float]:
+    lat: List[float] = []
+
+    def one(q: str) -> None:
+        t = time.perf_counter()
+        fn(q)
+        lat.append(time.perf_counter() - t)
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, questions))
+    return _percentiles(lat, time.perf_counter() - t0)
+
+
+def _dir_mb(path: str) -> float:
+    total = 0
+    for d, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(d, f)) for f in files)
+    return round(total / 2**20, 2)
+
+
+def _ingest_child(docs: str, work: str, workers: int, out) -> None:
+    # Fresh process per run so peak RSS belongs to this ingest alone
+    from fakes import install_fake_embedder
+    from rag_simple.config import Config
+    from rag_simple.ingest import ingest_dir
+
+    install_fake_embedder()
+    cfg = Config(db_dir=os.path.join(work, "db"), collection="bench",
+                 embed_cache_dir=os.path.join(work, "cache"), embed_cache_max_mb=0,
+                 ocr_cache_dir=os.path.join(work, "cache"))
+    t0 = time.perf_counter()
+    stats = ingest_dir(cfg, docs, workers=workers)
+    wall = time.perf_counter() - t0
+    kb = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+             resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)  # KiB on Linux
+    out.put({
+        "workers": workers,
+        "seconds": round(wall, 3),
+        "files": stats["files"],
+        "chunks": stats["chunks"],
+        "failed": stats["failed"],
+        "files_per_s": round(stats["files"] / wall, 2),
+        "chunks_per_s": round(stats["chunks"] / wall, 2),
+        "peak_rss_mb": round(kb / 1024, 1),
+        "index_mb": _dir_mb(cfg.db_dir),
+    })
+
+
+def bench_ingest(docs: str, work: str, workers: int) -> Dict[str, Any]:
+    shutil.rmtree(work, ignore_errors=True)
+    ctx = mp.get_context("spawn")
+    out = ctx.Queue()
+    proc = ctx.Process(target=_ingest_child, args=(docs, work, workers, out))
+    proc.start()
+    res = out.get()
+    proc.join()
+    return res
+
+
+def bench_queries(work: str, questions: List[str], levels: List[int], stub) -> Dict[str, Any]:
+    from fakes import install_fake_embedder
+    from rag_simple.config import Config
+    from rag_simple.retrieve import retrieve
+    from rag_simple.generate import answer
+    from rag_simple.store import warmup
+
+    install_fake_embedder()
+    cfg = Config(db_dir=os.path.join(work, "db"), collection="bench",
+                 query_cache_size=0, answer_cache=False, ollama_host=stub.host)
+    warmup(cfg)
+    retrieve(cfg, questions[0])
+    out: Dict[str, Any] = {"retrieve": {}, "answer": {}}
+    for c in levels:
+        out["retrieve"][str(c)] = _load(lambda q: retrieve(cfg, q), questions, c)
+        seen = len(stub.requests)
+        out["answer"][str(c)] = _load(lambda q: answer(cfg, q), questions, c)
+        sent = stub.requests[seen:]
+        if sent:
+            out["answer"][str(c)]["prompt_tokens_avg"] = round(sum(n for n, _ in sent) / len(sent), 1)
+            out["answer"][str(c)]["num_ctx_max"] = max((x or 0) for _, x in sent)
+    return out
+
+
+def bench_chat(work: str, questions: List[str], turns: int, stub) -> Dict[str, Any]:
+    """Sequential multi-turn sessions: latency per turn, and how much of each prompt the
+    stub had to prefill (the rest was the prefix cached from the previous turn)."""
+    from rag_simple.config import Config
+    from rag_simple.chat import chat
+
+    cfg = Config(db_dir=os.path.join(work, "db"), collection="bench",
+                 query_cache_size=0, answer_cache=False, ollama_host=stub.host)
+    seen = len(stub.requests)
+    lat: List[float] = []
+    t0 = time.perf_counter()
+    for s in range(0, len(questions) - turns + 1, turns):
+        session = None
+        for q in questions[s:s + turns]:
+            t = time.perf_counter()
+            session = chat(cfg, session, q)["session"]
+            lat.append(time.perf_counter() - t)
+    res = _percentiles(lat, time.perf_counter() - t0)
+    sent, fresh = stub.requests[seen:], stub.prefilled[seen:]
+    if sent:
+        res["turns"] = turns
+        res["prompt_tokens_avg"] = round(sum(n for n, _ in sent) / len(sent), 1)
+        res["prefilled_tokens_avg"] = round(sum(fresh) / len(fresh), 1)
+    return res
+
+
+def main():
+    p = argparse.ArgumentParser(description="Offline benchmark for rag_simple ingest and query paths")
+    p.add_argument("--sizes", default="50,200", help="Comma-separated corpus sizes (documents)")
+    p.add_argument("--workers", default="1,4", help="Comma-separated ingest worker counts")
+    p.add_argument("--concurrency", default="1,4,16", help="Comma-separated query concurrency levels")
+    p.add_argument("--queries", type=int, default=200, help="Questions per concurrency level")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--prefill-ms", type=float, default=50.0, help="Stub Ollama delay before the first token")
+    p.add_argument("--prefill-ms-per-1k", type=float, default=0.0,
+                   help="Extra stub Ollama delay per 1000 prompt tokens")
+    p.add_argument("--tokens-per-s", type=float, default=200.0, help="Stub Ollama token rate")
+    p.add_argument("--chat-turns", type=int, default=5, help="Turns per session in the chat benchmark (0 skips it)")
+    p.add_argument("--workdir", default=None, help="Where corpora and indexes go (default: temp dir)")
+    p.add_argument("--keep", action="store_true", help="Keep the work directory")
+    p.add_argument("--out", default="bench_results.json")
+    args = p.parse_args()
+
+    # no network here: fail fast instead of retrying Hub lookups for tokenizers
+    os.environ.setdefault("HF_HUB_OFFLINE", "1")
+    import corpus
+    from fakes import StubOllama
+
+    logging.getLogger("httpx").setLevel(logging.WARNING)  # one line per stub request otherwise
+
+    sizes = [int(s) for s in args.sizes.split(",")]
+    workers = [int(s) for s in args.workers.split(",")]
+    levels = [int(s) for s in args.concurrency.split(",")]
+    root = args.workdir or tempfile.mkdtemp(prefix="rag_bench_")
+    questions = corpus.questions(args.queries, seed=args.seed + 1)
+
+    report: Dict[str, Any] = {
+        "env": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "params": vars(args),
+        "runs": [],
+    }
+    try:
+        with StubOllama(prefill_s=args.prefill_ms / 1000.0, tokens_per_s=args.tokens_per_s,
+                        prefill_s_per_1k=args.prefill_ms_per_1k / 1000.0) as stub:
+            for size in sizes:
+                docs = os.path.join(root, f"corpus_{size}")
+                counts = corpus.generate(docs, size, seed=args.seed)
+                run: Dict[str, Any] = {"size": size, "corpus": counts, "ingest": []}
+                for w in workers:
+                    work = os.path.join(root, f"index_{size}_w{w}")
+                    res = bench_ingest(docs, work, w)
+                    print(f"[ingest] size={size} workers={w}: {res['files_per_s']} files/s, "
+                          f"{res['chunks_per_s']} chunks/s, peak {res['peak_rss_mb']} MB")
+                    run["ingest"].append(res)
+                run.update(bench_queries(work, questions, levels, stub))
+                for kind in ("retrieve", "answer"):
+                    for c, r in run[kind].items():
+                        extra = f", prompt ~{r['prompt_tokens_avg']} tok" if "prompt_tokens_avg" in r else ""
+                        print(f"[{kind}] size={size} c={c}: p50 {r['p50_ms']} ms, "
+                              f"p99 {r['p99_ms']} ms, {r['qps']} qps{extra}")
+                if args.chat_turns > 0:
+                    r = run["chat"] = bench_chat(work, questions, args.chat_turns, stub)
+                    print(f"[chat] size={size} turns={args.chat_turns}: p50 {r['p50_ms']} ms, "
+                          f"prompt ~{r.get('prompt_tokens_avg')} tok, prefilled ~{r.get('prefilled_tokens_avg')} tok")
+                report["runs"].append(run)
+    finally:
+        if not args.keep and not args.workdir:
+            shutil.rmtree(root, ignore_errors=True)
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -8,16 +8,35 @@ if SRC not in sys.path:
     sys.path.insert(0, SRC)
 import argparse
 from rag_simple.config import Config
-from rag_simple.generate import answer
 
 
 def main():
     p = argparse.ArgumentParser(description="Ask a question against the RAG index")
-    p.add_argument("question", help="Your question")
+    p.add_argument("question", nargs="?", help="Your question")
+    p.add_argument("--batch", help="JSONL file of questions to answer in bulk")
+    p.add_argument("--out", default="answers.jsonl", help="JSONL output for --batch (resumable)")
+    p.add_argument("--concurrency", type=int, default=None, help="Parallel generations for --batch")
+    p.add_argument("--server", help="Ask a running API server at this URL instead of loading the index")
     args = p.parse_args()
 
     cfg = Config()
-    resp = answer(cfg, args.question)
+    if args.batch:
+        if args.server:
+            p.error("--batch runs locally; it cannot be combined with --server")
+        from rag_simple.batch import run_batch
+        run_batch(cfg, args.batch, args.out, args.concurrency)
+        return
+    if not args.question:
+        p.error("a question (or --batch FILE) is required")
+    if args.server:
+        from rag_simple.client import ask_remote
+        try:
+            resp = ask_remote(args.server, args.question)
+        except RuntimeError as e:
+            sys.exit(str(e))
+    else:
+        from rag_simple.generate import answer
+        resp = answer(cfg, args.question)
 
     print("\n=== ANSWER ===\n")
     print(resp["answer"]) 
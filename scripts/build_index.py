@@ -8,16 +8,35 @@ if SRC not in sys.path:
     sys.path.insert(0, SRC)
 import argparse
 from rag_simple.config import Config
-from rag_simple.ingest import ingest_dir
+from rag_simple.ingest import ingest_dir, rebuild_shard
 
 
 def main():
+    cfg = Config()
     p = argparse.ArgumentParser(description="Ingest documents into Chroma")
-    p.add_argument("--docs", default="./docs", help="Directory of documents to ingest")
+    p.add_argument("--docs", default=cfg.docs_dir, help="Directory of documents to ingest")
+    p.add_argument("--workers", type=int, default=None,
+                   help="Extraction worker processes (>1 enables the pipelined ingest)")
+    p.add_argument("--rebuild-shard", metavar="SHARD",
+                   help="Drop and re-ingest one shard only (requires RAG_SHARD_BY)")
+    p.add_argument("--watch", action="store_true",
+                   help="Keep running and index files as they are added, changed or removed")
+    p.add_argument("--poll", action="store_true",
+                   help="With --watch: rescan periodically instead of using inotify (network shares)")
+    p.add_argument("--metrics-port", type=int, default=None,
+                   help="With --watch: serve Prometheus metrics (indexing lag) on this port")
     args = p.parse_args()
 
-    cfg = Config()
-    ingest_dir(cfg, args.docs)
+    if args.rebuild_shard:
+        rebuild_shard(cfg, args.rebuild_shard, workers=args.workers)
+    elif args.watch:
+        from rag_simple.watch import watch
+        try:
+            watch(cfg, args.docs, workers=args.workers, poll=args.poll, metrics_port=args.metrics_port)
+        except KeyboardInterrupt:
+            pass
+    else:
+        ingest_dir(cfg, args.docs, workers=args.workers)
 
 
 if __name__ == "__main__":
@@ -7,22 +7,35 @@ use; for wheels, move the Streamlit app under `src/` later.
 from __future__ import annotations
 
 from pathlib import Path
+import os
 import sys
 import subprocess
 import argparse
 
 from .config import Config
-from .ingest import ingest_dir
-from .generate import answer
 
 __all__ = [
     "build_index_cli",
     "ask_cli",
     "serve_cli",
     "ui_cli",
+    "export_cli",
+    "import_cli",
 ]
 
 
+def __getattr__(name: str):
+    # `ingest_dir` and `answer` pull in chromadb, the embedding model and PyMuPDF;
+    # import them on first use so `import rag_simple` (and every CLI) starts fast
+    if name == "ingest_dir":
+        from .ingest import ingest_dir
+        return ingest_dir
+    if name == "answer":
+        from .generate import answer
+        return answer
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 def _repo_root_from_pkg() -> Path | None:
     """Best-effort: find the project root (where `app/streamlit_app.py` lives)
     when installed in editable mode with a `src/` layout. Returns None if not found.
@@ -44,17 +57,61 @@ def _repo_root_from_pkg() -> Path | None:
 
 
 def build_index_cli() -> None:
+    cfg = Config()
     p = argparse.ArgumentParser(description="Ingest documents into Chroma")
-    p.add_argument("--docs", default="./docs")
+    p.add_argument("--docs", default=cfg.docs_dir)
+    p.add_argument("--workers", type=int, default=None,
+                   help="Extraction worker processes (>1 enables the pipelined ingest)")
+    p.add_argument("--rebuild-shard", metavar="SHARD",
+                   help="Drop and re-ingest one shard only (requires RAG_SHARD_BY)")
+    p.add_argument("--watch", action="store_true",
+                   help="Keep running and index files as they are added, changed or removed")
+    p.add_argument("--poll", action="store_true",
+                   help="With --watch: rescan periodically instead of using inotify (network shares)")
+    p.add_argument("--metrics-port", type=int, default=None,
+                   help="With --watch: serve Prometheus metrics (indexing lag) on this port")
     args = p.parse_args()
-    ingest_dir(Config(), args.docs)
+    if args.rebuild_shard:
+        from .ingest import rebuild_shard
+        rebuild_shard(cfg, args.rebuild_shard, workers=args.workers)
+        return
+    if args.watch:
+        from .watch import watch
+        try:
+            watch(cfg, args.docs, workers=args.workers, poll=args.poll, metrics_port=args.metrics_port)
+        except KeyboardInterrupt:
+            pass
+        return
+    from .ingest import ingest_dir
+    ingest_dir(cfg, args.docs, workers=args.workers)
 
 
 def ask_cli() -> None:
     p = argparse.ArgumentParser(description="Ask a question against the index")
-    p.add_argument("question")
+    p.add_argument("question", nargs="?")
+    p.add_argument("--batch", help="JSONL file of questions to answer in bulk")
+    p.add_argument("--out", default="answers.jsonl", help="JSONL output for --batch (resumable)")
+    p.add_argument("--concurrency", type=int, default=None, help="Parallel generations for --batch")
+    p.add_argument("--server", help="Ask a running rag-serve at this URL instead of loading the index")
     args = p.parse_args()
-    resp = answer(Config(), args.question)
+    if args.batch:
+        if args.server:
+            p.error("--batch runs locally; it cannot be combined with --server")
+        from .batch import run_batch
+        run_batch(Config(), args.batch, args.out, args.concurrency)
+        return
+    if not args.question:
+        p.error("a question (or --batch FILE) is required")
+    if args.server:
+        from .client import ask_remote
+        try:
+            resp = ask_remote(args.server, args.question)
+        except RuntimeError as e:
+            print(str(e), file=sys.stderr)
+            sys.exit(1)
+    else:
+        from .generate import answer
+        resp = answer(Config(), args.question)
     print("\n=== ANSWER ===\n")
     print(resp.get("answer", ""))
     print("\n=== SOURCES ===\n")
@@ -70,27 +127,58 @@ def ask_cli() -> None:
 
 
 def serve_cli() -> None:
-    # Inline FastAPI app to avoid creating new files
+    cfg = Config()
+    p = argparse.ArgumentParser(description="Serve the RAG API")
+    p.add_argument("--host", default=cfg.api_host)
+    p.add_argument("--port", type=int, default=cfg.api_port)
+    p.add_argument("--workers", type=int, default=cfg.api_workers,
+                   help="Worker processes; each keeps its own model and Ollama client resident")
+    p.add_argument("--mode", choices=["async", "sync"], default=cfg.api_mode)
+    args = p.parse_args()
     try:
-        from fastapi import FastAPI, Query
-        from fastapi.responses import JSONResponse
         import uvicorn
+        from .api import create_app
     except Exception:
         print("FastAPI/uvicorn not installed. Install requirements or run `pip install -r requirements.txt`.",
               file=sys.stderr)
         raise
 
-    app = FastAPI(title="Simple Dense RAG API")
+    if args.workers > 1:
+        # workers are fresh processes: they pick the mode up from the environment
+        os.environ["RAG_API_MODE"] = args.mode
+        uvicorn.run("rag_simple.api:create_app", factory=True,
+                    host=args.host, port=args.port, workers=args.workers)
+    else:
+        uvicorn.run(create_app(args.mode), host=args.host, port=args.port)
+
+
+def _snapshot_cli(kind: str) -> None:
+    cfg = Config()
+    if kind == "export":
+        p = argparse.ArgumentParser(description="Export the index (chunks, embeddings, catalog) to a snapshot file")
+        p.add_argument("path", help="Snapshot to write: .parquet, or .arrow / .feather for Arrow IPC")
+    else:
+        p = argparse.ArgumentParser(description="Load a snapshot into an empty collection without re-embedding")
+        p.add_argument("path", help="Snapshot written by rag-export")
+    p.add_argument("--batch-size", type=int, default=cfg.snapshot_batch, help="Chunks per record batch")
+    args = p.parse_args()
+    from . import snapshot
+    run = snapshot.export_snapshot if kind == "export" else snapshot.import_snapshot
+    try:
+        stats = run(cfg, args.path, args.batch_size)
+    except (ValueError, ImportError, OSError) as e:
+        print(str(e), file=sys.stderr)
+        sys.exit(1)
+    print(f"{stats['chunks']} chunks, {stats['documents']} documents ({stats['embed_model']}, "
+          f"dim {stats['dim']}) in {stats['seconds']:.1f}s")
+
 
-    @app.get("/healthz")
-    def health():
-        return {"ok": True}
+def export_cli() -> None:
+    _snapshot_cli("export")
 
-    @app.get("/ask")
-    def ask(q: str = Query(..., description="User question")):
-        return JSONResponse(answer(Config(), q))
 
-    uvicorn.run(app, host="0.0.0.0", port=8080)
+def import_cli() -> None:
+    _snapshot_cli("import")
 
 
 def ui_cli() -> None:
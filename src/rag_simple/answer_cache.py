@@ -0,0 +1,121 @@
+"""Optional in-process answer cache for `generate.answer`.
+
+Two lookups, both scoped to the same index (db_dir, collection, embedding model, top_k),
+the same Ollama model and the same index version:
+
+1. exact: the normalized question was answered before → hit without even retrieving;
+2. semantic: after retrieval, an earlier question that retrieved exactly the same set of
+   chunk ids and whose embedding is within `Config.answer_cache_threshold` (cosine
+   similarity) of this one → hit.
+
+The index version (see `store.index_version`) changes on every ingest that modifies the
+collection and when the index is cleared, which drops all entries for that index.
+"""
+from __future__ import annotations
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+import numpy as np
+
+from .config import Config
+
+
+def normalize_question(q: str) -> str:
+    return " ".join(re.sub(r"[^\w\s]", " ", q.lower()).split())
+
+
+def _scope(cfg: Config) -> Tuple:
+    return (os.path.abspath(cfg.db_dir), cfg.collection, cfg.embed_model, cfg.top_k, cfg.ollama_model)
+
+
+class AnswerCache:
+    def __init__(self, maxsize: int = 512):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        self._exact: Dict[Tuple, int] = {}
+        self._by_ids: Dict[Tuple, List[int]] = {}
+        self._versions: Dict[Tuple, str] = {}
+        self._next = 0
+        self.hits = {"exact": 0, "semantic": 0}
+        self.misses = 0
+        self.invalidations = 0
+
+    def _sync_version(self, scope: Tuple, version: str) -> None:
+        if self._versions.get(scope, version) != version:
+            for eid in [e for e, v in self._entries.items() if v["scope"] == scope]:
+                self._drop(eid)
+            self.invalidations += 1
+        self._versions[scope] = version
+
+    def _drop(self, eid: int) -> None:
+        e = self._entries.pop(eid)
+        self._exact.pop((e["scope"], e["q"]), None)
+        ids_key = (e["scope"], e["ids"])
+        lst = self._by_ids.get(ids_key, [])
+        if eid in lst:
+            lst.remove(eid)
+        if not lst:
+            self._by_ids.pop(ids_key, None)
+
+    def get_exact(self, cfg: Config, version: str, question: str) -> Optional[Dict[str, Any]]:
+        scope = _scope(cfg)
+        with self._lock:
+            self._sync_version(scope, version)
+            eid = self._exact.get((scope, normalize_question(question)))
+            if eid is None:
+                return None
+            self._entries.move_to_end(eid)
+            self.hits["exact"] += 1
+            return self._entries[eid]["resp"]
+
+    def get_similar(self, cfg: Config, version: str, ids: FrozenSet[str], q_emb) -> Optional[Dict[str, Any]]:
+        scope = _scope(cfg)
+        q = np.asarray(q_emb, dtype=np.float32)
+        with self._lock:
+            self._sync_version(scope, version)
+            best, best_sim = None, cfg.answer_cache_threshold
+            for eid in self._by_ids.get((scope, ids), []):
+                sim = float(np.dot(self._entries[eid]["emb"], q))
+                if sim >= best_sim:
+                    best, best_sim = eid, sim
+            if best is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best)
+            self.hits["semantic"] += 1
+            return self._entries[best]["resp"]
+
+    def put(self, cfg: Config, version: str, question: str, ids: FrozenSet[str], q_emb,
+            resp: Dict[str, Any]) -> None:
+        if self.maxsize <= 0:
+            return
+        scope = _scope(cfg)
+        q = normalize_question(question)
+        with self._lock:
+            self._sync_version(scope, version)
+            old = self._exact.get((scope, q))
+            if old is not None:
+                self._drop(old)
+            eid, self._next = self._next, self._next + 1
+            self._entries[eid] = {
+                "scope": scope, "q": q, "ids": ids,
+                "emb": np.asarray(q_emb, dtype=np.float32), "resp": resp,
+            }
+            self._exact[(scope, q)] = eid
+            self._by_ids.setdefault((scope, ids), []).append(eid)
+            while len(self._entries) > self.maxsize:
+                self._drop(next(iter(self._entries)))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": dict(self.hits),
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+            }
@@ -0,0 +1,518 @@
+"""FastAPI app shared by `rag-serve` and `scripts/serve.py`.
+
+`create_app()` builds the async app by default (`Config.api_mode`):
+
+- one `ollama.AsyncClient` per worker, so HTTP connections to Ollama are reused;
+- a generation gate: at most `max_concurrent_generations` Ollama calls run at once and
+  at most `max_queue_depth` requests may wait for a slot; beyond that requests get a
+  429 with Retry-After instead of piling up;
+- a micro-batcher that merges questions arriving within `batch_window_ms` into one
+  embedding pass and one Chroma query.
+
+`api_mode=sync` keeps the original thread-pool handlers. Both apps serve Prometheus
+metrics on `/metrics`, accept `/ask?timings=true` for a per-stage breakdown and serve
+multi-turn chat on `/chat?q=...&session=...` (see `chat.py`). `/ask` and `/chat` take
+`source`, `type`, `page_from`, `page_to` and `tag` filters (see `catalog.py`);
+`/documents` lists the document catalog. `/jobs` queues background ingests (see
+`jobs.py`) that run while questions are being answered.
+"""
+from __future__ import annotations
+import os
+import json
+import time
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import Body, Depends, FastAPI, HTTPException, Query
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+
+from .config import Config
+from .logging_setup import logger
+from . import chat as chats, generate, jobs, metrics
+from .chat import chat, chat_stream, chat_stats
+from .generate import answer, answer_stream, answer_cache_stats
+from .store import warmup, load_stats
+from .retrieve import query_cache_stats, retrieve, retrieve_many
+from .catalog import Filters, list_documents
+
+
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+_SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+_TIMINGS = Query(False, description="Include a per-stage timing breakdown (ms)")
+_SESSION = Query(None, description="Chat session id from an earlier /chat response (new session if omitted)")
+
+
+def _filters(
+    source: Optional[List[str]] = Query(None, description="Only these documents (path, file name or path fragment); repeatable"),
+    type: Optional[List[str]] = Query(None, description="Only these document types: pdf, image, text; repeatable"),
+    page_from: Optional[int] = Query(None, description="Only chunks from this page on"),
+    page_to: Optional[int] = Query(None, description="Only chunks up to this page"),
+    tag: Optional[List[str]] = Query(None, description="Only documents with all these folder tags; repeatable"),
+) -> Optional[Filters]:
+    f = Filters(source or (), type or (), page_from, page_to, tag or ())
+    return None if f.empty() else f
+
+
+_FILTERS = Depends(_filters)
+
+
+def _documents(cfg: Config, type: Optional[List[str]], tag: Optional[List[str]]) -> Dict[str, Any]:
+    docs = list_documents(cfg, type=type or (), tags=tag or ())
+    return {"documents": docs, "count": len(docs)}
+
+
+_PATHS = Body(None, embed=True, description="Files under the docs directory to ingest; omit to sync the whole directory")
+
+
+def _submit_job(cfg: Config, paths: Optional[List[str]]) -> Dict[str, Any]:
+    # the API only ingests from the server's docs directory
+    root = os.path.join(os.path.abspath(cfg.docs_dir), "")
+    bad = [p for p in paths or [] if not os.path.abspath(os.path.join(root, p)).startswith(root)]
+    if bad:
+        raise HTTPException(status_code=400, detail=f"Paths outside the docs directory: {bad}")
+    if paths is not None:
+        paths = [os.path.join(root, p) for p in paths]
+    jid = jobs.submit(cfg, paths)
+    return jobs.store(cfg).get(jid)
+
+
+def _job_routes(app: FastAPI, get_cfg) -> None:
+    """Background ingestion: POST /jobs, GET /jobs, GET /jobs/{id}, POST /jobs/{id}/cancel.
+    Handlers are sync (run in the thread pool) in both app modes: they only touch SQLite."""
+
+    @app.post("/jobs")
+    def submit_job(paths: Optional[List[str]] = _PATHS):
+        """Queue an ingest of `paths` (relative to the docs directory) or of the whole directory."""
+        return _submit_job(get_cfg(), paths)
+
+    @app.get("/jobs")
+    def list_jobs(limit: int = Query(20, ge=1, le=500)):
+        return {"jobs": jobs.store(get_cfg()).list(limit)}
+
+    @app.get("/jobs/{job_id}")
+    def get_job(job_id: str):
+        """Status, per-file progress and throughput of one job."""
+        job = jobs.store(get_cfg()).get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="Unknown job")
+        return job
+
+    @app.post("/jobs/{job_id}/cancel")
+    def cancel_job(job_id: str):
+        status = jobs.store(get_cfg()).cancel(job_id)
+        if status is None:
+            raise HTTPException(status_code=404, detail="Unknown job")
+        return {"id": job_id, "status": status}
+
+
+def _count(route: str, outcome: str, t0: float) -> float:
+    seconds = time.perf_counter() - t0
+    metrics.REQUEST_SECONDS.observe(route, value=seconds)
+    metrics.REQUESTS.inc(route, outcome)
+    return seconds
+
+
+def _finish(cfg: Config, resp: Dict[str, Any], tr: Dict[str, float], t0: float,
+            timings: bool, route: str = "/ask") -> Dict[str, Any]:
+    outcome = "cached" if resp.get("cached") else "answered"
+    seconds = _count(route, outcome, t0)
+    metrics.log_breakdown(f"{route} {outcome} in {seconds * 1000:.1f}ms;", tr, verbose=cfg.log_timings)
+    if timings:
+        resp = {**resp, "timings": {**metrics.breakdown_ms(tr), "total": round(seconds * 1000, 3)}}
+    return resp
+
+
+def _metrics_response() -> PlainTextResponse:
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
+class Overloaded(Exception):
+    pass
+
+
+class GenerationGate:
+    """Bounded concurrency for LLM calls with queue-depth backpressure."""
+
+    def __init__(self, limit: int, max_waiting: int):
+        self._sem = asyncio.Semaphore(max(1, limit))
+        self.limit = max(1, limit)
+        self.max_waiting = max_waiting
+        self.active = 0
+        self.waiting = 0
+        self.rejected = 0
+
+    def check(self) -> None:
+        """Raise `Overloaded` (and count the rejection) if `slot` would reject now;
+        streaming routes call it before their response starts."""
+        if self.active >= self.limit and self.waiting >= self.max_waiting:
+            self.rejected += 1
+            raise Overloaded()
+
+    @asynccontextmanager
+    async def slot(self):
+        self.check()
+        self.waiting += 1
+        t0 = time.perf_counter()
+        try:
+            await self._sem.acquire()
+        finally:
+            self.waiting -= 1
+        metrics.record("generation_wait", time.perf_counter() - t0)
+        self.active += 1
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self._sem.release()
+
+    def stats(self) -> Dict[str, int]:
+        return {"limit": self.limit, "active": self.active, "waiting": self.waiting,
+                "max_waiting": self.max_waiting, "rejected": self.rejected}
+
+
+class MicroBatcher:
+    """Coalesces concurrent `retrieve` calls into one `retrieve_many` (one encode, one
+    Chroma query). A batch is flushed when it is full or `window_ms` after its first
+    question arrived."""
+
+    def __init__(self, cfg: Config, max_batch: int, window_ms: float):
+        self.cfg = cfg
+        self.max_batch = max(1, max_batch)
+        self.window = window_ms / 1000.0
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self.batches = 0
+        self.questions = 0
+
+    async def retrieve(self, question: str) -> List[Dict[str, Any]]:
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._pending.append((question, fut))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await fut
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            asyncio.ensure_future(self._run(batch))
+
+    async def _run(self, batch: List[Tuple[str, asyncio.Future]]) -> None:
+        metrics.detach()  # shared by the batch; each request times its own wait instead
+        self.batches += 1
+        self.questions += len(batch)
+        try:
+            results = await asyncio.to_thread(retrieve_many, self.cfg, [q for q, _ in batch])
+        except Exception as e:
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        for (_, fut), res in zip(batch, results):
+            if not fut.done():
+                fut.set_result(res)
+
+    def stats(self) -> Dict[str, Any]:
+        avg = self.questions / self.batches if self.batches else 0.0
+        return {"batches": self.batches, "questions": self.questions, "avg_batch": round(avg, 2)}
+
+
+def create_sync_app() -> FastAPI:
+    app = FastAPI(title="Simple Dense RAG API")
+
+    @app.on_event("startup")
+    def _warmup():
+        # Keep the Chroma client and embedding model resident before the first /ask
+        warmup(Config())
+        jobs.ensure_worker(Config())
+
+    _job_routes(app, Config)
+
+    @app.get("/healthz")
+    def health():
+        return {"ok": True, "store": load_stats(), "query_cache": query_cache_stats(),
+                "answer_cache": answer_cache_stats(), "chat": chat_stats()}
+
+    @app.get("/metrics")
+    def prometheus():
+        return _metrics_response()
+
+    @app.get("/documents")
+    def documents(type: Optional[List[str]] = Query(None), tag: Optional[List[str]] = Query(None)):
+        """The document catalog, to pick `source`/`type`/`tag` filters from."""
+        return _documents(Config(), type, tag)
+
+    @app.get("/ask")
+    def ask(q: str = Query(..., description="User question"), timings: bool = _TIMINGS,
+            filters: Optional[Filters] = _FILTERS):
+        cfg, t0 = Config(), time.perf_counter()
+        with metrics.trace() as tr:
+            resp = answer(cfg, q, filters)
+        return JSONResponse(_finish(cfg, resp, tr, t0, timings))
+
+    @app.get("/ask/stream")
+    def ask_stream(q: str = Query(..., description="User question"), filters: Optional[Filters] = _FILTERS):
+        """Server-Sent Events: one `sources` event, then `token` events, then `done`."""
+        def events():
+            t0, outcome = time.perf_counter(), "answered"
+            for ev in answer_stream(Config(), q, filters):
+                if ev["type"] == "done" and ev["cached"]:
+                    outcome = "cached"
+                yield _sse(ev["type"], {k: v for k, v in ev.items() if k != "type"})
+            _count("/ask/stream", outcome, t0)
+
+        return StreamingResponse(events(), media_type="text/event-stream", headers=_SSE_HEADERS)
+
+    @app.get("/chat")
+    def chat_turn(q: str = Query(..., description="User message"), session: Optional[str] = _SESSION,
+                  timings: bool = _TIMINGS, filters: Optional[Filters] = _FILTERS):
+        cfg, t0 = Config(), time.perf_counter()
+        with metrics.trace() as tr:
+            resp = chat(cfg, session, q, filters)
+        return JSONResponse(_finish(cfg, resp, tr, t0, timings, route="/chat"))
+
+    @app.get("/chat/stream")
+    def chat_turn_stream(q: str = Query(..., description="User message"), session: Optional[str] = _SESSION,
+                         filters: Optional[Filters] = _FILTERS):
+        """Server-Sent Events as for /ask/stream; the `sources` event carries the session id."""
+        def events():
+            t0 = time.perf_counter()
+            for ev in chat_stream(Config(), session, q, filters):
+                yield _sse(ev["type"], {k: v for k, v in ev.items() if k != "type"})
+            _count("/chat/stream", "answered", t0)
+
+        return StreamingResponse(events(), media_type="text/event-stream", headers=_SSE_HEADERS)
+
+    @app.delete("/chat/{session}")
+    def chat_end(session: str):
+        return {"deleted": chats.sessions(Config()).drop(session)}
+
+    return app
+
+
+def create_async_app(cfg: Optional[Config] = None) -> FastAPI:
+    cfg = cfg or Config()
+    app = FastAPI(title="Simple Dense RAG API")
+    gate = GenerationGate(cfg.max_concurrent_generations, cfg.max_queue_depth)
+    batcher = MicroBatcher(cfg, cfg.max_batch_size, cfg.batch_window_ms)
+    state: Dict[str, Any] = {"client": None}
+
+    @app.on_event("startup")
+    async def _startup():
+        await asyncio.to_thread(warmup, cfg)
+        if generate.ollama is not None:
+            state["client"] = generate.ollama.AsyncClient(host=cfg.ollama_host)
+        jobs.ensure_worker(cfg)
+
+    _job_routes(app, lambda: cfg)
+
+    async def _retrieve(q: str, filters: Optional[Filters]):
+        # only unfiltered questions share a batch: one query has one `where`
+        with metrics.span("retrieve"):
+            if filters is None:
+                return await batcher.retrieve(q)
+            return await asyncio.to_thread(retrieve, cfg, q, filters)
+
+    async def _prepare(q: str, filters: Optional[Filters] = None):
+        done, st = await asyncio.to_thread(generate.lookup, cfg, q, filters)
+        if done is None:
+            snippets = await _retrieve(q, filters)
+            done = await asyncio.to_thread(generate.after_retrieval, q, snippets, st)
+        return done, st
+
+    def _overloaded() -> HTTPException:
+        return HTTPException(status_code=429, detail="Too many requests queued for generation",
+                             headers={"Retry-After": "1"})
+
+    @app.get("/healthz")
+    async def health():
+        return {"ok": True, "store": load_stats(), "query_cache": query_cache_stats(cfg),
+                "answer_cache": answer_cache_stats(cfg), "generation": gate.stats(),
+                "batcher": batcher.stats(), "chat": chat_stats(cfg)}
+
+    @app.get("/metrics")
+    async def prometheus():
+        return _metrics_response()
+
+    @app.get("/documents")
+    async def documents(type: Optional[List[str]] = Query(None), tag: Optional[List[str]] = Query(None)):
+        """The document catalog, to pick `source`/`type`/`tag` filters from."""
+        return await asyncio.to_thread(_documents, cfg, type, tag)
+
+    @app.get("/ask")
+    async def ask(q: str = Query(..., description="User question"), timings: bool = _TIMINGS,
+                  filters: Optional[Filters] = _FILTERS):
+        t0 = time.perf_counter()
+        with metrics.trace() as tr:
+            done, st = await _prepare(q, filters)
+            if done is None:
+                try:
+                    async with gate.slot():
+                        with metrics.span("generate"):
+                            resp = await state["client"].generate(
+                                model=cfg.ollama_model, prompt=st["prompt"], options=st["options"]
+                            )
+                except Overloaded:
+                    _count("/ask", "rejected", t0)
+                    raise _overloaded()
+                metrics.count_tokens(resp)
+                txt = resp.get("response", "")
+                generate.remember(q, st, txt)
+                done = {"answer": txt, "sources": st["snippets"], "cached": False}
+        return JSONResponse(_finish(cfg, done, tr, t0, timings))
+
+    @app.get("/ask/stream")
+    async def ask_stream(q: str = Query(..., description="User question"), filters: Optional[Filters] = _FILTERS):
+        """Server-Sent Events: one `sources` event, then `token` events, then `done`."""
+        t0 = time.perf_counter()
+        done, st = await _prepare(q, filters)
+        if done is not None:
+            async def cached():
+                yield _sse("sources", {"sources": done["sources"]})
+                yield _sse("token", {"text": done["answer"]})
+                yield _sse("done", {"cached": done["cached"]})
+                _count("/ask/stream", "cached" if done["cached"] else "answered", t0)
+            return StreamingResponse(cached(), media_type="text/event-stream", headers=_SSE_HEADERS)
+
+        # reject before the response starts so clients get a proper 429
+        try:
+            gate.check()
+        except Overloaded:
+            _count("/ask/stream", "rejected", t0)
+            raise _overloaded()
+
+        async def events():
+            yield _sse("sources", {"sources": st["snippets"]})
+            parts = []
+            try:
+                async with gate.slot():
+                    t_gen = time.perf_counter()
+                    stream = await state["client"].generate(
+                        model=cfg.ollama_model, prompt=st["prompt"], options=st["options"], stream=True
+                    )
+                    async for chunk in stream:
+                        tok = chunk.get("response", "")
+                        if tok:
+                            if not parts:
+                                metrics.record("first_token", time.perf_counter() - t_gen)
+                            parts.append(tok)
+                            yield _sse("token", {"text": tok})
+                        if chunk.get("done"):
+                            metrics.count_tokens(chunk)
+                    metrics.record("generate", time.perf_counter() - t_gen)
+            except Overloaded:
+                _count("/ask/stream", "rejected", t0)
+                yield _sse("error", {"detail": "Too many requests queued for generation"})
+                return
+            generate.remember(q, st, "".join(parts))
+            yield _sse("done", {"cached": False})
+            _count("/ask/stream", "answered", t0)
+
+        return StreamingResponse(events(), media_type="text/event-stream", headers=_SSE_HEADERS)
+
+    async def _prepare_turn(session: Optional[str], q: str, filters: Optional[Filters]):
+        sess = chats.sessions(cfg).get(session)
+        snippets = await _retrieve(q, filters)
+        done, st = await asyncio.to_thread(chats.prepare_turn, cfg, sess, q, snippets)
+        return sess, done, st
+
+    @app.get("/chat")
+    async def chat_turn(q: str = Query(..., description="User message"), session: Optional[str] = _SESSION,
+                        timings: bool = _TIMINGS, filters: Optional[Filters] = _FILTERS):
+        t0 = time.perf_counter()
+        with metrics.trace() as tr:
+            sess, done, st = await _prepare_turn(session, q, filters)
+            if done is None:
+                try:
+                    async with gate.slot():
+                        with metrics.span("generate"):
+                            resp = await state["client"].chat(
+                                model=cfg.ollama_model, messages=st["messages"], options=st["options"],
+                                keep_alive=cfg.ollama_keep_alive,
+                            )
+                except Overloaded:
+                    _count("/chat", "rejected", t0)
+                    raise _overloaded()
+                metrics.count_tokens(resp)
+                txt = resp["message"]["content"] or ""
+                chats.record_turn(cfg, sess, q, txt)
+                done = {"answer": txt, "sources": st["snippets"], "cached": False, "session": sess.id}
+        return JSONResponse(_finish(cfg, done, tr, t0, timings, route="/chat"))
+
+    @app.get("/chat/stream")
+    async def chat_turn_stream(q: str = Query(..., description="User message"),
+                               session: Optional[str] = _SESSION, filters: Optional[Filters] = _FILTERS):
+        """Server-Sent Events as for /ask/stream; the `sources` event carries the session id."""
+        t0 = time.perf_counter()
+        sess, done, st = await _prepare_turn(session, q, filters)
+        if done is not None:
+            async def fixed():
+                yield _sse("sources", {"sources": done["sources"], "session": sess.id})
+                yield _sse("token", {"text": done["answer"]})
+                yield _sse("done", {"cached": False})
+                _count("/chat/stream", "answered", t0)
+            return StreamingResponse(fixed(), media_type="text/event-stream", headers=_SSE_HEADERS)
+
+        try:
+            gate.check()
+        except Overloaded:
+            _count("/chat/stream", "rejected", t0)
+            raise _overloaded()
+
+        async def events():
+            yield _sse("sources", {"sources": st["snippets"], "session": sess.id})
+            parts = []
+            try:
+                async with gate.slot():
+                    t_gen = time.perf_counter()
+                    stream = await state["client"].chat(
+                        model=cfg.ollama_model, messages=st["messages"], options=st["options"],
+                        keep_alive=cfg.ollama_keep_alive, stream=True,
+                    )
+                    async for chunk in stream:
+                        tok = chunk["message"]["content"] or ""
+                        if tok:
+                            if not parts:
+                                metrics.record("first_token", time.perf_counter() - t_gen)
+                            parts.append(tok)
+                            yield _sse("token", {"text": tok})
+                        if chunk.get("done"):
+                            metrics.count_tokens(chunk)
+                    metrics.record("generate", time.perf_counter() - t_gen)
+            except Overloaded:
+                _count("/chat/stream", "rejected", t0)
+                yield _sse("error", {"detail": "Too many requests queued for generation"})
+                return
+            chats.record_turn(cfg, sess, q, "".join(parts))
+            yield _sse("done", {"cached": False})
+            _count("/chat/stream", "answered", t0)
+
+        return StreamingResponse(events(), media_type="text/event-stream", headers=_SSE_HEADERS)
+
+    @app.delete("/chat/{session}")
+    async def chat_end(session: str):
+        return {"deleted": chats.sessions(cfg).drop(session)}
+
+    logger.info(
+        f"Async API: {gate.limit} concurrent generations, queue depth {gate.max_waiting}, "
+        f"batch window {cfg.batch_window_ms} ms"
+    )
+    return app
+
+
+def create_app(mode: Optional[str] = None) -> FastAPI:
+    """App factory (also used by uvicorn with `factory=True` for multi-worker runs)."""
+    cfg = Config()
+    if (mode or cfg.api_mode) == "sync":
+        return create_sync_app()
+    return create_async_app(cfg)
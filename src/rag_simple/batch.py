@@ -0,0 +1,73 @@
+"""Bulk question answering from a JSONL file (`rag-ask --batch`).
+
+Input lines are {"question": "...", "id": optional}; plain JSON strings are accepted
+too. Each answer is appended to the output JSONL as soon as it finishes, so an
+interrupted run can be resumed: ids already answered in the output are skipped, while
+ids whose last attempt failed are retried (the newer line wins).
+"""
+from __future__ import annotations
+import os
+import json
+import time
+from typing import Any, Dict, List, Optional, Set
+
+from .config import Config
+from .logging_setup import logger
+from .generate import answer_many
+
+
+def _read_questions(path: str) -> List[Dict[str, Any]]:
+    items = []
+    with open(path, "r", encoding="utf-8") as f:
+        for n, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            obj = json.loads(line)
+            if isinstance(obj, str):
+                obj = {"question": obj}
+            obj.setdefault("id", n)
+            items.append(obj)
+    return items
+
+
+def _done_ids(out_path: str) -> Set[str]:
+    """Ids successfully answered in `out_path`; a torn last line is truncated away."""
+    if not os.path.exists(out_path):
+        return set()
+    with open(out_path, "rb+") as f:
+        data = f.read()
+        if data and not data.endswith(b"\n"):
+            cut = data.rfind(b"\n") + 1
+            f.truncate(cut)
+            data = data[:cut]
+    done = set()
+    for line in data.decode("utf-8").splitlines():
+        try:
+            rec = json.loads(line)
+        except Exception:
+            continue
+        if "error" in rec:
+            done.discard(str(rec["id"]))
+        else:
+            done.add(str(rec["id"]))
+    return done
+
+
+def run_batch(cfg: Config, in_path: str, out_path: str, concurrency: Optional[int] = None) -> Dict[str, int]:
+    items = _read_questions(in_path)
+    done = _done_ids(out_path)
+    todo = [it for it in items if str(it["id"]) not in done]
+    logger.info(f"Batch: {len(items)} questions, {len(items) - len(todo)} already answered, {len(todo)} to go")
+
+    t0 = time.perf_counter()
+    errors = 0
+    with open(out_path, "a", encoding="utf-8") as out:
+        for n, (i, resp) in enumerate(answer_many(cfg, [it["question"] for it in todo], concurrency), 1):
+            errors += "error" in resp
+            out.write(json.dumps({**todo[i], **resp}) + "\n")
+            out.flush()
+            if n % 50 == 0:
+                logger.info(f"Batch: {n}/{len(todo)} answered ({n / (time.perf_counter() - t0):.2f} q/s)")
+    logger.info(f"Batch finished: {len(todo)} answered, {errors} errors in {time.perf_counter() - t0:.1f}s")
+    return {"total": len(items), "skipped": len(items) - len(todo), "answered": len(todo), "errors": errors}
@@ -0,0 +1,266 @@
+"""Document catalog and retrieval filters.
+
+Ingest records one catalog row per document (doc id, path, type, pages, tags, chunk
+count) in the manifest database, so the UI and `/documents` can list and scope
+documents without scanning chunk metadata.
+
+Chunks refer to their document by the integer ``doc`` id only (plus ``page`` and
+``chunk``); the path is looked up in the catalog for the final snippets of a retrieval
+(`attach_sources`), instead of being stored on, and read back from, every chunk.
+`compact_metadata` rewrites collections written with the earlier per-chunk ``source``,
+``type``, ``pages`` and ``char_len`` keys.
+
+Tags are the folder names between the docs directory and the file, lower-cased
+(``docs/2024/Drawings/a.pdf`` → ``2024``, ``drawings``). Each chunk carries them as
+boolean ``tag:<name>`` keys, which every supported Chroma version (and the flat store)
+can filter on.
+
+`Filters` are turned into a ``where`` clause by `build_where` and pushed down into the
+vector search, so `top_k` is filled with matching chunks only.
+"""
+from __future__ import annotations
+import os
+import json
+import itertools
+import sqlite3
+import threading
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from .config import Config
+from .logging_setup import logger
+from .manifest import Manifest, manifest_path
+
+
+TAG_PREFIX = "tag:"
+LEGACY_KEYS = ("source", "type", "pages", "char_len")  # per-chunk keys before doc ids
+META_FORMAT = "doc-id"  # manifest "chunk_meta" once chunk metadata is compact
+DOC_TYPES = {".pdf": "pdf", ".png": "image", ".jpg": "image", ".jpeg": "image", ".tif": "image",
+             ".tiff": "image", ".txt": "text", ".md": "text"}
+
+
+def doc_type(path: str) -> str:
+    return DOC_TYPES.get(os.path.splitext(path)[1].lower(), "")
+
+
+def folder_tags(cfg: Config, root: str, path: str) -> Tuple[str, ...]:
+    """Folders between the docs directory and `path` (relative to `cfg.docs_dir` when the
+    file is inside it, so re-ingesting a subfolder keeps the same tags)."""
+    base = os.path.abspath(cfg.docs_dir)
+    if not os.path.abspath(path).startswith(os.path.join(base, "")):
+        base = os.path.abspath(root)
+    rel = os.path.relpath(os.path.dirname(os.path.abspath(path)), base)
+    if rel == "." or rel.startswith(".."):
+        return ()
+    return tuple(dict.fromkeys(p.lower() for p in rel.split(os.sep) if p))
+
+
+def tag_metadata(tags: Iterable[str]) -> Dict[str, bool]:
+    return {f"{TAG_PREFIX}{t}": True for t in tags}
+
+
+class Filters(NamedTuple):
+    """Retrieval scope; empty fields do not filter. `source` entries are full paths,
+    file names or path fragments, resolved through the catalog."""
+    source: Sequence[str] = ()
+    type: Sequence[str] = ()
+    page_from: Optional[int] = None
+    page_to: Optional[int] = None
+    tags: Sequence[str] = ()
+
+    def empty(self) -> bool:
+        return not (self.source or self.type or self.tags) and self.page_from is None and self.page_to is None
+
+
+def _read_catalog(path: str, read: Callable[[Manifest], Any], default: Any) -> Any:
+    """`read(manifest)` on a read-only connection; `default` if there is no catalog yet."""
+    if not os.path.exists(path):
+        return default
+    m = Manifest(path, readonly=True)
+    try:
+        return read(m)
+    except sqlite3.OperationalError as e:
+        if "no such table" not in str(e):  # a manifest from before the catalog
+            raise
+        return default
+    finally:
+        m.close()
+
+
+def _all_docs(cfg: Config) -> List[Dict[str, Any]]:
+    return _read_catalog(manifest_path(cfg), Manifest.docs, [])
+
+
+def _narrow(docs: List[Dict[str, Any]], type: Sequence[str] = (), tags: Sequence[str] = (),
+            source: Sequence[str] = ()) -> List[Dict[str, Any]]:
+    if type:
+        docs = [d for d in docs if d["type"] in set(type)]
+    if tags:
+        want = {t.lower() for t in tags}
+        docs = [d for d in docs if want <= set(d["tags"])]
+    if source:
+        paths = set(resolve_sources(source, docs))
+        docs = [d for d in docs if d["source"] in paths]
+    return docs
+
+
+def list_documents(cfg: Config, type: Sequence[str] = (), tags: Sequence[str] = (),
+                   source: Sequence[str] = ()) -> List[Dict[str, Any]]:
+    """Catalog rows, optionally narrowed by type, tags (all must match) and source."""
+    return _narrow(_all_docs(cfg), type, tags, source)
+
+
+def resolve_sources(patterns: Sequence[str], docs: List[Dict[str, Any]]) -> List[str]:
+    """Paths of catalog documents matching any pattern: the exact path, the file name or
+    a fragment of the path. Patterns matching nothing are kept as given."""
+    out = []
+    for p in patterns:
+        full = os.path.abspath(p)
+        hits = [d["source"] for d in docs if d["source"] == full]
+        hits = hits or [d["source"] for d in docs if os.path.basename(d["source"]) == p]
+        hits = hits or [d["source"] for d in docs if p in d["source"]]
+        out.extend(hits or [p])
+    return list(dict.fromkeys(out))
+
+
+def build_where(cfg: Config, filters: Optional[Filters]) -> Optional[Dict[str, Any]]:
+    """Chroma ``where`` clause for `filters` (None when nothing is filtered). Source and
+    type select documents in the catalog and become one ``doc`` ``$in`` clause."""
+    if filters is None or filters.empty():
+        return None
+    clauses: List[Dict[str, Any]] = []
+    if filters.source or filters.type:
+        docs = _all_docs(cfg)
+        picked = [d["doc_id"] for d in _narrow(docs, type=filters.type, source=filters.source)]
+        if len(picked) < len(docs) or not docs:
+            clauses.append({"doc": {"$in": picked or [-1]}})  # -1: no document matches
+    if filters.page_from is not None:
+        clauses.append({"page": {"$gte": int(filters.page_from)}})
+    if filters.page_to is not None:
+        clauses.append({"page": {"$lte": int(filters.page_to)}})
+    clauses.extend({f"{TAG_PREFIX}{t.lower()}": True} for t in filters.tags)
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+class DocTable:
+    """In-process doc id -> path map of one collection's catalog.
+
+    Within one catalog an id is never reused for another path, but the catalog itself
+    can be replaced: clearing the index deletes it (ids restart at 1) and a snapshot
+    import writes other id -> path pairs. The map is therefore tied to the index version
+    and the manifest file's identity, and reloaded when either changes or an id is
+    unknown (ingest allocates ids before their chunks are written)."""
+
+    def __init__(self, cfg: Config):
+        self.cfg = cfg
+        self.path = manifest_path(cfg)
+        self._paths: Dict[int, str] = {}
+        self._stamp: Optional[Tuple[Any, ...]] = None
+        self._lock = threading.Lock()
+
+    def _current(self) -> Optional[Tuple[Any, ...]]:
+        from .store import index_version  # imports chromadb
+
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (index_version(self.cfg), st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def sources(self, ids: Iterable[int]) -> Dict[int, Optional[str]]:
+        ids = list(ids)
+        with self._lock:
+            stamp = self._current()
+            if stamp != self._stamp or any(i not in self._paths for i in ids):
+                self._paths = _read_catalog(self.path, Manifest.doc_paths, {})
+                self._stamp = stamp
+            return {i: self._paths.get(i) for i in ids}
+
+
+_TABLES: Dict[str, DocTable] = {}
+_TABLES_LOCK = threading.Lock()
+
+
+def doc_table(cfg: Config) -> DocTable:
+    path = manifest_path(cfg)
+    with _TABLES_LOCK:
+        table = _TABLES.get(path)
+        if table is None:
+            table = _TABLES[path] = DocTable(cfg)
+        return table
+
+
+def attach_sources(cfg: Config, snippets: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Fill in "source" (and the paths of dedup "locations") from the catalog."""
+    ids = {s["doc"] for s in snippets if "doc" in s}
+    ids.update(loc[0] for s in snippets for loc in s.get("locations") or () if isinstance(loc[0], int))
+    if not ids:
+        return snippets
+    paths = doc_table(cfg).sources(ids)
+    for s in snippets:
+        if "doc" in s and "source" not in s:
+            s["source"] = paths.get(s["doc"])
+        if s.get("locations"):
+            s["locations"] = [[paths.get(d, d) if isinstance(d, int) else d, p, c] for d, p, c in s["locations"]]
+    return snippets
+
+
+def compact_meta(meta: Dict[str, Any], doc_of) -> Dict[str, Any]:
+    """Metadata update turning a chunk with per-chunk `source`/`type`/`pages` into the
+    compact form (None removes a key, as in Chroma's update); {} if already compact.
+    `doc_of(path)` returns the document id of a path."""
+    if "source" not in meta:
+        return {}
+    out: Dict[str, Any] = {k: None for k in LEGACY_KEYS if k in meta}
+    out["doc"] = doc_of(meta["source"])
+    if isinstance(meta.get("locations"), str):
+        locs = json.loads(meta["locations"])
+        out["locations"] = json.dumps([[doc_of(src), p, c] for src, p, c in locs])
+    return out
+
+
+def compact_metadata(cfg: Config, col, manifest: Manifest, batch: int = 500) -> int:
+    """Migrate a collection to doc-id chunk metadata in place; returns the number of
+    chunks rewritten. A no-op once the manifest records the compact format."""
+    if manifest.get_meta("chunk_meta") == META_FORMAT:
+        return 0
+    from .dedup import compact_refs
+
+    ids = {}
+
+    def doc_of(path: str) -> int:
+        if path not in ids:
+            ids[path] = manifest.doc_id(path, doc_type(path))
+        return ids[path]
+
+    # every chunk of the collection itself: an index built before the manifest existed
+    # has chunks the manifest knows nothing about. Ids are listed before any update,
+    # since the flat store appends updated rows (paging by offset would skip some); a
+    # sharded collection pages every shard at once, so stop on the first empty page.
+    chunk_ids: List[str] = []
+    for offset in itertools.count(0, batch):
+        page = col.get(limit=batch, offset=offset, include=[])["ids"]
+        if not page:
+            break
+        chunk_ids.extend(page)
+    n = 0
+    for i in range(0, len(chunk_ids), batch):
+        got = col.get(ids=chunk_ids[i:i + batch], include=["metadatas"])
+        todo = [(cid, compact_meta(m or {}, doc_of)) for cid, m in zip(got["ids"], got["metadatas"])]
+        todo = [(cid, m) for cid, m in todo if m]
+        if todo:
+            col.update(ids=[cid for cid, _ in todo], metadatas=[m for _, m in todo])
+            n += len(todo)
+
+    def ref_meta(m: Dict[str, Any]) -> Dict[str, Any]:
+        # duplicate references keep a plain metadata dict: apply the update to it
+        merged = {**m, **compact_meta(m, doc_of)}
+        return {k: v for k, v in merged.items() if v is not None}
+
+    refs = compact_refs(cfg, ref_meta)
+    manifest.set_meta("chunk_meta", META_FORMAT)
+    manifest.commit()
+    if n or refs:
+        logger.info(f"Migrated {n} chunks (and {refs} duplicate references) to doc-id metadata")
+    return n
@@ -0,0 +1,215 @@
+"""Multi-turn chat sessions over Ollama's chat endpoint.
+
+Each turn retrieves for the new question and sends
+
+    [system: SYS_PROMPT, user: q1, assistant: a1, ..., user: context + qN]
+
+The system message never changes and earlier turns are sent exactly as they were
+(question and answer, without the context they were answered from), so a request
+starts with the same tokens as the previous one up to its last user message and
+Ollama reuses its KV cache for that prefix instead of prefilling the conversation
+again. `keep_alive` keeps the model (and that cache) loaded between turns, and
+`num_ctx` is fixed per configuration (`context.chat_num_ctx`) because changing it
+reloads the model.
+
+Earlier turns beyond `Config.chat_history_tokens` (counted with the embedding model's
+tokenizer, so `context.chat_num_ctx` leaves a margin) are dropped oldest first. Sessions
+idle for `Config.chat_idle_s` are evicted, and so are the least recently used ones
+beyond `Config.chat_max_sessions`.
+"""
+from __future__ import annotations
+import time
+import uuid
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from .config import Config
+from .chunker import token_counter
+from .context import MESSAGE_OVERHEAD, build_context, chat_history_budget, chat_num_ctx
+from .catalog import Filters
+from .retrieve import retrieve
+from .generate import SYS_PROMPT
+from .logging_setup import logger
+from . import generate, metrics
+
+
+class Turn(NamedTuple):
+    question: str
+    answer: str
+    tokens: int
+
+
+class ChatSession:
+    def __init__(self, sid: str):
+        self.id = sid
+        self.turns: List[Turn] = []
+        self.last_used = time.monotonic()
+
+    def history_tokens(self) -> int:
+        return sum(t.tokens for t in self.turns)
+
+    def messages(self) -> List[Dict[str, str]]:
+        out = [{"role": "system", "content": SYS_PROMPT}]
+        for t in self.turns:
+            out.append({"role": "user", "content": t.question})
+            out.append({"role": "assistant", "content": t.answer})
+        return out
+
+
+class ChatSessions:
+    """In-process session store: idle sessions expire, the rest are LRU-bounded."""
+
+    def __init__(self, max_sessions: int = 256, idle_s: float = 1800.0):
+        self.max_sessions = max_sessions
+        self.idle_s = idle_s
+        self._lock = threading.Lock()
+        self._sessions: "OrderedDict[str, ChatSession]" = OrderedDict()
+        self.evicted = 0
+
+    def _evict(self, now: float) -> None:
+        # ordered by last use, so idle sessions are at the front
+        while self._sessions:
+            first = next(iter(self._sessions.values()))
+            if now - first.last_used < self.idle_s and len(self._sessions) <= self.max_sessions:
+                break
+            self._sessions.popitem(last=False)
+            self.evicted += 1
+
+    def get(self, sid: Optional[str] = None) -> ChatSession:
+        """The session `sid`, created if unknown (with a new id if `sid` is empty)."""
+        now = time.monotonic()
+        with self._lock:
+            self._evict(now)
+            sess = self._sessions.get(sid) if sid else None
+            if sess is None:
+                sess = ChatSession(sid or uuid.uuid4().hex)
+                self._sessions[sess.id] = sess
+            self._sessions.move_to_end(sess.id)
+            sess.last_used = now
+            self._evict(now)
+            return sess
+
+    def drop(self, sid: str) -> bool:
+        with self._lock:
+            return self._sessions.pop(sid, None) is not None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"sessions": len(self._sessions), "evicted": self.evicted,
+                    "max_sessions": self.max_sessions, "idle_s": self.idle_s}
+
+
+# One store per (chat_max_sessions, chat_idle_s), so each config's limits apply to its
+# own sessions instead of the last caller's to all of them (as `retrieve._query_cache`)
+_STORES: Dict[Tuple[int, float], ChatSessions] = {}
+_STORES_LOCK = threading.Lock()
+
+
+def sessions(cfg: Config) -> ChatSessions:
+    key = (cfg.chat_max_sessions, cfg.chat_idle_s)
+    with _STORES_LOCK:
+        store = _STORES.get(key)
+        if store is None:
+            store = _STORES[key] = ChatSessions(*key)
+        return store
+
+
+def chat_stats(cfg: Optional[Config] = None) -> Dict[str, Any]:
+    return sessions(cfg or Config()).stats()
+
+
+def _user_message(context: str, question: str) -> str:
+    return (
+        f"Context:\n{context}\n\n"
+        f"Question: {question}\n\n"
+        f"Answer concisely, and include citations by quoting the headers where relevant."
+    )
+
+
+def prepare_turn(cfg: Config, sess: ChatSession, question: str,
+                 snippets: List[Dict[str, Any]]) -> Tuple[Optional[Dict[str, Any]], Dict[str, Any]]:
+    """Build the chat request for `question` from retrieved `snippets`.
+
+    Returns (response, state) like `generate.prepare`: `response` is set when no
+    generation is needed; otherwise `state` holds "messages", "options", "snippets".
+    """
+    with metrics.span("make_context"):
+        context = build_context(cfg, snippets)
+    st = {"snippets": snippets, "messages": None, "options": None}
+    if not context.strip():
+        return {"answer": "I don't have enough information in the indexed corpus to answer that.",
+                "sources": [], "cached": False, "session": sess.id}, st
+    if generate.ollama is None:
+        logger.warning("ollama is not installed; returning context-only stub answer")
+        return {"answer": context[:1200] + "\n\n[Install ollama to generate answers]",
+                "sources": snippets, "cached": False, "session": sess.id}, st
+    st["messages"] = sess.messages() + [{"role": "user", "content": _user_message(context, question)}]
+    st["options"] = {"num_ctx": chat_num_ctx(cfg)}
+    return None, st
+
+
+def record_turn(cfg: Config, sess: ChatSession, question: str, txt: str) -> None:
+    """Append a finished turn and drop the oldest ones beyond the history cap."""
+    # the chat LLM's tokenizer is not available locally; see context.CHAT_MARGIN
+    n = sum(token_counter(cfg.embed_model)([question, txt])) + 2 * MESSAGE_OVERHEAD
+    sess.turns.append(Turn(question, txt, n))
+    budget = chat_history_budget(cfg)
+    while sess.turns and sess.history_tokens() > budget:
+        sess.turns.pop(0)
+
+
+def _prepare(cfg: Config, session_id: Optional[str], question: str, filters: Optional[Filters]):
+    sess = sessions(cfg).get(session_id)
+    with metrics.span("retrieve"):
+        snippets = retrieve(cfg, question, filters)
+    done, st = prepare_turn(cfg, sess, question, snippets)
+    return sess, done, st
+
+
+def chat(cfg: Config, session_id: Optional[str], question: str,
+         filters: Optional[Filters] = None) -> Dict[str, Any]:
+    """One chat turn; the response carries the "session" id to send with the next one.
+    `filters` scope this turn's retrieval only."""
+    sess, done, st = _prepare(cfg, session_id, question, filters)
+    if done is not None:
+        return done
+
+    client = generate.ollama.Client(host=cfg.ollama_host)
+    with metrics.span("generate"):
+        resp = client.chat(model=cfg.ollama_model, messages=st["messages"], options=st["options"],
+                           keep_alive=cfg.ollama_keep_alive)
+    metrics.count_tokens(resp)
+    txt = resp["message"]["content"] or ""
+    record_turn(cfg, sess, question, txt)
+    return {"answer": txt, "sources": st["snippets"], "cached": False, "session": sess.id}
+
+
+def chat_stream(cfg: Config, session_id: Optional[str], question: str,
+                filters: Optional[Filters] = None) -> Iterator[Dict[str, Any]]:
+    """Streaming variant of `chat`, with the events of `generate.answer_stream`; the
+    "sources" event also carries the "session" id."""
+    sess, done, st = _prepare(cfg, session_id, question, filters)
+    if done is not None:
+        yield {"type": "sources", "sources": done["sources"], "session": sess.id}
+        yield {"type": "token", "text": done["answer"]}
+        yield {"type": "done", "cached": False}
+        return
+
+    yield {"type": "sources", "sources": st["snippets"], "session": sess.id}
+    client = generate.ollama.Client(host=cfg.ollama_host)
+    parts = []
+    t0 = time.perf_counter()
+    for chunk in client.chat(model=cfg.ollama_model, messages=st["messages"], options=st["options"],
+                             keep_alive=cfg.ollama_keep_alive, stream=True):
+        tok = chunk["message"]["content"] or ""
+        if tok:
+            if not parts:
+                metrics.record("first_token", time.perf_counter() - t0)
+            parts.append(tok)
+            yield {"type": "token", "text": tok}
+        if chunk.get("done"):
+            metrics.count_tokens(chunk)
+    metrics.record("generate", time.perf_counter() - t0)
+    record_turn(cfg, sess, question, "".join(parts))
+    yield {"type": "done", "cached": False}
@@ -1,5 +1,22 @@
+"""Chunking.
+
+Text arrives either as one string (a PDF page, an OCR'd image) or as a stream of
+pieces (large text files, see `text_extractor.iter_text`); both are chunked lazily so
+memory stays bounded by the chunk size, not the document size.
+
+- Character chunks (default): fixed-size windows with overlap, no tokenizer needed.
+- Token chunks (`ChunkSpec.tokenizer` set): sentences are packed up to `size` tokens of
+  the embedding model's tokenizer, preferring to end a chunk on a paragraph break;
+  overlap is whole trailing sentences, so chunks neither overflow the model's window
+  nor waste it.
+"""
 from __future__ import annotations
-from typing import List, Tuple
+import os
+import re
+from functools import lru_cache
+from typing import Callable, Iterable, Iterator, List, NamedTuple, Tuple, Union
+
+from .logging_setup import logger
 
 
 def chunk_text(text: str, chunk_size: int = 1200, overlap: int = 200) -> List[str]:
@@ -23,11 +40,168 @@ def chunk_text(text: str, chunk_size: int = 1200, overlap: int = 200) -> List[st
     return chunks
 
 
-def attach_metadata(chunks: List[str], base_meta: dict) -> List[Tuple[str, dict]]:
-    out = []
+def iter_char_chunks(pieces: Iterable[str], chunk_size: int = 1200, overlap: int = 200) -> Iterator[str]:
+    """`chunk_text` over a stream of pieces (same chunks as on the joined text)."""
+    step = max(1, chunk_size - overlap)
+    buf, pos = "", 0
+    for piece in pieces:
+        buf = buf[pos:] + piece
+        pos = 0
+        # only cut once more text follows the window, as chunk_text does
+        while len(buf) - pos > chunk_size:
+            yield buf[pos:pos + chunk_size]
+            pos += step
+    if buf[pos:]:
+        yield buf[pos:]
+
+
+class ChunkSpec(NamedTuple):
+    """How documents are chunked; `key()` is part of the index identity."""
+    size: int
+    overlap: int
+    tokenizer: str = ""  # model whose tokenizer measures chunks; "" = characters
+
+    def key(self) -> str:
+        if not self.tokenizer:
+            return f"{self.size}:{self.overlap}"
+        return f"tokens:{self.size}:{self.overlap}:{self.tokenizer}"
+
+
+TokenCounter = Callable[[List[str]], List[int]]
+
+
+@lru_cache(maxsize=4)
+def token_counter(model_name: str) -> TokenCounter:
+    """Batch token counter (special tokens excluded) for `model_name`'s fast tokenizer:
+    from a local model directory, the Hugging Face cache, or the Hub. Falls back to an
+    estimate of 4 characters per token if no tokenizer can be loaded."""
+    try:
+        from tokenizers import Tokenizer
+
+        local = os.path.join(model_name, "tokenizer.json")
+        if os.path.isfile(local):
+            tok = Tokenizer.from_file(local)
+        else:
+            try:
+                from huggingface_hub import try_to_load_from_cache
+                cached = try_to_load_from_cache(model_name, "tokenizer.json")
+            except Exception:
+                cached = None
+            tok = Tokenizer.from_file(cached) if isinstance(cached, str) else Tokenizer.from_pretrained(model_name)
+        tok.no_truncation()
+        tok.no_padding()
+    except Exception as e:
+        logger.warning(f"No fast tokenizer for {model_name} ({e}); estimating 4 characters per token")
+        return lambda texts: [max(1, round(len(t) / 4)) for t in texts]
+
+    def count(texts: List[str]) -> List[int]:
+        return [len(enc.ids) for enc in tok.encode_batch(texts, add_special_tokens=False)]
+    return count
+
+
+# sentence ends and paragraph breaks; the separator stays with the preceding sentence
+_BOUNDARY = re.compile(r"(?<=[.!?])\s+|\n\n+")
+_MAX_CARRY = 1 << 16  # chars without any boundary before we cut at whitespace anyway
+
+
+def _split_long(text: str, n: int, max_tokens: int, count: TokenCounter) -> Iterator[Tuple[str, int]]:
+    # Halve an over-long sentence at the whitespace nearest its middle until it fits
+    if n <= max_tokens or len(text) < 2:
+        yield text, n
+        return
+    mid = len(text) // 2
+    cut = max(text.rfind(" ", 0, mid), text.rfind("\n", 0, mid)) + 1
+    if cut <= 0:
+        cut = text.find(" ", mid) + 1 or mid
+    halves = [text[:cut], text[cut:]]
+    for half, k in zip(halves, count(halves)):
+        yield from _split_long(half, k, max_tokens, count)
+
+
+def _sentences(pieces: Iterable[str], count: TokenCounter, max_tokens: int) -> Iterator[Tuple[str, int, bool]]:
+    """Yield (sentence, tokens, ends_paragraph), each at most `max_tokens` long."""
+    def counted(parts: List[Tuple[str, bool]]):
+        parts = [(t, p) for t, p in parts if t.strip()]
+        if not parts:
+            return
+        for (text, para), n in zip(parts, count([t for t, _ in parts])):
+            split = list(_split_long(text, n, max_tokens, count))
+            for i, (t, k) in enumerate(split):
+                yield t, k, para and i == len(split) - 1
+
+    carry = ""
+    for piece in pieces:
+        carry += piece
+        parts, start = [], 0
+        for m in _BOUNDARY.finditer(carry):
+            parts.append((carry[start:m.end()], "\n\n" in m.group()))
+            start = m.end()
+        carry = carry[start:]
+        if len(carry) > _MAX_CARRY:
+            cut = carry.rfind(" ") + 1 or len(carry)
+            parts.append((carry[:cut], False))
+            carry = carry[cut:]
+        yield from counted(parts)
+    yield from counted([(carry, True)])
+
+
+def iter_token_chunks(pieces: Iterable[str], max_tokens: int, overlap_tokens: int,
+                      count: TokenCounter) -> Iterator[Tuple[str, int]]:
+    """Yield (chunk, tokens): sentences packed up to `max_tokens`. A chunk ends on the
+    last paragraph break if that keeps it at least half full; otherwise it is cut
+    between sentences and the next one repeats up to `overlap_tokens` of trailing
+    sentences."""
+    window: List[Tuple[str, int, bool]] = []
+    total = fresh = 0  # tokens in window; sentences not yet emitted
+
+    def emit(segs):
+        return "".join(s[0] for s in segs).strip(), sum(s[1] for s in segs)
+
+    for seg in _sentences(pieces, count, max_tokens):
+        while window and total + seg[1] > max_tokens:
+            if not fresh:  # only overlap left: it cannot share a chunk with `seg`
+                window, total = [], 0
+                break
+            cut, acc = len(window), 0
+            for i, (_, k, para) in enumerate(window[:-1]):
+                acc += k
+                if para and acc >= max_tokens // 2 and i + 1 > len(window) - fresh:
+                    cut = i + 1
+            yield emit(window[:cut])
+            rest = window[cut:]
+            overlap: List[Tuple[str, int, bool]] = []
+            if not window[cut - 1][2]:
+                acc = 0
+                for s in reversed(window[:cut]):
+                    if acc + s[1] > overlap_tokens:
+                        break
+                    overlap.insert(0, s)
+                    acc += s[1]
+            window, fresh = overlap + rest, len(rest)
+            total = sum(s[1] for s in window)
+        window.append(seg)
+        total += seg[1]
+        fresh += 1
+    if fresh:
+        yield emit(window)
+
+
+def iter_chunks(pieces: Iterable[str], spec: ChunkSpec) -> Iterator[Union[str, Tuple[str, int]]]:
+    """Chunk a text stream per `spec`: plain strings for character chunks,
+    (chunk, tokens) for token chunks."""
+    if not spec.tokenizer:
+        # character chunks keep the historical text: no blank lines between paragraphs
+        return iter_char_chunks((p.replace("\n\n", "\n") for p in pieces), spec.size, spec.overlap)
+    return iter_token_chunks(pieces, spec.size, spec.overlap, token_counter(spec.tokenizer))
+
+
+def attach_metadata(chunks: Iterable[Union[str, Tuple[str, int]]], base_meta: dict) -> Iterator[Tuple[str, dict]]:
     for i, ch in enumerate(chunks):
+        tokens = None
+        if isinstance(ch, tuple):
+            ch, tokens = ch
         meta = dict(base_meta)
         meta["chunk"] = i + 1
-        meta["char_len"] = len(ch)
-        out.append((ch, meta))
-    return out
\ No newline at end of file
+        if tokens is not None:
+            meta["tokens"] = tokens
+        yield ch, meta
@@ -0,0 +1,25 @@
+"""Minimal client for a running `rag-serve`, so `rag-ask --server URL` can answer
+without importing chromadb, the embedding model or PyMuPDF. Standard library only."""
+from __future__ import annotations
+import json
+import urllib.error
+import urllib.parse
+import urllib.request
+from typing import Any, Dict
+
+
+def ask_remote(server: str, question: str, timeout: float = 600.0) -> Dict[str, Any]:
+    """GET `{server}/ask?q=...` and return the decoded JSON answer.
+
+    Raises RuntimeError with the server's message on HTTP errors (e.g. 429 when the
+    server's generation queue is full) or when the server cannot be reached.
+    """
+    url = f"{server.rstrip('/')}/ask?{urllib.parse.urlencode({'q': question})}"
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as r:
+            return json.loads(r.read().decode("utf-8"))
+    except urllib.error.HTTPError as e:
+        detail = e.read().decode("utf-8", errors="replace")
+        raise RuntimeError(f"{server} answered {e.code}: {detail}") from e
+    except urllib.error.URLError as e:
+        raise RuntimeError(f"Could not reach {server}: {e.reason}") from e
@@ -4,13 +4,94 @@ from dataclasses import dataclass
 @dataclass
 class Config:
     embed_model: str = os.getenv("RAG_EMBED_MODEL", "BAAI/bge-small-en-v1.5")
+    embed_backend: str = os.getenv("RAG_EMBED_BACKEND", "torch")  # torch | onnx | onnx-int8
+    onnx_dir: str = os.getenv("RAG_ONNX_DIR", "./models/onnx")
+    embed_parity_min: float = float(os.getenv("RAG_EMBED_PARITY_MIN", "0.99"))
     collection: str = os.getenv("RAG_COLLECTION", "company_docs")
     db_dir: str = os.getenv("RAG_DB_DIR", "./vectorstore")
+    # Vector store: chroma (HNSW + SQLite) or flat (memory-mapped, exact search)
+    vector_backend: str = os.getenv("RAG_VECTOR_BACKEND", "chroma")  # chroma | flat
+    flat_dtype: str = os.getenv("RAG_FLAT_DTYPE", "int8")  # int8 | float16
+    flat_rescore: int = int(os.getenv("RAG_FLAT_RESCORE", "4"))  # int8 candidates per result rescored
+    # Sharding: "" (one collection), "hash" (of the source path) or "folder" (top-level
+    # subfolder of docs_dir); queries fan out over shard_workers threads
+    docs_dir: str = os.getenv("RAG_DOCS_DIR", "./docs")
+    shard_by: str = os.getenv("RAG_SHARD_BY", "")
+    shards: int = int(os.getenv("RAG_SHARDS", "4"))  # hash mode only
+    shard_workers: int = int(os.getenv("RAG_SHARD_WORKERS", "8"))
     chunk_size: int = int(os.getenv("RAG_CHUNK_SIZE", "1200"))
     chunk_overlap: int = int(os.getenv("RAG_CHUNK_OVERLAP", "200"))
+    # >0: chunks of up to this many embed_model tokens, cut on sentence/paragraph
+    # boundaries (keep below the model's window, e.g. 480 for 512) instead of characters
+    chunk_tokens: int = int(os.getenv("RAG_CHUNK_TOKENS", "0"))
+    chunk_overlap_tokens: int = int(os.getenv("RAG_CHUNK_OVERLAP_TOKENS", "48"))
+    # Near-duplicate chunks (SimHash within dedup_distance of 64 bits) are embedded and
+    # stored once, with every location they occur at in the canonical chunk's metadata
+    dedup: bool = os.getenv("RAG_DEDUP", "0") == "1"
+    dedup_distance: int = int(os.getenv("RAG_DEDUP_DISTANCE", "3"))
     top_k: int = int(os.getenv("RAG_TOP_K", "8"))
+    query_cache_size: int = int(os.getenv("RAG_QUERY_CACHE_SIZE", "1024"))  # 0 disables
+    query_cache_ttl: float = float(os.getenv("RAG_QUERY_CACHE_TTL", "3600"))  # seconds
 
     ollama_host: str = os.getenv("OLLAMA_HOST", "http://localhost:11434")
     ollama_model: str = os.getenv("OLLAMA_MODEL", "llama3.1:8b")
+    # Prompt context: merged adjacent chunks packed up to context_tokens; num_ctx is sized
+    # to the prompt + answer_tokens, capped at num_ctx_max. 0 = 6000 chars, num_ctx_max
+    context_tokens: int = int(os.getenv("RAG_CONTEXT_TOKENS", "1200"))
+    answer_tokens: int = int(os.getenv("RAG_ANSWER_TOKENS", "512"))
+    num_ctx_max: int = int(os.getenv("RAG_NUM_CTX_MAX", "8192"))
+    # Chat sessions (/chat): earlier turns are kept up to chat_history_tokens, the model
+    # stays loaded for ollama_keep_alive; idle or least recently used sessions are evicted
+    ollama_keep_alive: str = os.getenv("RAG_OLLAMA_KEEP_ALIVE", "30m")
+    chat_history_tokens: int = int(os.getenv("RAG_CHAT_HISTORY_TOKENS", "1536"))
+    chat_idle_s: float = float(os.getenv("RAG_CHAT_IDLE_S", "1800"))
+    chat_max_sessions: int = int(os.getenv("RAG_CHAT_MAX_SESSIONS", "256"))
+
+    # API server: async mode shares one Ollama client, caps concurrent generations
+    # (429 once too many requests are waiting) and micro-batches retrieval
+    api_host: str = os.getenv("RAG_API_HOST", "0.0.0.0")
+    api_port: int = int(os.getenv("RAG_API_PORT", "8080"))
+    api_workers: int = int(os.getenv("RAG_API_WORKERS", "1"))
+    api_mode: str = os.getenv("RAG_API_MODE", "async")  # async | sync
+    max_concurrent_generations: int = int(os.getenv("RAG_MAX_CONCURRENT_GENERATIONS", "4"))
+    max_queue_depth: int = int(os.getenv("RAG_MAX_QUEUE_DEPTH", "32"))
+    batch_window_ms: float = float(os.getenv("RAG_BATCH_WINDOW_MS", "5"))
+    max_batch_size: int = int(os.getenv("RAG_MAX_BATCH_SIZE", "32"))
+    # log each /ask's per-stage timing breakdown at INFO (DEBUG otherwise)
+    log_timings: bool = os.getenv("RAG_LOG_TIMINGS", "0") == "1"
+
+    # Optional answer cache: exact normalized question, then nearest cached question
+    # (cosine >= threshold) among entries that retrieved the same chunk ids
+    answer_cache: bool = os.getenv("RAG_ANSWER_CACHE", "0") == "1"
+    answer_cache_size: int = int(os.getenv("RAG_ANSWER_CACHE_SIZE", "512"))
+    answer_cache_threshold: float = float(os.getenv("RAG_ANSWER_CACHE_THRESHOLD", "0.95"))
+
+    # Ingest pipeline: >1 workers enables the parallel extract → embed → write pipeline
+    ingest_workers: int = int(os.getenv("RAG_INGEST_WORKERS", "1"))
+    ingest_queue_size: int = int(os.getenv("RAG_INGEST_QUEUE_SIZE", "8"))
+    pdf_shard_pages: int = int(os.getenv("RAG_PDF_SHARD_PAGES", "50"))
+
+    # Watch mode (rag-build --watch): a changed file is indexed once it has been quiet for
+    # watch_debounce_s, or at the latest watch_max_delay_s after its first change; without
+    # inotify (or with --poll) the docs directory is rescanned every watch_poll_s
+    watch_debounce_s: float = float(os.getenv("RAG_WATCH_DEBOUNCE_S", "1.0"))
+    watch_max_delay_s: float = float(os.getenv("RAG_WATCH_MAX_DELAY_S", "30"))
+    watch_poll_s: float = float(os.getenv("RAG_WATCH_POLL_S", "2.0"))
+
+    # Index snapshots (rag-export / rag-import): chunks per record batch (Parquet row group)
+    snapshot_batch: int = int(os.getenv("RAG_SNAPSHOT_BATCH", "1000"))
+
+    # Persistent embedding cache (outside db_dir so it survives clearing the index); 0 disables
+    embed_cache_dir: str = os.getenv("RAG_EMBED_CACHE_DIR", "./cache")
+    embed_cache_max_mb: int = int(os.getenv("RAG_EMBED_CACHE_MAX_MB", "2048"))
+
+    # OCR: result cache, adaptive DPI (low first, high only if confidence is low), pool
+    ocr_cache_dir: str = os.getenv("RAG_OCR_CACHE_DIR", "./cache")
+    ocr_lang: str = os.getenv("RAG_OCR_LANG", "eng")
+    ocr_dpi_low: int = int(os.getenv("RAG_OCR_DPI_LOW", "100"))
+    ocr_dpi_high: int = int(os.getenv("RAG_OCR_DPI_HIGH", "300"))
+    ocr_min_conf: float = float(os.getenv("RAG_OCR_MIN_CONF", "70"))
+    ocr_workers: int = int(os.getenv("RAG_OCR_WORKERS", "2"))
+    ocr_timeout: float = float(os.getenv("RAG_OCR_TIMEOUT", "60"))
 
     # Add more knobs if needed later
\ No newline at end of file
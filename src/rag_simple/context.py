@@ -0,0 +1,143 @@
+"""Prompt context packing (``Config.context_tokens > 0``).
+
+`pack_context` turns retrieved snippets into the context block of the prompt:
+
+- consecutive chunks of one source and page (chunk n, n+1, ...) become one block, and
+  the text neighbouring chunks share through chunk overlap is kept once;
+- blocks go in best-ranked first while they fit `Config.context_tokens`, counted with
+  the embedding model's tokenizer (`chunker.token_counter`); the block that crosses
+  the budget is cut to fit;
+
+and `num_ctx` sizes Ollama's context window to the prompt plus `Config.answer_tokens`,
+rounded up to a power of two (at least 2048, at most `Config.num_ctx_max`) so that
+Ollama does not reload the model for every new prompt length.
+
+With ``context_tokens = 0`` the previous behaviour is kept: `retrieve.make_context`
+(6000 characters) and a fixed `num_ctx_max`.
+"""
+from __future__ import annotations
+from typing import Any, Dict, List, Tuple
+
+from .config import Config
+from .chunker import token_counter
+from .retrieve import make_context
+
+
+MIN_OVERLAP = 32  # shorter common text between neighbours is not treated as overlap
+MIN_NUM_CTX = 2048
+MIN_TAIL_TOKENS = 64  # a block crossing the budget is cut only if this much room is left
+PROMPT_OVERHEAD = 128  # system prompt, instructions and question around the context
+# the LLM's tokenizer is not available locally; counts from the embedding model's
+# tokenizer get this much headroom when sizing num_ctx
+CTX_MARGIN = 1.1
+# chat history is re-sent every turn, so the drift between the two tokenizers adds up
+# over the whole conversation, and each message is wrapped in the chat template's role
+# tokens; undercounting would make Ollama cut the front of the conversation (and with it
+# the cached prefix), so chat sizing keeps a wider margin and charges every message
+CHAT_MARGIN = 1.25
+MESSAGE_OVERHEAD = 8
+
+
+def _overlap(a: str, b: str) -> int:
+    """Length of the longest suffix of `a` that is also a prefix of `b`."""
+    probe = b[:MIN_OVERLAP]
+    if len(probe) < MIN_OVERLAP:
+        return 0
+    p = a.find(probe, max(0, len(a) - len(b)))
+    while p != -1:
+        if b.startswith(a[p:]):
+            return len(a) - p
+        p = a.find(probe, p + 1)
+    return 0
+
+
+def merge_adjacent(snippets: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Merge runs of consecutive chunks of the same source and page. Blocks keep the
+    rank of their best snippet: {"source", "page", "chunks": (first, last), "text"}."""
+    groups: Dict[Tuple[Any, Any], List[Tuple[int, Dict[str, Any]]]] = {}
+    for rank, s in enumerate(snippets):
+        groups.setdefault((s.get("source"), s.get("page")), []).append((rank, s))
+    blocks = []
+    for (source, page), items in groups.items():
+        items.sort(key=lambda x: (x[1].get("chunk") is None, x[1].get("chunk") or 0))
+        run = None
+        for rank, s in items:
+            c = s.get("chunk")
+            text = s.get("text") or ""
+            if run is not None and c is not None and run["chunks"][1] is not None and c == run["chunks"][1] + 1:
+                k = _overlap(run["text"], text)
+                run["text"] += text[k:] if k else "\n" + text
+                run["chunks"] = (run["chunks"][0], c)
+                run["rank"] = min(run["rank"], rank)
+                continue
+            run = {"source": source, "page": page, "chunks": (c, c), "text": text, "rank": rank}
+            blocks.append(run)
+    blocks.sort(key=lambda b: b["rank"])
+    return blocks
+
+
+def _block(b: Dict[str, Any], text: str) -> str:
+    first, last = b["chunks"]
+    chunk = first if first == last else f"{first}-{last}"
+    page = b["page"] if b["page"] is not None else ""
+    return f"[source: {b['source']} page:{page} chunk:{chunk}]\n{text.strip()}\n\n"
+
+
+def pack_context(cfg: Config, snippets: List[Dict[str, Any]]) -> str:
+    blocks = merge_adjacent(snippets)
+    if not blocks:
+        return ""
+    count = token_counter(cfg.embed_model)
+    parts = [_block(b, b["text"]) for b in blocks]
+    out, used = [], 0
+    for b, part, n in zip(blocks, parts, count(parts)):
+        left = cfg.context_tokens - used
+        if n > left:
+            if left >= MIN_TAIL_TOKENS:
+                # keep the head of the block that crosses the budget
+                cut = b["text"][: int(len(b["text"]) * left / n)]
+                cut = cut[: cut.rfind(" ")] if " " in cut else cut
+                out.append(_block(b, cut))
+            break
+        out.append(part)
+        used += n
+    return "".join(out)
+
+
+def _round_ctx(cfg: Config, prompt_tokens: int, margin: float = CTX_MARGIN) -> int:
+    need = int(prompt_tokens * margin) + cfg.answer_tokens
+    n = MIN_NUM_CTX
+    while n < need and n < cfg.num_ctx_max:
+        n *= 2
+    return min(n, cfg.num_ctx_max)
+
+
+def num_ctx(cfg: Config, prompt: str) -> int:
+    if cfg.context_tokens <= 0:
+        return cfg.num_ctx_max
+    return _round_ctx(cfg, token_counter(cfg.embed_model)([prompt])[0])
+
+
+def chat_history_budget(cfg: Config) -> int:
+    """Tokens of earlier turns a chat session keeps: `Config.chat_history_tokens`, lowered
+    if that much history plus one context block and the answer would not fit in
+    `Config.num_ctx_max` with the chat margin."""
+    if cfg.context_tokens <= 0:
+        return cfg.chat_history_tokens
+    room = int((cfg.num_ctx_max - cfg.answer_tokens) / CHAT_MARGIN) - cfg.context_tokens - PROMPT_OVERHEAD
+    return max(0, min(cfg.chat_history_tokens, room))
+
+
+def chat_num_ctx(cfg: Config) -> int:
+    """num_ctx for chat sessions: fixed per configuration (history budget + one context
+    block + answer), since a different value on a later turn reloads the model."""
+    if cfg.context_tokens <= 0:
+        return cfg.num_ctx_max
+    prompt = chat_history_budget(cfg) + cfg.context_tokens + PROMPT_OVERHEAD
+    return _round_ctx(cfg, prompt, CHAT_MARGIN)
+
+
+def build_context(cfg: Config, snippets: List[Dict[str, Any]]) -> str:
+    if cfg.context_tokens <= 0:
+        return make_context(snippets)
+    return pack_context(cfg, snippets)
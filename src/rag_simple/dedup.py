@@ -0,0 +1,350 @@
+"""Near-duplicate chunk detection at ingest time (``Config.dedup``).
+
+Each chunk gets a 64-bit SimHash of its word 3-shingles. A chunk within
+`Config.dedup_distance` bits of an indexed chunk is a near-duplicate: it is neither
+embedded nor stored. The first copy seen stays the canonical chunk and lists every
+place the text occurs in its metadata (``locations``: JSON list of
+``[doc id, page, chunk]``, its own first, resolved to paths at retrieval;
+``duplicates``: how many were skipped).
+
+Signatures and duplicate → canonical references persist in
+``{db_dir}/{collection}.dedup.sqlite`` (next to the manifest, so "Clear index" resets
+both). Candidates are found by exact match on one of ``distance + 1`` bit bands, which
+by pigeonhole finds every signature within ``distance`` bits.
+
+When chunks disappear (their file changed or was removed), `Deduper.forget` drops their
+references; a canonical chunk that still has duplicates is re-stored under one of them,
+so the text stays searchable from the remaining locations.
+"""
+from __future__ import annotations
+import os
+import re
+import json
+import sqlite3
+import hashlib
+import threading
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from .config import Config
+from .logging_setup import logger
+
+
+_WORD = re.compile(r"\w+")
+SHINGLE = 3
+
+
+def dedup_path(cfg: Config) -> str:
+    return os.path.join(cfg.db_dir, f"{cfg.collection}.dedup.sqlite")
+
+
+def simhash(text: str) -> Optional[int]:
+    words = _WORD.findall(text.lower())
+    if not words:
+        return None
+    grams = [" ".join(words[i:i + SHINGLE]) for i in range(max(1, len(words) - SHINGLE + 1))]
+    digests = b"".join(hashlib.blake2b(g.encode("utf-8"), digest_size=8).digest() for g in grams)
+    bits = np.unpackbits(np.frombuffer(digests, dtype=np.uint8).reshape(-1, 8), axis=1)
+    return int.from_bytes(np.packbits(bits.sum(axis=0) * 2 > len(grams)).tobytes(), "big")
+
+
+def _i64(x: int) -> int:
+    # sqlite integers are signed
+    return x - (1 << 64) if x >= 1 << 63 else x
+
+
+def _u64(x: int) -> int:
+    return x + (1 << 64) if x < 0 else x
+
+
+def _location(meta: Dict[str, Any]) -> list:
+    # [doc id, page, chunk]; `catalog.attach_sources` turns the doc id into its path
+    return [meta.get("doc"), meta.get("page"), meta.get("chunk")]
+
+
+class SignatureIndex:
+    """SimHash signatures of canonical chunks and references of skipped duplicates."""
+
+    def __init__(self, path: str, distance: int):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.distance = max(0, distance)
+        edges = [round(i * 64 / (self.distance + 1)) for i in range(self.distance + 2)]
+        self._bands = [(lo, (1 << (hi - lo)) - 1) for lo, hi in zip(edges, edges[1:])]
+        self._lock = threading.RLock()  # shared by the embed and write stages
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(
+            "CREATE TABLE IF NOT EXISTS sigs (id TEXT PRIMARY KEY, sig INTEGER);"
+            "CREATE TABLE IF NOT EXISTS bands (band INTEGER, key INTEGER, id TEXT);"
+            "CREATE INDEX IF NOT EXISTS bands_key ON bands (band, key);"
+            "CREATE INDEX IF NOT EXISTS bands_id ON bands (id);"
+            "CREATE TABLE IF NOT EXISTS refs (id TEXT PRIMARY KEY, canon TEXT, meta TEXT);"
+            "CREATE INDEX IF NOT EXISTS refs_canon ON refs (canon);"
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);"
+        )
+        row = self._db.execute("SELECT value FROM meta WHERE key = 'distance'").fetchone()
+        if row is None or int(row[0]) != self.distance:
+            self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._db.executescript("DELETE FROM sigs; DELETE FROM bands; DELETE FROM refs;")
+            self._db.execute("INSERT OR REPLACE INTO meta VALUES ('distance', ?)", (str(self.distance),))
+            self._db.commit()
+
+    def _keys(self, sig: int) -> List[Tuple[int, int]]:
+        return [(b, (sig >> lo) & mask) for b, (lo, mask) in enumerate(self._bands)]
+
+    def nearest(self, sig: int) -> Optional[str]:
+        """Closest canonical chunk within `distance` bits, if any."""
+        keys = self._keys(sig)
+        cond = " OR ".join("(b.band = ? AND b.key = ?)" for _ in keys)
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT DISTINCT s.id, s.sig FROM bands b JOIN sigs s ON s.id = b.id WHERE {cond}",
+                [v for k in keys for v in k],
+            ).fetchall()
+        best, best_d = None, self.distance + 1
+        for cid, other in rows:
+            d = bin(sig ^ _u64(other)).count("1")
+            if d < best_d:
+                best, best_d = cid, d
+        return best
+
+    def sig(self, cid: str) -> Optional[int]:
+        with self._lock:
+            row = self._db.execute("SELECT sig FROM sigs WHERE id = ?", (cid,)).fetchone()
+        return _u64(row[0]) if row else None
+
+    def add(self, cid: str, sig: int) -> None:
+        with self._lock:
+            self.drop(cid)
+            self._db.execute("INSERT INTO sigs VALUES (?, ?)", (cid, _i64(sig)))
+            self._db.executemany("INSERT INTO bands VALUES (?, ?, ?)", [(b, k, cid) for b, k in self._keys(sig)])
+
+    def drop(self, cid: str) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM sigs WHERE id = ?", (cid,))
+            self._db.execute("DELETE FROM bands WHERE id = ?", (cid,))
+
+    def ref(self, cid: str) -> Optional[str]:
+        with self._lock:
+            row = self._db.execute("SELECT canon FROM refs WHERE id = ?", (cid,)).fetchone()
+        return row[0] if row else None
+
+    def refs(self, canon: str) -> List[Tuple[str, Dict[str, Any]]]:
+        with self._lock:
+            rows = self._db.execute("SELECT id, meta FROM refs WHERE canon = ? ORDER BY id", (canon,)).fetchall()
+        return [(cid, json.loads(meta)) for cid, meta in rows]
+
+    def set_ref(self, cid: str, canon: str, meta: Dict[str, Any]) -> None:
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO refs VALUES (?, ?, ?)", (cid, canon, json.dumps(meta)))
+
+    def unref(self, cid: str) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM refs WHERE id = ?", (cid,))
+
+    def retarget(self, old: str, new: str) -> None:
+        with self._lock:
+            self._db.execute("UPDATE refs SET canon = ? WHERE canon = ?", (new, old))
+
+    def commit(self) -> None:
+        with self._lock:
+            self._db.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.commit()
+            self._db.close()
+
+
+class Pending(NamedTuple):
+    """Collection changes decided by `Deduper.filter`, applied around the batch write."""
+    promote: List[Tuple[str, str, Dict[str, Any]]]  # (old canonical, duplicate taking over, its meta), before
+    delete: List[str]  # chunk ids that became duplicates and may still be stored, before
+    refresh: Set[str]  # canonical ids whose `locations` changed, after
+
+
+class Deduper:
+    def __init__(self, cfg: Config, embed):
+        self.index = SignatureIndex(dedup_path(cfg), cfg.dedup_distance)
+        self.embed = embed  # only used to re-store a canonical chunk under a duplicate
+        self.skipped = 0
+        self.skipped_chars = 0
+
+    def _locations(self, cid: str, meta: Dict[str, Any]) -> Dict[str, Any]:
+        refs = self.index.refs(cid)
+        if not refs:
+            return {"locations": None, "duplicates": None}  # None clears the keys
+        locs = [_location(meta)] + [_location(m) for _, m in refs]
+        return {"locations": json.dumps(locs), "duplicates": len(refs)}
+
+    def _rehome(self, canon: str) -> Optional[Tuple[str, str, Dict[str, Any]]]:
+        # Make the first duplicate of `canon` the new canonical chunk (index side)
+        sig = self.index.sig(canon)
+        self.index.drop(canon)
+        refs = self.index.refs(canon)
+        if not refs:
+            return None
+        new, meta = refs[0]
+        self.index.unref(new)
+        self.index.retarget(canon, new)
+        if sig is not None:
+            self.index.add(new, sig)
+        return canon, new, meta
+
+    def filter(self, ids: List[str], docs: List[str], metas: List[Dict[str, Any]]
+               ) -> Tuple[List[int], Pending]:
+        """Positions of the batch rows to embed and store (canonical metadata filled
+        in) and the changes to apply around writing them."""
+        keep: List[int] = []
+        pending = Pending([], [], set())
+        for i, (cid, doc, meta) in enumerate(zip(ids, docs, metas)):
+            sig = simhash(doc)
+            old_ref = self.index.ref(cid)
+            old_sig = self.index.sig(cid)
+            if old_sig is not None:
+                if sig is not None and bin(sig ^ old_sig).count("1") <= self.index.distance:
+                    self.index.add(cid, sig)
+                    keep.append(i)
+                    continue
+                # the text drifted away from its duplicates: one of them takes over
+                moved = self._rehome(cid)
+                if moved:
+                    pending.promote.append(moved)
+            canon = self.index.nearest(sig) if sig is not None else None
+            if canon is not None and canon != cid:
+                self.index.set_ref(cid, canon, meta)
+                if old_ref is None:
+                    pending.delete.append(cid)
+                elif old_ref != canon:
+                    pending.refresh.add(old_ref)
+                pending.refresh.add(canon)
+                self.skipped += 1
+                self.skipped_chars += len(doc)
+                continue
+            if old_ref is not None:
+                self.index.unref(cid)
+                pending.refresh.add(old_ref)
+            if sig is not None:
+                self.index.add(cid, sig)
+            keep.append(i)
+        for i in keep:
+            loc = self._locations(ids[i], metas[i])
+            if loc["locations"] is not None:
+                metas[i] = {**metas[i], **loc}
+        self.index.commit()
+        return keep, pending
+
+    def before_write(self, col, pending: Pending) -> None:
+        self._promote(col, pending.promote)
+        if pending.delete:
+            col.delete(ids=pending.delete)
+
+    def after_write(self, col, pending: Pending) -> None:
+        self._refresh(col, pending.refresh)
+
+    def forget(self, col, ids: Sequence[str]) -> None:
+        """Drop chunks that are about to be deleted from the collection. Call before
+        deleting them: a canonical chunk with duplicates left is re-stored first."""
+        gone = set(ids)
+        refresh: Set[str] = set()
+        canons = []
+        for cid in ids:
+            canon = self.index.ref(cid)
+            if canon is not None:
+                self.index.unref(cid)
+                refresh.add(canon)
+            elif self.index.sig(cid) is not None:
+                canons.append(cid)
+        moves = [m for m in (self._rehome(c) for c in canons) if m]
+        self._promote(col, moves)
+        self._refresh(col, refresh - gone)
+        self.index.commit()
+
+    def _promote(self, col, moves: List[Tuple[str, str, Dict[str, Any]]]) -> None:
+        # Store the old canonical text under the duplicate that took over (the
+        # embedding cache usually already holds its vector)
+        if not moves:
+            return
+        got = col.get(ids=[m[0] for m in moves], include=["documents"])
+        docs = dict(zip(got["ids"], got["documents"]))
+        ids, texts, metas = [], [], []
+        for canon, new, meta in moves:
+            if canon not in docs:
+                logger.warning(f"Canonical chunk {canon} is not stored; cannot re-store it as {new}")
+                continue
+            loc = self._locations(new, meta)
+            ids.append(new)
+            texts.append(docs[canon])
+            metas.append({**meta, **{k: v for k, v in loc.items() if v is not None}})
+        if ids:
+            col.upsert(ids=ids, embeddings=self.embed(texts), documents=texts, metadatas=metas)
+
+    def _refresh(self, col, canons: Set[str]) -> None:
+        if not canons:
+            return
+        got = col.get(ids=sorted(canons), include=["metadatas"])
+        if got["ids"]:
+            col.update(ids=got["ids"], metadatas=[self._locations(cid, m) for cid, m in zip(got["ids"], got["metadatas"])])
+
+    def stats(self) -> Dict[str, int]:
+        return {"duplicates": self.skipped, "duplicate_chars": self.skipped_chars}
+
+    def close(self) -> None:
+        self.index.close()
+
+
+def disable_dedup(cfg: Config, col) -> None:
+    """Dedup was switched off (all files are being re-ingested in full): clear the
+    `locations` of canonical chunks and remove the signature index."""
+    path = dedup_path(cfg)
+    db = sqlite3.connect(path)
+    try:
+        canons = [r[0] for r in db.execute("SELECT DISTINCT canon FROM refs")]
+    finally:
+        db.close()
+    for i in range(0, len(canons), 500):
+        part = canons[i:i + 500]
+        col.update(ids=part, metadatas=[{"locations": None, "duplicates": None}] * len(part))
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    logger.info(f"Dedup disabled: cleared locations on {len(canons)} chunks")
+
+
+def read_refs(cfg: Config) -> List[Tuple[str, str, Dict[str, Any]]]:
+    """Every duplicate reference (id, canonical id, metadata) of the collection, for
+    snapshots; [] without a dedup index."""
+    path = dedup_path(cfg)
+    if not os.path.exists(path):
+        return []
+    db = sqlite3.connect(path)
+    try:
+        rows = db.execute("SELECT id, canon, meta FROM refs ORDER BY id").fetchall()
+    finally:
+        db.close()
+    return [(cid, canon, json.loads(meta)) for cid, canon, meta in rows]
+
+
+def compact_refs(cfg: Config, convert: Callable[[Dict[str, Any]], Dict[str, Any]]) -> int:
+    """Rewrite the stored metadata of duplicate references with `convert` (used by
+    `catalog.compact_metadata`); returns the number of references changed."""
+    path = dedup_path(cfg)
+    if not os.path.exists(path):
+        return 0
+    db = sqlite3.connect(path)
+    try:
+        rows = db.execute("SELECT id, meta FROM refs").fetchall()
+        changed = []
+        for cid, meta in rows:
+            new = convert(json.loads(meta))
+            if new != json.loads(meta):
+                changed.append((json.dumps(new), cid))
+        db.executemany("UPDATE refs SET meta = ? WHERE id = ?", changed)
+        db.commit()
+        return len(changed)
+    finally:
+        db.close()
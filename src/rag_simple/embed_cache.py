@@ -0,0 +1,140 @@
+"""Persistent, content-addressed embedding cache.
+
+Chunks are keyed by (embedding model + backend, sha256 of the chunk text), so
+re-chunking, clearing the index or rebuilding into a new collection only runs the
+model for text it has never seen. The cache lives outside `db_dir` on purpose: it must
+survive "Clear index". Size is bounded by `Config.embed_cache_max_mb`; when exceeded,
+the least recently used tenth of the entries is evicted.
+"""
+from __future__ import annotations
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from .config import Config
+from .logging_setup import logger
+
+
+def _sha(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    def __init__(self, path: str, model_key: str, max_bytes: int):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.model_key = model_key
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT, sha TEXT, vec BLOB, last_used REAL,"
+            " PRIMARY KEY (model, sha)) WITHOUT ROWID"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS embeddings_lru ON embeddings (last_used)")
+        self._db.commit()
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    def get_many(self, texts: List[str]) -> List[Optional[np.ndarray]]:
+        shas = [_sha(t) for t in texts]
+        found: Dict[str, np.ndarray] = {}
+        with self._lock:
+            for i in range(0, len(shas), 500):  # stay under sqlite's variable limit
+                part = shas[i:i + 500]
+                q = ",".join("?" * len(part))
+                rows = self._db.execute(
+                    f"SELECT sha, vec FROM embeddings WHERE model = ? AND sha IN ({q})",
+                    [self.model_key, *part],
+                ).fetchall()
+                found.update((sha, np.frombuffer(vec, dtype=np.float32)) for sha, vec in rows)
+            if found:
+                now = time.time()
+                self._db.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE model = ? AND sha = ?",
+                    [(now, self.model_key, s) for s in found],
+                )
+                self._db.commit()
+        out = [found.get(s) for s in shas]
+        hits = sum(v is not None for v in out)
+        self.hits += hits
+        self.misses += len(out) - hits
+        return out
+
+    def put_many(self, texts: List[str], vecs) -> None:
+        now = time.time()
+        rows = [
+            (self.model_key, _sha(t), np.asarray(v, dtype=np.float32).tobytes(), now)
+            for t, v in zip(texts, vecs)
+        ]
+        with self._lock:
+            self._db.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)", rows)
+            self._db.commit()
+            self._evict()
+
+    def _used_bytes(self) -> int:
+        pages = self._db.execute("PRAGMA page_count").fetchone()[0]
+        free = self._db.execute("PRAGMA freelist_count").fetchone()[0]
+        size = self._db.execute("PRAGMA page_size").fetchone()[0]
+        return (pages - free) * size
+
+    def _evict(self) -> None:
+        if self.max_bytes <= 0 or self._used_bytes() <= self.max_bytes:
+            return
+        total = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        n = max(1, total // 10)
+        self._db.execute(
+            "DELETE FROM embeddings WHERE (model, sha) IN "
+            "(SELECT model, sha FROM embeddings ORDER BY last_used LIMIT ?)",
+            (n,),
+        )
+        self._db.commit()
+        self.evicted += n
+        logger.info(f"Embedding cache over {self.max_bytes >> 20} MB; evicted {n} least recently used entries")
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "evicted": self.evicted}
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+class CachedEmbedder:
+    """Callable like an embedding function; only cache misses reach the model."""
+
+    def __init__(self, ef, cache: EmbeddingCache):
+        self.ef = ef
+        self.cache = cache
+
+    def __call__(self, texts: List[str]) -> List[np.ndarray]:
+        out = self.cache.get_many(texts)
+        miss = [i for i, v in enumerate(out) if v is None]
+        if miss:
+            vecs = self.ef([texts[i] for i in miss])
+            self.cache.put_many([texts[i] for i in miss], vecs)
+            for i, v in zip(miss, vecs):
+                out[i] = np.asarray(v, dtype=np.float32)
+        return out
+
+    def stats(self) -> Dict[str, int]:
+        return self.cache.stats()
+
+    def close(self) -> None:
+        self.cache.close()
+
+
+def open_embedder(cfg: Config, ef) -> Optional[CachedEmbedder]:
+    """Wrap `ef` with the persistent cache, or return None when it is disabled."""
+    if cfg.embed_cache_max_mb <= 0:
+        return None
+    path = os.path.join(cfg.embed_cache_dir, "embeddings.sqlite")
+    cache = EmbeddingCache(path, f"{cfg.embed_model}|{cfg.embed_backend}", cfg.embed_cache_max_mb << 20)
+    return CachedEmbedder(ef, cache)
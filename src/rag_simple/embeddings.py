@@ -0,0 +1,182 @@
+"""Embedding backends.
+
+- ``torch`` (default): chroma's SentenceTransformerEmbeddingFunction, full precision.
+- ``onnx``: the same sentence-transformers model exported to ONNX and run with ONNX
+  Runtime on CPU.
+- ``onnx-int8``: as ``onnx`` but with dynamic int8 quantization of the weights.
+
+ONNX exports are written once under ``Config.onnx_dir`` and checked against the PyTorch
+model on a fixed probe set; the resulting minimum cosine similarity ("parity") is
+stored with the export and stamped onto collections, so vectors from different
+backends are only mixed in one collection when they are known to agree.
+"""
+from __future__ import annotations
+import os
+import json
+import platform
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+from chromadb.utils.embedding_functions import SentenceTransformerEmbeddingFunction
+
+from .config import Config
+from .logging_setup import logger
+
+
+BACKENDS = ("torch", "onnx", "onnx-int8")
+
+PARITY_PROBES = [
+    "What is the secure loop current deadband?",
+    "Torque specification for the M8 flange bolts on the pump housing.",
+    "Revision history: updated wiring diagram for panel B, sheet 3 of 7.",
+    "The interlock trips when the coolant flow drops below 12 L/min for more than 5 s.",
+    "Table 4-2 lists the calibration intervals for all pressure transmitters.",
+    "hello",
+]
+
+
+def _quant_config() -> str:
+    # sentence-transformers quantization presets; avx2 is the safe x86 default
+    if platform.machine().lower() in ("arm64", "aarch64"):
+        return "arm64"
+    return os.getenv("RAG_ONNX_QCONFIG", "avx2")
+
+
+def export_onnx(model_name: str, export_dir: str, quantize: bool) -> Tuple[str, str]:
+    """Export `model_name` to ONNX under `export_dir` (once) and return
+    (model_dir, onnx_file_name relative to model_dir)."""
+    from sentence_transformers import SentenceTransformer
+
+    target = os.path.join(export_dir, model_name.replace("/", "__"))
+    fname = "onnx/model.onnx"
+    if not os.path.exists(os.path.join(target, fname)):
+        logger.info(f"Exporting {model_name} to ONNX → {target}")
+        SentenceTransformer(model_name, device="cpu", backend="onnx").save_pretrained(target)
+    if quantize:
+        from sentence_transformers import export_dynamic_quantized_onnx_model
+
+        qcfg = _quant_config()
+        qname = f"onnx/model_qint8_{qcfg}.onnx"
+        if not os.path.exists(os.path.join(target, qname)):
+            logger.info(f"Quantizing {model_name} to dynamic int8 ({qcfg})")
+            model = SentenceTransformer(target, device="cpu", backend="onnx")
+            export_dynamic_quantized_onnx_model(model, qcfg, target)
+        fname = qname
+    return target, fname
+
+
+def parity_check(model_name: str, ef, probes: List[str] = PARITY_PROBES) -> float:
+    """Minimum cosine similarity between `ef` and the PyTorch model on `probes`."""
+    from sentence_transformers import SentenceTransformer
+
+    ref = SentenceTransformer(model_name, device="cpu")
+    a = ref.encode(probes, convert_to_numpy=True, normalize_embeddings=True)
+    b = np.asarray(ef(probes), dtype=np.float32)
+    return float(np.min(np.sum(a * b, axis=1)))
+
+
+class OnnxEmbeddingFunction(SentenceTransformerEmbeddingFunction):
+    """SentenceTransformer on the ONNX Runtime backend.
+
+    Keeps chroma's ``sentence_transformer`` identity (same model, same normalized
+    vectors), so chroma accepts it for collections built with the PyTorch backend;
+    compatibility is enforced separately via `check_compatible`.
+    """
+
+    def __init__(self, model_name: str, export_dir: str, quantize: bool = False,
+                 normalize_embeddings: bool = True):
+        from sentence_transformers import SentenceTransformer
+
+        model_dir, fname = export_onnx(model_name, export_dir, quantize)
+        self.model_name = model_name
+        self.device = "cpu"
+        self.normalize_embeddings = normalize_embeddings
+        self.kwargs = {"backend": "onnx"}
+        # not shared through the parent's class-level `models` cache, which is keyed
+        # by model name only and would hand back the PyTorch model
+        self._model = SentenceTransformer(
+            model_dir, device="cpu", backend="onnx", model_kwargs={"file_name": fname}
+        )
+        self.parity = self._load_parity(model_dir, fname)
+
+    def __call__(self, input: List[str]) -> List[List[float]]:
+        # the parent's __call__ reads version-specific attributes (`_normalize_embeddings`
+        # on chromadb 0.5, `normalize_embeddings` on 1.x) and its own model cache
+        embs = self._model.encode(
+            list(input), convert_to_numpy=True, normalize_embeddings=self.normalize_embeddings
+        )
+        return embs.tolist()
+
+    def _load_parity(self, model_dir: str, fname: str) -> float:
+        path = os.path.join(model_dir, "parity.json")
+        results: Dict[str, float] = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                results = json.load(f)
+        if fname not in results:
+            results[fname] = parity_check(self.model_name, self)
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(results, f, indent=2)
+            logger.info(f"ONNX parity for {self.model_name} ({fname}): min cosine {results[fname]:.5f}")
+        return results[fname]
+
+
+def make_embedding_function(cfg: Config):
+    if cfg.embed_backend == "torch":
+        return SentenceTransformerEmbeddingFunction(
+            model_name=cfg.embed_model,
+            normalize_embeddings=True,
+        )
+    if cfg.embed_backend in ("onnx", "onnx-int8"):
+        return OnnxEmbeddingFunction(
+            cfg.embed_model,
+            export_dir=cfg.onnx_dir,
+            quantize=cfg.embed_backend == "onnx-int8",
+        )
+    raise ValueError(f"Unknown embed backend {cfg.embed_backend!r}; expected one of {BACKENDS}")
+
+
+def fingerprint(cfg: Config, ef) -> Dict[str, Any]:
+    return {
+        "embed_model": cfg.embed_model,
+        "embed_backend": cfg.embed_backend,
+        "embed_parity": float(getattr(ef, "parity", 1.0)),
+    }
+
+
+def check_compatible(col, cfg: Config, ef) -> None:
+    """Stamp a new collection with the embedding fingerprint, or refuse to use an
+    existing one whose vectors came from a different model or from a backend that
+    does not agree closely enough with this one."""
+    meta = dict(col.metadata or {})
+    if "embed_model" not in meta:
+        if col.count() > 0:
+            # built before stamping: at least the vector size has to match, then the
+            # current config is taken on trust and recorded so later mixes are caught
+            stored = col.get(limit=1, include=["embeddings"])["embeddings"]
+            dim = len(np.asarray(ef(["dimension probe"]))[0])
+            if stored is not None and len(stored) and len(stored[0]) != dim:
+                raise ValueError(
+                    f"Collection {cfg.collection!r} holds {len(stored[0])}-dimensional vectors; "
+                    f"{cfg.embed_model!r} produces {dim}. Use another collection or rebuild."
+                )
+            logger.warning(
+                f"Collection {cfg.collection!r} has no embedding stamp; assuming it was built with "
+                f"{cfg.embed_model!r} [{cfg.embed_backend}] and stamping it"
+            )
+        meta.update(fingerprint(cfg, ef))
+        col.modify(metadata=meta)
+        return
+    if meta["embed_model"] != cfg.embed_model:
+        raise ValueError(
+            f"Collection {cfg.collection!r} was built with {meta['embed_model']!r}; "
+            f"refusing to mix with {cfg.embed_model!r}. Use another collection or rebuild."
+        )
+    if meta.get("embed_backend", "torch") != cfg.embed_backend:
+        parity = min(float(meta.get("embed_parity", 1.0)), float(getattr(ef, "parity", 1.0)))
+        if parity < cfg.embed_parity_min:
+            raise ValueError(
+                f"Collection {cfg.collection!r} was built with the {meta.get('embed_backend')!r} backend and "
+                f"{cfg.embed_backend!r} only reaches parity {parity:.4f} < {cfg.embed_parity_min}; "
+                f"refusing to mix vectors. Rebuild the collection with this backend."
+            )
@@ -0,0 +1,547 @@
+"""Flat, memory-mapped vector store (``Config.vector_backend = "flat"``).
+
+Layout of ``{db_dir}/{collection}.flat/``:
+
+- ``meta.json``: dimension, dtype, committed row count, live count, file generation and
+  the collection metadata. It is replaced atomically after every write, so readers only
+  ever map committed rows.
+- ``vectors.<gen>.f16``, or ``vectors.<gen>.i8`` + ``scales.<gen>.f32`` (int8 with one
+  scale per vector): normalized embeddings, row-major.
+- ``exact.<gen>.f16`` (int8 only): float16 copy, read only for the rows being rescored.
+- ``alive.<gen>.u8``: 1 per live row; deletes (and upserts of an existing id) clear the
+  old row in place and append the new one.
+- ``ids``/``docs``/``metas`` columns: ``.<gen>.off`` (int64 end offsets) + ``.<gen>.bin``
+  (UTF-8 blob; metadata is one JSON object per row).
+
+Search is exact: blocks of rows are scored against all queries with one matmul,
+``argpartition`` keeps the best candidates per block, and int8 candidates are rescored
+against the float16 copy. Everything is opened with ``np.memmap``, so opening is
+near-instant and several server processes share pages through the OS page cache.
+Distances are squared L2 between unit vectors (2 - 2·cos), as in Chroma's default space.
+
+Collections implement the part of Chroma's ``Collection`` API this package uses
+(``upsert``, ``update``, ``delete``, ``get``, ``query``, ``count``,
+``metadata``/``modify``). Metadata ``where`` filters on ``get``/``query`` are evaluated
+over the JSON metadata once per clause and cached as a row mask until the next write.
+"""
+from __future__ import annotations
+import os
+import json
+import shutil
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Sequence
+
+import numpy as np
+
+from .logging_setup import logger
+
+try:
+    import fcntl
+except ImportError:  # Windows: in-process locking only
+    fcntl = None
+
+
+DTYPES = ("int8", "float16")
+BLOCK = 16384  # rows scored per matmul
+COLUMNS = ("ids", "docs", "metas")
+
+
+def _normalize(x) -> np.ndarray:
+    x = np.asarray(x, dtype=np.float32)
+    if x.ndim == 1:
+        x = x[None, :]
+    n = np.linalg.norm(x, axis=1, keepdims=True)
+    return x / np.where(n == 0, 1.0, n)
+
+
+_OPS = {
+    "$eq": lambda v, x: v == x,
+    "$ne": lambda v, x: v != x,
+    "$gt": lambda v, x: v > x,
+    "$gte": lambda v, x: v >= x,
+    "$lt": lambda v, x: v < x,
+    "$lte": lambda v, x: v <= x,
+    "$in": lambda v, x: v in x,
+    "$nin": lambda v, x: v not in x,
+}
+
+
+def _compile(where: Any) -> Any:
+    """`where` with $in/$nin lists as sets (e.g. long lists of doc ids)."""
+    if isinstance(where, list):
+        return [_compile(w) for w in where]
+    if not isinstance(where, dict):
+        return where
+    return {k: frozenset(v) if k in ("$in", "$nin") and isinstance(v, list) else _compile(v)
+            for k, v in where.items()}
+
+
+def _matches(meta: Dict[str, Any], where: Dict[str, Any]) -> bool:
+    """Evaluate a Chroma-style metadata ``where`` clause; rows without the key never match."""
+    for key, cond in where.items():
+        if key == "$and":
+            if not all(_matches(meta, w) for w in cond):
+                return False
+        elif key == "$or":
+            if not any(_matches(meta, w) for w in cond):
+                return False
+        else:
+            ops = cond if isinstance(cond, dict) else {"$eq": cond}
+            for op, x in ops.items():
+                if op not in _OPS:
+                    raise ValueError(f"Unsupported where operator {op!r}")
+                if key not in meta:
+                    return False
+                try:
+                    if not _OPS[op](meta.get(key), x):
+                        return False
+                except TypeError:  # e.g. comparing a string with a number
+                    return False
+    return True
+
+
+class _View(NamedTuple):
+    """The committed arrays at one moment. Row numbers are only meaningful against the
+    view they were computed from: a compaction renumbers rows (and deletes the old
+    generation's files, which stay readable through existing maps)."""
+    vecs: np.ndarray
+    scales: Optional[np.ndarray]
+    exact: Optional[np.ndarray]
+    alive: np.ndarray
+    live: int
+    offs: Dict[str, np.ndarray]
+    blobs: Dict[str, np.ndarray]
+
+
+def _decode(off: np.ndarray, blob: np.ndarray, rows: Iterable[int]) -> List[str]:
+    out = []
+    for r in rows:
+        start = int(off[r - 1]) if r else 0
+        out.append(bytes(blob[start:int(off[r])]).decode("utf-8"))
+    return out
+
+
+def _map(path: str, dtype, shape) -> np.ndarray:
+    if not shape[0] or not os.path.exists(path):
+        return np.zeros(shape, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", shape=shape)
+
+
+class FlatCollection:
+    def __init__(self, path: str, name: str, dtype: str = "int8", rescore: int = 4,
+                 metadata: Optional[Dict[str, Any]] = None):
+        self.path = path
+        self.name = name
+        self.rescore = max(1, rescore)
+        self._lock = threading.RLock()
+        self._stamp = None
+        self._index: Optional[Dict[str, int]] = None
+        os.makedirs(path, exist_ok=True)
+        if not os.path.exists(self._file("meta.json")):
+            if dtype not in DTYPES:
+                raise ValueError(f"Unknown flat dtype {dtype!r}; expected one of {DTYPES}")
+            self._meta = {"dim": None, "dtype": dtype, "rows": 0, "live": 0, "gen": 0,
+                          "metadata": dict(metadata or {})}
+            self._commit()
+        self._refresh()
+        if self._meta["dtype"] != dtype:
+            logger.info(f"Flat collection {name!r} is stored as {self._meta['dtype']}; ignoring {dtype!r}")
+
+    # ----- files -------------------------------------------------------------------
+
+    def _file(self, name: str, gen: Optional[int] = None) -> str:
+        if gen is None:
+            return os.path.join(self.path, name)
+        stem, ext = name.split(".")
+        return os.path.join(self.path, f"{stem}.{gen}.{ext}")
+
+    def _files(self, gen: int) -> List[str]:
+        names = ["vectors.i8", "scales.f32", "exact.f16"] if self._meta["dtype"] == "int8" else ["vectors.f16"]
+        names += ["alive.u8"] + [f"{c}.{e}" for c in COLUMNS for e in ("off", "bin")]
+        return [self._file(n, gen) for n in names]
+
+    def _commit(self) -> None:
+        tmp = self._file("meta.json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self._meta, f)
+        os.replace(tmp, self._file("meta.json"))
+
+    def _refresh(self) -> None:
+        """(Re)map the files if another handle or process committed since last time."""
+        st = os.stat(self._file("meta.json"))
+        stamp = (st.st_ino, st.st_mtime_ns, st.st_size)
+        if stamp == self._stamp:
+            return
+        with self._lock:
+            with open(self._file("meta.json"), "r", encoding="utf-8") as f:
+                self._meta = json.load(f)
+            self._stamp = stamp
+            self._index = None
+            m, n, g = self._meta, self._meta["rows"], self._meta["gen"]
+            d = m["dim"] or 0
+            self._alive = _map(self._file("alive.u8", g), np.uint8, (n,))
+            if m["dtype"] == "int8":
+                self._vecs = _map(self._file("vectors.i8", g), np.int8, (n, d))
+                self._scales = _map(self._file("scales.f32", g), np.float32, (n,))
+                self._exact = _map(self._file("exact.f16", g), np.float16, (n, d))
+            else:
+                self._vecs = _map(self._file("vectors.f16", g), np.float16, (n, d))
+                self._scales = self._exact = None
+            self._cols = {c: (_map(self._file(f"{c}.off", g), np.int64, (n,)), self._file(f"{c}.bin", g))
+                          for c in COLUMNS}
+            self._blobs: Dict[str, np.ndarray] = {}
+            self._masks: Dict[str, np.ndarray] = {}
+
+    def _blob(self, col: str) -> np.ndarray:
+        off, path = self._cols[col]
+        blob = self._blobs.get(col)
+        if blob is None:
+            size = int(off[-1]) if len(off) else 0
+            blob = self._blobs[col] = _map(path, np.uint8, (size,))
+        return blob
+
+    def _strings(self, col: str, rows: Iterable[int]) -> List[str]:
+        return _decode(self._cols[col][0], self._blob(col), rows)
+
+    def _view(self) -> _View:
+        # under self._lock; the string blobs are mapped now, before a compaction can
+        # remove their files
+        return _View(self._vecs, self._scales, self._exact, self._alive, int(self._meta["live"]),
+                     {c: self._cols[c][0] for c in COLUMNS}, {c: self._blob(c) for c in COLUMNS})
+
+    # ----- writes ------------------------------------------------------------------
+
+    @contextmanager
+    def _writing(self):
+        with self._lock:
+            lockf = open(self._file(".lock"), "a")
+            try:
+                if fcntl is not None:
+                    fcntl.flock(lockf, fcntl.LOCK_EX)
+                self._refresh()
+                self._truncate()
+                yield
+                self._commit()
+                # we held the lock, so the id index (kept up to date by the writer) is still valid
+                index = self._index
+                self._refresh()
+                self._index = index
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lockf, fcntl.LOCK_UN)
+                lockf.close()
+
+    def _truncate(self) -> None:
+        # drop bytes a crashed writer appended past the committed rows
+        m, n, g = self._meta, self._meta["rows"], self._meta["gen"]
+        d = m["dim"] or 0
+        sizes = {"vectors.i8": n * d, "scales.f32": n * 4, "exact.f16": n * d * 2,
+                 "vectors.f16": n * d * 2, "alive.u8": n}
+        for c in COLUMNS:
+            off = self._cols[c][0]
+            sizes[f"{c}.off"] = n * 8
+            sizes[f"{c}.bin"] = int(off[-1]) if n else 0
+        for name, size in sizes.items():
+            p = self._file(name, g)
+            if os.path.exists(p) and os.path.getsize(p) != size:
+                os.truncate(p, size)
+
+    def _append(self, name: str, data: bytes) -> None:
+        with open(self._file(name, self._meta["gen"]), "ab") as f:
+            f.write(data)
+
+    def _append_strings(self, col: str, values: Sequence[str]) -> None:
+        off = self._cols[col][0]
+        end = int(off[-1]) if len(off) else 0
+        enc = [v.encode("utf-8") for v in values]
+        ends = end + np.cumsum([len(b) for b in enc], dtype=np.int64)
+        self._append(f"{col}.bin", b"".join(enc))
+        self._append(f"{col}.off", ends.tobytes())
+
+    def _id_index(self) -> Dict[str, int]:
+        if self._index is None:
+            live = np.flatnonzero(self._alive)
+            self._index = dict(zip(self._strings("ids", live), live.tolist()))
+        return self._index
+
+    def _kill(self, rows: List[int]) -> None:
+        if not rows:
+            return
+        alive = np.memmap(self._file("alive.u8", self._meta["gen"]), dtype=np.uint8, mode="r+",
+                          shape=(self._meta["rows"],))
+        alive[rows] = 0
+        alive.flush()
+        del alive
+        self._meta["live"] -= len(rows)
+
+    def upsert(self, ids: List[str], embeddings=None, documents=None, metadatas=None) -> None:
+        if embeddings is None:
+            raise ValueError("The flat backend stores precomputed embeddings only")
+        if len(set(ids)) != len(ids):
+            raise ValueError("Expected IDs to be unique")
+        if not ids:
+            return
+        x = _normalize(embeddings)
+        documents = documents or [""] * len(ids)
+        metadatas = metadatas or [{}] * len(ids)
+        with self._writing():
+            m = self._meta
+            if m["dim"] is None:
+                m["dim"] = int(x.shape[1])
+            elif x.shape[1] != m["dim"]:
+                raise ValueError(f"Embedding dimension {x.shape[1]} does not match collection dimension {m['dim']}")
+            index = self._id_index()
+            self._kill([index[i] for i in ids if i in index])
+            index.update((uid, m["rows"] + j) for j, uid in enumerate(ids))
+            if m["dtype"] == "int8":
+                scale = np.abs(x).max(axis=1) / 127.0
+                scale[scale == 0] = 1.0
+                self._append("vectors.i8", np.round(x / scale[:, None]).astype(np.int8).tobytes())
+                self._append("scales.f32", scale.astype(np.float32).tobytes())
+                self._append("exact.f16", x.astype(np.float16).tobytes())
+            else:
+                self._append("vectors.f16", x.astype(np.float16).tobytes())
+            self._append("alive.u8", np.ones(len(ids), dtype=np.uint8).tobytes())
+            self._append_strings("ids", ids)
+            self._append_strings("docs", documents)
+            self._append_strings("metas", [json.dumps(md or {}, separators=(",", ":")) for md in metadatas])
+            m["rows"] += len(ids)
+            m["live"] += len(ids)
+        self._maybe_compact()
+
+    add = upsert
+
+    def update(self, ids: List[str], metadatas=None, documents=None) -> None:
+        """Replace documents and/or merge metadata of existing rows, as Chroma does
+        (unknown ids are ignored). Stored vectors are copied to the new rows as is."""
+        if len(set(ids)) != len(ids):
+            raise ValueError("Expected IDs to be unique")
+        if not ids:
+            return
+        with self._writing():
+            m = self._meta
+            index = self._id_index()
+            pos = [j for j, uid in enumerate(ids) if uid in index]
+            rows = [index[ids[j]] for j in pos]
+            if rows:
+                names = ["vectors.i8", "scales.f32", "exact.f16"] if m["dtype"] == "int8" else ["vectors.f16"]
+                arrays = [self._vecs, self._scales, self._exact] if m["dtype"] == "int8" else [self._vecs]
+                for name, arr in zip(names, arrays):
+                    self._append(name, np.ascontiguousarray(arr[rows]).tobytes())
+                docs = self._strings("docs", rows)
+                metas = [json.loads(x) for x in self._strings("metas", rows)]
+                for k, j in enumerate(pos):
+                    if documents is not None:
+                        docs[k] = documents[j]
+                    for key, v in ((metadatas[j] or {}) if metadatas is not None else {}).items():
+                        if v is None:  # as in Chroma, None removes the key
+                            metas[k].pop(key, None)
+                        else:
+                            metas[k][key] = v
+                self._kill(rows)
+                index.update((ids[j], m["rows"] + k) for k, j in enumerate(pos))
+                self._append("alive.u8", np.ones(len(rows), dtype=np.uint8).tobytes())
+                self._append_strings("ids", [ids[j] for j in pos])
+                self._append_strings("docs", docs)
+                self._append_strings("metas", [json.dumps(md, separators=(",", ":")) for md in metas])
+                m["rows"] += len(rows)
+                m["live"] += len(rows)
+        self._maybe_compact()
+
+    def delete(self, ids: Optional[List[str]] = None, where=None) -> None:
+        if where is not None:
+            raise ValueError("The flat backend deletes by id only")
+        if not ids:
+            return
+        with self._writing():
+            index = self._id_index()
+            self._kill([index.pop(i) for i in set(ids) if i in index])
+        self._maybe_compact()
+
+    def modify(self, name: Optional[str] = None, metadata: Optional[Dict[str, Any]] = None) -> None:
+        with self._writing():
+            if metadata is not None:
+                self._meta["metadata"] = dict(metadata)
+
+    def _maybe_compact(self) -> None:
+        m = self._meta
+        if m["rows"] - m["live"] > max(1024, m["live"]):
+            self.compact()
+
+    def compact(self) -> None:
+        """Rewrite live rows into a new file generation and drop the old one."""
+        with self._writing():
+            old, new = self._meta["gen"], self._meta["gen"] + 1
+            live = np.flatnonzero(self._alive)
+            out = {os.path.basename(p).replace(f".{new}.", "."): open(p, "wb") for p in self._files(new)}
+            ends = {c: 0 for c in COLUMNS}
+            try:
+                for s in range(0, len(live), BLOCK):
+                    rows = live[s:s + BLOCK]
+                    if self._meta["dtype"] == "int8":
+                        out["vectors.i8"].write(np.asarray(self._vecs[rows]).tobytes())
+                        out["scales.f32"].write(np.asarray(self._scales[rows]).tobytes())
+                        out["exact.f16"].write(np.asarray(self._exact[rows]).tobytes())
+                    else:
+                        out["vectors.f16"].write(np.asarray(self._vecs[rows]).tobytes())
+                    for c in ends:
+                        enc = [v.encode("utf-8") for v in self._strings(c, rows)]
+                        offs = ends[c] + np.cumsum([len(b) for b in enc], dtype=np.int64)
+                        out[f"{c}.bin"].write(b"".join(enc))
+                        out[f"{c}.off"].write(offs.tobytes())
+                        if len(offs):
+                            ends[c] = int(offs[-1])
+                out["alive.u8"].write(np.ones(len(live), dtype=np.uint8).tobytes())
+            finally:
+                for f in out.values():
+                    f.close()
+            rows_before = self._meta["rows"]
+            self._meta.update(gen=new, rows=int(len(live)), live=int(len(live)))
+            self._index = None  # row numbers changed
+            logger.info(f"Compacted flat collection {self.name!r}: {rows_before} → {len(live)} rows")
+        for p in self._files(old):
+            if os.path.exists(p):
+                os.remove(p)  # processes that still map them keep the inode until they refresh
+
+    # ----- reads -------------------------------------------------------------------
+
+    @property
+    def metadata(self) -> Dict[str, Any]:
+        self._refresh()
+        return dict(self._meta["metadata"])
+
+    def count(self) -> int:
+        self._refresh()
+        return int(self._meta["live"])
+
+    def _rows(self, rows: List[int], include: Sequence[str], view: Optional[_View] = None) -> Dict[str, Any]:
+        v = view or self._view()
+
+        def strings(col: str) -> List[str]:
+            return _decode(v.offs[col], v.blobs[col], rows)
+
+        return {
+            "ids": strings("ids"),
+            "documents": strings("docs") if "documents" in include else None,
+            "metadatas": [json.loads(s) for s in strings("metas")] if "metadatas" in include else None,
+            # the normalized float16 vectors (for int8, the rescoring copy)
+            "embeddings": (np.asarray((v.vecs if v.exact is None else v.exact)[rows], dtype=np.float32)
+                           if "embeddings" in include else None),
+        }
+
+    def _where_mask(self, where: Dict[str, Any]) -> np.ndarray:
+        """Live rows matching `where`; cached per clause until the next write."""
+        key = json.dumps(where, sort_keys=True)
+        mask = self._masks.get(key)
+        if mask is None:
+            where = _compile(where)
+            mask = np.zeros(len(self._alive), dtype=bool)
+            live = np.flatnonzero(self._alive)
+            for s in range(0, len(live), BLOCK):
+                rows = live[s:s + BLOCK]
+                hits = [_matches(json.loads(m), where) for m in self._strings("metas", rows)]
+                mask[rows[np.asarray(hits, dtype=bool)]] = True
+            if len(self._masks) >= 32:
+                self._masks.pop(next(iter(self._masks)))
+            self._masks[key] = mask
+        return mask
+
+    def get(self, ids: Optional[List[str]] = None, where=None, limit: Optional[int] = None,
+            offset: int = 0, include: Sequence[str] = ("documents", "metadatas")) -> Dict[str, Any]:
+        self._refresh()
+        with self._lock:
+            if ids is not None:
+                index = self._id_index()
+                rows = [index[i] for i in ids if i in index]
+                if where is not None:
+                    mask = self._where_mask(where)
+                    rows = [r for r in rows if mask[r]]
+            elif where is not None:
+                rows = np.flatnonzero(self._where_mask(where)).tolist()
+            else:
+                rows = np.flatnonzero(self._alive).tolist()
+            rows = rows[offset:offset + limit if limit is not None else None]
+            return self._rows(rows, include)
+
+    def query(self, query_embeddings=None, n_results: int = 10, where=None,
+              include: Sequence[str] = ("documents", "metadatas", "distances"), **kwargs) -> Dict[str, Any]:
+        if query_embeddings is None:
+            raise ValueError("The flat backend needs query_embeddings")
+        self._refresh()
+        q = _normalize(query_embeddings)
+        with self._lock:
+            # scoring runs without the lock; rows are resolved against this view, so a
+            # concurrent write (and the compaction it may trigger) cannot mix up rows
+            view = self._view()
+            vecs, scales, exact, alive = view.vecs, view.scales, view.exact, view.alive
+            if where is not None:
+                # filtered rows are excluded from scoring, like deleted ones
+                alive = self._where_mask(where)
+        n, nq = len(alive), len(q)
+        k = min(n_results, view.live if where is None else int(alive.sum()))
+        out: Dict[str, Any] = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        if k <= 0:
+            for key in out:
+                out[key] = [[] for _ in range(nq)]
+            return out
+
+        keep = k * self.rescore if exact is not None else k
+        best_s = np.full((nq, 0), -np.inf, dtype=np.float32)
+        best_i = np.zeros((nq, 0), dtype=np.int64)
+        for start in range(0, n, BLOCK):
+            stop = min(n, start + BLOCK)
+            s = q @ np.asarray(vecs[start:stop], dtype=np.float32).T
+            if scales is not None:
+                s *= np.asarray(scales[start:stop])
+            s[:, np.asarray(alive[start:stop]) == 0] = -np.inf
+            s = np.concatenate([best_s, s], axis=1)
+            i = np.concatenate([best_i, np.broadcast_to(np.arange(start, stop), (nq, stop - start))], axis=1)
+            if s.shape[1] > keep:
+                part = np.argpartition(-s, keep - 1, axis=1)[:, :keep]
+                s, i = np.take_along_axis(s, part, 1), np.take_along_axis(i, part, 1)
+            best_s, best_i = s, i
+
+        if exact is not None:
+            # int8 scores only pick candidates; rank them with the float16 vectors
+            cand = np.asarray(exact[best_i.ravel()], dtype=np.float32).reshape(nq, best_i.shape[1], -1)
+            best_s = np.where(np.isinf(best_s), -np.inf, np.einsum("qd,qcd->qc", q, cand))
+
+        order = np.argsort(-best_s, axis=1)[:, :k]
+        for qi in range(nq):
+            rows = [int(best_i[qi, j]) for j in order[qi] if np.isfinite(best_s[qi, j])]
+            sims = [float(best_s[qi, j]) for j in order[qi] if np.isfinite(best_s[qi, j])]
+            res = self._rows(rows, include, view)
+            out["ids"].append(res["ids"])
+            out["documents"].append(res["documents"])
+            out["metadatas"].append(res["metadatas"])
+            out["distances"].append([2.0 - 2.0 * s for s in sims])
+        return out
+
+
+class FlatClient:
+    """Client-like holder of flat collections under one `db_dir`."""
+
+    def __init__(self, path: str, dtype: str = "int8", rescore: int = 4):
+        self.path = path
+        self.dtype = dtype
+        self.rescore = rescore
+        self._collections: Dict[str, FlatCollection] = {}
+        os.makedirs(path, exist_ok=True)
+
+    def _dir(self, name: str) -> str:
+        return os.path.join(self.path, f"{name}.flat")
+
+    def get_or_create_collection(self, name: str, embedding_function=None,
+                                 metadata: Optional[Dict[str, Any]] = None) -> FlatCollection:
+        col = self._collections.get(name)
+        if col is None:
+            col = self._collections[name] = FlatCollection(self._dir(name), name, self.dtype, self.rescore, metadata)
+        return col
+
+    def delete_collection(self, name: str) -> None:
+        self._collections.pop(name, None)
+        shutil.rmtree(self._dir(name), ignore_errors=True)
+
+    def close(self) -> None:
+        self._collections.clear()
@@ -1,12 +1,21 @@
 
 
 from __future__ import annotations
-from typing import Dict, Any
+from concurrent.futures import ThreadPoolExecutor, Future, wait, as_completed, FIRST_COMPLETED
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 import os
+import time
+import threading
+from dataclasses import replace
 
 from .config import Config
-from .retrieve import retrieve, make_context
+from .retrieve import retrieve, retrieve_many, embed_queries
+from .context import build_context, num_ctx
+from .catalog import Filters
+from .store import index_version
+from .answer_cache import AnswerCache
 from .logging_setup import logger
+from . import metrics
 
 try:
     import ollama
@@ -21,28 +30,237 @@ SYS_PROMPT = (
 )
 
 
-def answer(cfg: Config, question: str) -> Dict[str, Any]:
-    snippets = retrieve(cfg, question)
-    context = make_context(snippets)
+# One cache per size, so configs with different limits in one process do not resize
+# each other's cache (as `retrieve._query_cache`); entries are scoped per index anyway.
+_ANSWER_CACHES: Dict[int, AnswerCache] = {}
+_ANSWER_CACHES_LOCK = threading.Lock()
+
+
+def _answer_cache(cfg: Config) -> AnswerCache:
+    with _ANSWER_CACHES_LOCK:
+        cache = _ANSWER_CACHES.get(cfg.answer_cache_size)
+        if cache is None:
+            cache = _ANSWER_CACHES[cfg.answer_cache_size] = AnswerCache(cfg.answer_cache_size)
+        return cache
 
-    if not context.strip():
-        return {
-            "answer": "I don't have enough information in the indexed corpus to answer that.",
-            "sources": [],
-        }
 
-    prompt = (
+def answer_cache_stats(cfg: Optional[Config] = None) -> Dict[str, Any]:
+    return _answer_cache(cfg or Config()).stats()
+
+
+def _build_prompt(context: str, question: str) -> str:
+    return (
         f"System: {SYS_PROMPT}\n\n"
         f"Context:\n{context}\n\n"
         f"User question: {question}\n\n"
         f"Answer concisely, and include citations by quoting the headers where relevant."
     )
 
+
+def _new_state() -> Dict[str, Any]:
+    return {"version": None, "ids": None, "q_emb": None, "snippets": [], "prompt": None, "options": None}
+
+
+def _lookup_exact(cfg: Config, question: str, st: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    if cfg.answer_cache:
+        st["version"] = index_version(cfg)
+        hit = _answer_cache(cfg).get_exact(cfg, st["version"], question)
+        if hit is not None:
+            return {**hit, "cached": True}
+    return None
+
+
+def _after_retrieval(cfg: Config, question: str, snippets: List[Dict[str, Any]],
+                     st: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    with metrics.span("make_context"):
+        context = build_context(cfg, snippets)
+
+    if not context.strip():
+        return {
+            "answer": "I don't have enough information in the indexed corpus to answer that.",
+            "sources": [],
+            "cached": False,
+        }
+
     if ollama is None:
         logger.warning("ollama is not installed; returning context-only stub answer")
-        return {"answer": context[:1200] + "\n\n[Install ollama to generate answers]", "sources": snippets}
+        return {"answer": context[:1200] + "\n\n[Install ollama to generate answers]",
+                "sources": snippets, "cached": False}
+
+    if cfg.answer_cache:
+        st["ids"] = frozenset(s["id"] for s in snippets)
+        st["q_emb"] = embed_queries(cfg, [question])[0]  # already in the query LRU from retrieve
+        hit = _answer_cache(cfg).get_similar(cfg, st["version"], st["ids"], st["q_emb"])
+        if hit is not None:
+            return {**hit, "cached": True}
+
+    st["snippets"] = snippets
+    st["prompt"] = _build_prompt(context, question)
+    st["options"] = {"num_ctx": num_ctx(cfg, st["prompt"])}
+    return None
+
+
+def _scoped(cfg: Config, filters: Optional[Filters]) -> Config:
+    # cached answers are not keyed by filters: scoped questions bypass the cache
+    return cfg if filters is None or filters.empty() else replace(cfg, answer_cache=False)
+
+
+def lookup(cfg: Config, question: str,
+           filters: Optional[Filters] = None) -> Tuple[Optional[Dict[str, Any]], Dict[str, Any]]:
+    """First step of `prepare` for callers that retrieve on their own (the async API).
+
+    Returns (response, state): `response` is an exact answer-cache hit or None; pass
+    `state` on to `after_retrieval` and `remember`. Reads the index version from disk,
+    so async callers should run it in a thread.
+    """
+    st = _new_state()
+    st["cfg"] = _scoped(cfg, filters)
+    return _lookup_exact(st["cfg"], question, st), st
+
+
+def after_retrieval(question: str, snippets: List[Dict[str, Any]],
+                    st: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Second step of `prepare`: build the prompt from `snippets` into `state`, or return
+    the response when no generation is needed (similar-answer hit, empty context,
+    ollama missing)."""
+    return _after_retrieval(st["cfg"], question, snippets, st)
+
+
+def prepare(cfg: Config, question: str,
+            filters: Optional[Filters] = None) -> Tuple[Optional[Dict[str, Any]], Dict[str, Any]]:
+    """Everything before generation, shared by `answer` and `answer_stream`.
+
+    Returns (response, state): `response` is set when the answer is already known
+    (cache hit, empty context, ollama missing); otherwise it is None and `state`
+    carries the snippets and prompt for generation.
+    """
+    done, st = lookup(cfg, question, filters)
+    if done is None:
+        with metrics.span("retrieve"):
+            snippets = retrieve(cfg, question, filters)
+        done = after_retrieval(question, snippets, st)
+    return done, st
+
+
+def remember(question: str, st: Dict[str, Any], txt: str) -> None:
+    """Cache `txt`, generated for `question` from a `prepare`/`lookup` state."""
+    _remember(st["cfg"], question, st, txt)
+
+
+def _remember(cfg: Config, question: str, st: Dict[str, Any], txt: str) -> None:
+    if cfg.answer_cache:
+        _answer_cache(cfg).put(cfg, st["version"], question, st["ids"], st["q_emb"],
+                               {"answer": txt, "sources": st["snippets"]})
+
+
+def answer(cfg: Config, question: str, filters: Optional[Filters] = None) -> Dict[str, Any]:
+    """Answer `question` from the index, optionally scoped by `filters`."""
+    done, st = prepare(cfg, question, filters)
+    if done is not None:
+        return done
 
     client = ollama.Client(host=cfg.ollama_host)
-    resp = client.generate(model=cfg.ollama_model, prompt=prompt, options={"num_ctx": 8192})
+    with metrics.span("generate"):
+        resp = client.generate(model=cfg.ollama_model, prompt=st["prompt"], options=st["options"])
+    metrics.count_tokens(resp)
     txt = resp.get("response", "")
-    return {"answer": txt, "sources": snippets}
\ No newline at end of file
+    remember(question, st, txt)
+    return {"answer": txt, "sources": st["snippets"], "cached": False}
+
+
+def answer_stream(cfg: Config, question: str, filters: Optional[Filters] = None) -> Iterator[Dict[str, Any]]:
+    """Streaming variant of `answer`. Yields events:
+
+    - {"type": "sources", "sources": [...]} as soon as retrieval is done
+    - {"type": "token", "text": "..."} for each piece Ollama produces
+    - {"type": "done", "cached": bool}
+    """
+    done, st = prepare(cfg, question, filters)
+    if done is not None:
+        yield {"type": "sources", "sources": done["sources"]}
+        yield {"type": "token", "text": done["answer"]}
+        yield {"type": "done", "cached": done["cached"]}
+        return
+
+    yield {"type": "sources", "sources": st["snippets"]}
+    client = ollama.Client(host=cfg.ollama_host)
+    parts = []
+    t0 = time.perf_counter()
+    for chunk in client.generate(model=cfg.ollama_model, prompt=st["prompt"],
+                                 options=st["options"], stream=True):
+        tok = chunk.get("response", "")
+        if tok:
+            if not parts:
+                metrics.record("first_token", time.perf_counter() - t0)
+            parts.append(tok)
+            yield {"type": "token", "text": tok}
+        if chunk.get("done"):
+            metrics.count_tokens(chunk)
+    metrics.record("generate", time.perf_counter() - t0)
+    remember(question, st, "".join(parts))
+    yield {"type": "done", "cached": False}
+
+
+def answer_many(
+    cfg: Config,
+    questions: List[str],
+    concurrency: Optional[int] = None,
+    batch_size: int = 64,
+) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    """Answer many questions; yields (index, response) as answers finish (not in order).
+
+    Retrieval runs in batches of `batch_size` (one encode and one Chroma query per
+    batch) and generation runs on `concurrency` threads (default
+    `cfg.max_concurrent_generations`) sharing one Ollama client. A failing question
+    yields a response with an "error" key instead of aborting the run.
+    """
+    conc = max(1, concurrency or cfg.max_concurrent_generations)
+    client = ollama.Client(host=cfg.ollama_host) if ollama is not None else None
+
+    def gen(q: str, st: Dict[str, Any]) -> Dict[str, Any]:
+        with metrics.span("generate"):
+            resp = client.generate(model=cfg.ollama_model, prompt=st["prompt"], options=st["options"])
+        metrics.count_tokens(resp)
+        txt = resp.get("response", "")
+        _remember(cfg, q, st, txt)
+        return {"answer": txt, "sources": st["snippets"], "cached": False}
+
+    def error(e: Exception) -> Dict[str, Any]:
+        return {"answer": "", "sources": [], "cached": False, "error": f"{type(e).__name__}: {e}"}
+
+    pending: Dict[Future, int] = {}
+    with ThreadPoolExecutor(max_workers=conc, thread_name_prefix="answer") as pool:
+        for start in range(0, len(questions), batch_size):
+            batch = list(range(start, min(len(questions), start + batch_size)))
+            states = {i: _new_state() for i in batch}
+            todo = []
+            for i in batch:
+                done = _lookup_exact(cfg, questions[i], states[i])
+                if done is not None:
+                    yield i, done
+                else:
+                    todo.append(i)
+            try:
+                results = retrieve_many(cfg, [questions[i] for i in todo])
+            except Exception as e:
+                for i in todo:
+                    yield i, error(e)
+                continue
+            for i, snippets in zip(todo, results):
+                try:
+                    done = _after_retrieval(cfg, questions[i], snippets, states[i])
+                except Exception as e:
+                    done = error(e)
+                if done is not None:
+                    yield i, done
+                else:
+                    pending[pool.submit(gen, questions[i], states[i])] = i
+            # keep a bounded backlog so the next batch is retrieved while this one generates
+            while len(pending) > 2 * conc:
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for fut in finished:
+                    i = pending.pop(fut)
+                    yield i, fut.result() if fut.exception() is None else error(fut.exception())
+        for fut in as_completed(list(pending)):
+            i = pending.pop(fut)
+            yield i, fut.result() if fut.exception() is None else error(fut.exception())
@@ -3,16 +3,22 @@
 from __future__ import annotations
 import os
 import glob
+import time
 import hashlib
-from typing import List
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
 
 from tqdm import tqdm
 
 from .config import Config
 from .logging_setup import logger
-from .text_extractor import iter_docs
-from .chunker import chunk_text, attach_metadata
-from .store import get_collection
+from . import metrics
+from .text_extractor import iter_docs, pdf_page_count
+from .chunker import ChunkSpec, iter_chunks, attach_metadata
+from .store import get_collection, get_embedding_function, bump_index_version
+from .embed_cache import open_embedder
+from .manifest import Manifest, manifest_path, file_sha256
+from .dedup import Deduper, dedup_path, disable_dedup
+from .catalog import compact_metadata, doc_type, folder_tags, tag_metadata
 
 
 SUPPORTED_EXTS = (".pdf", ".png", ".jpg", ".jpeg", ".tif", ".tiff", ".txt", ".md")
@@ -31,34 +37,380 @@ def _id_for(path: str, unit_id: str, chunk_idx: int) -> str:
     return hashlib.sha1(raw.encode("utf-8")).hexdigest()
 
 
-def ingest_dir(cfg: Config, docs_dir: str):
-    col, client = get_collection(cfg)
+def chunk_spec(cfg: Config) -> ChunkSpec:
+    if cfg.chunk_tokens > 0:
+        return ChunkSpec(cfg.chunk_tokens, cfg.chunk_overlap_tokens, cfg.embed_model)
+    return ChunkSpec(cfg.chunk_size, cfg.chunk_overlap)
 
-    paths = _doc_paths(docs_dir)
-    if not paths:
-        logger.warning(f"No supported documents found in {docs_dir}")
-        return
 
-    logger.info(f"Found {len(paths)} files. Ingesting → {cfg.db_dir} / {cfg.collection}")
+def _iter_chunks(cfg: Config, path: str, spec: ChunkSpec, pages=None, tags: Tuple[str, ...] = (),
+                 doc: int = 0):
+    """Yield (id, chunk, meta) for one file (or PDF page range), lazily: a streamed
+    text file is chunked as it is read. Extraction (including OCR waits and reading
+    streamed text) and chunking time are recorded once per file.
 
+    Chunk metadata is compact: the catalog id `doc` (path, type and page count live in
+    the catalog), the page, the chunk number, its token count and the folder tags."""
+    t = {"extract": 0.0, "chunk": 0.0}
+    tag_meta = tag_metadata(tags)
+
+    def timed(stream):
+        while True:
+            t0 = time.perf_counter()
+            piece = next(stream, None)
+            t["extract"] += time.perf_counter() - t0
+            if piece is None:
+                return
+            yield piece
+
+    docs = iter(iter_docs(path, pages=pages, cfg=cfg))
+    try:
+        while True:
+            t0 = time.perf_counter()
+            unit = next(docs, None)
+            t["extract"] += time.perf_counter() - t0
+            if unit is None:
+                break
+            unit_id, text, unit_meta = unit
+            meta = {"doc": doc, **tag_meta}
+            if unit_meta.get("page") is not None:
+                meta["page"] = unit_meta["page"]
+            pieces = [text] if isinstance(text, str) else timed(iter(text))
+            chunks = attach_metadata(iter_chunks(pieces, spec), meta)
+            i = 0
+            while True:
+                t0 = time.perf_counter()
+                x0 = t["extract"]
+                item = next(chunks, None)
+                # time spent reading the stream is extraction, not chunking
+                t["chunk"] += time.perf_counter() - t0 - (t["extract"] - x0)
+                if item is None:
+                    break
+                chunk, m = item
+                yield _id_for(path, unit_id, i), chunk, m
+                i += 1
+    finally:
+        metrics.record("ingest_extract", t["extract"])
+        metrics.record("ingest_chunk", t["chunk"])
+
+
+class _Job(NamedTuple):
+    """A new or changed file that needs (re-)ingesting."""
+    path: str
+    size: int
+    mtime_ns: int
+    sha: str
+    entry: Optional[dict]  # previous manifest row, None for new files
+    tags: Tuple[str, ...] = ()  # folder tags (catalog.folder_tags)
+    doc: int = 0  # catalog document id
+
+
+def _catalog(manifest: Manifest, path: str, tags: Tuple[str, ...], chunks: int) -> None:
+    pages = None
+    if doc_type(path) == "pdf":
+        try:
+            pages = pdf_page_count(path)
+        except Exception:
+            pass
+    manifest.put_doc(path, doc_type(path), pages, list(tags), chunks)
+
+
+def _record(col, manifest: Manifest, stats: Dict[str, int], job: _Job, ids: List[str],
+            dedup: Optional[Deduper] = None) -> None:
+    # Called once all of a file's chunks are written: drop chunk ids the new version no
+    # longer produces and remember the file in the manifest.
+    stale = set(job.entry["ids"]) - set(ids) if job.entry else set()
+    if stale:
+        if dedup is not None:
+            dedup.forget(col, sorted(stale))
+        col.delete(ids=sorted(stale))
+    manifest.put(job.path, job.size, job.mtime_ns, job.sha, ids)
+    _catalog(manifest, job.path, job.tags, len(ids))
+    stats["chunks"] += len(ids)
+    stats["changed" if job.entry else "new"] += 1
+
+
+def _record_failed(manifest: Manifest, stats: Dict[str, int], job: _Job, ids: List[str]) -> None:
+    # Keep the old chunk ids but poison the fingerprint so the next run retries the
+    # file and can still clean up whatever was written for it.
+    if job.entry or ids:
+        old = job.entry["ids"] if job.entry else []
+        manifest.put(job.path, -1, -1, "", sorted(set(old) | set(ids)))
+    stats["failed"] += 1
+
+
+def _dedup_batch(dedup: Optional[Deduper], ids: List[str], docs: List[str], metas: List[dict]):
+    # Drop near-duplicates before they are embedded; returns the rows left and the
+    # changes `_write` applies around them
+    if dedup is None:
+        return ids, docs, metas, None
+    keep, changes = dedup.filter(ids, docs, metas)
+    return [ids[i] for i in keep], [docs[i] for i in keep], [metas[i] for i in keep], changes
+
+
+def _write(col, dedup: Optional[Deduper], changes, ids, embs, docs, metas) -> None:
+    if changes is not None:
+        dedup.before_write(col, changes)
+    if ids:
+        col.upsert(ids=ids, embeddings=embs, documents=docs, metadatas=metas)
+    if changes is not None:
+        dedup.after_write(col, changes)
+
+
+# progress hooks for background jobs (see jobs.py): on_file(path, chunks, ok) once a
+# file is recorded; cancelled() is polled between files
+PROGRESS_S = 1.0
+OnFile = Callable[[str, int, bool], None]
+Cancelled = Callable[[], bool]
+
+
+def _ingest_serial(cfg: Config, col, embed, manifest: Manifest, jobs: List[_Job], stats: Dict[str, int],
+                   dedup: Optional[Deduper] = None, on_file: Optional[OnFile] = None,
+                   cancelled: Optional[Cancelled] = None) -> None:
     batch_ids, batch_docs, batch_metas = [], [], []
+    pending = []  # (job, ids, ok), recorded only once their chunks are written
     BATCH = 128  # small batches to keep memory low
+    last = [time.monotonic()]
 
-    for pth in tqdm(paths, desc="files"):
-        for unit_id, text, meta in iter_docs(pth):
-            chunks = chunk_text(text, cfg.chunk_size, cfg.chunk_overlap)
-            for i, (chunk, m) in enumerate(attach_metadata(chunks, meta)):
-                uid = _id_for(pth, unit_id, i)
+    def flush():
+        last[0] = time.monotonic()
+        if batch_ids:
+            ids, docs, metas, changes = _dedup_batch(dedup, batch_ids, batch_docs, batch_metas)
+            embs = []
+            if docs:
+                with metrics.span("ingest_embed"):
+                    embs = embed(docs)
+            with metrics.span("ingest_write"):
+                _write(col, dedup, changes, ids, embs, docs, metas)
+            batch_ids.clear(); batch_docs.clear(); batch_metas.clear()
+        for job, ids, ok in pending:
+            if ok:
+                _record(col, manifest, stats, job, ids, dedup)
+            else:
+                _record_failed(manifest, stats, job, ids)
+        manifest.commit()
+        if on_file is not None:
+            for job, ids, ok in pending:
+                on_file(job.path, len(ids), ok)
+        pending.clear()
+
+    for i, job in enumerate(tqdm(jobs, desc="files")):
+        if cancelled is not None and cancelled():
+            stats["cancelled"] = len(jobs) - i
+            break
+        ids, ok = [], True
+        try:
+            for uid, chunk, m in _iter_chunks(cfg, job.path, chunk_spec(cfg), tags=job.tags, doc=job.doc):
+                ids.append(uid)
                 batch_ids.append(uid)
                 batch_docs.append(chunk)
                 batch_metas.append(m)
                 if len(batch_ids) >= BATCH:
-                    col.add(ids=batch_ids, documents=batch_docs, metadatas=batch_metas)
-                    batch_ids, batch_docs, batch_metas = [], [], []
-    if batch_ids:
-        col.add(ids=batch_ids, documents=batch_docs, metadatas=batch_metas)
+                    flush()
+        except Exception as e:
+            logger.error(f"Extraction failed for {job.path}: {e}")
+            ok = False
+        pending.append((job, ids, ok))
+        # with a progress callback, finished files are reported at least every PROGRESS_S
+        if on_file is not None and time.monotonic() - last[0] >= PROGRESS_S:
+            flush()
+    flush()
+
 
-    # Persist
+def ingest_dir(cfg: Config, docs_dir: str, workers: Optional[int] = None,
+               on_file: Optional[OnFile] = None, cancelled: Optional[Cancelled] = None) -> Dict[str, int]:
+    """Incrementally sync `docs_dir` into the collection.
+
+    Files whose size and mtime match the manifest are skipped without being opened;
+    changed files are re-chunked, their new chunks upserted and stale chunk ids deleted;
+    files that disappeared from `docs_dir` are purged from the collection.
+
+    With `workers > 1` (default `cfg.ingest_workers`) new and changed files go through
+    the pipelined ingest in `pipeline.py` instead of the single-threaded loop.
+    """
+    return _run(cfg, docs_dir, None, workers, on_file, cancelled)
+
+
+def ingest_paths(cfg: Config, paths: List[str], workers: Optional[int] = None,
+                 on_file: Optional[OnFile] = None, cancelled: Optional[Cancelled] = None) -> Dict[str, int]:
+    """Like `ingest_dir`, but only for `paths` (e.g. freshly uploaded files); the rest
+    of the docs directory is not scanned. Listed paths that no longer exist are
+    removed from the collection. Tags are relative to `cfg.docs_dir`."""
+    paths = sorted({os.path.abspath(p) for p in paths if p.lower().endswith(SUPPORTED_EXTS)})
+    return _run(cfg, cfg.docs_dir, paths, workers, on_file, cancelled)
+
+
+def _run(cfg: Config, docs_dir: str, only: Optional[List[str]], workers: Optional[int],
+         on_file: Optional[OnFile], cancelled: Optional[Cancelled]) -> Dict[str, int]:
+    with metrics.trace() as tr:
+        stats = _sync(cfg, docs_dir, only, workers, on_file, cancelled)
+    for result in ("new", "changed", "unchanged", "removed", "failed"):
+        if stats[result]:
+            metrics.INGEST_FILES.inc(result, n=stats[result])
+    metrics.INGEST_CHUNKS.inc(n=stats["chunks"])
+    if tr:
+        metrics.log_breakdown("Ingest", tr, verbose=True)
+    return stats
+
+
+def _sync(cfg: Config, docs_dir: str, only: Optional[List[str]], workers: Optional[int],
+          on_file: Optional[OnFile] = None, cancelled: Optional[Cancelled] = None) -> Dict[str, int]:
+    # only=None syncs the whole of docs_dir; otherwise just the listed paths
+    with metrics.span("store_load"):
+        col, client = get_collection(cfg)
+    workers = cfg.ingest_workers if workers is None else workers
+
+    root = os.path.abspath(docs_dir)
+    paths = _doc_paths(docs_dir) if only is None else [p for p in only if os.path.isfile(p)]
+    stats = {"files": len(paths), "new": 0, "changed": 0, "unchanged": 0, "removed": 0,
+             "failed": 0, "chunks": 0, "cancelled": 0}
+
+    with metrics.span("store_load"):
+        ef = get_embedding_function(cfg)
+    cached = open_embedder(cfg, ef)
+    manifest = Manifest(manifest_path(cfg))
+    dedup = None
+    try:
+        # Chunking (and dedup) settings are part of the index identity: if they changed,
+        # every file has to be re-chunked even though its bytes did not.
+        chunking = chunk_spec(cfg).key() + (f":dedup{cfg.dedup_distance}" if cfg.dedup else "")
+        force = manifest.get_meta("chunking") not in (None, chunking)
+        # before any write: upserting onto a chunk merges its metadata, so legacy keys
+        # would otherwise survive re-ingestion
+        compact_metadata(cfg, col, manifest)
+        if force:
+            logger.info("Chunking settings changed since last ingest; re-chunking all files")
+            if only is not None:
+                # a partial run cannot leave the rest on the old settings: sync everything
+                paths = sorted(set(_doc_paths(docs_dir)) | set(paths))
+                stats["files"], only = len(paths), None
+        if cfg.dedup:
+            dedup = Deduper(cfg, cached or ef)
+            if force:
+                dedup.index.reset()
+        elif force and os.path.exists(dedup_path(cfg)):
+            disable_dedup(cfg, col)
+
+        live = set(paths)
+        known = manifest.paths_under(root) if only is None else [p for p in only if manifest.get(p)]
+        for gone in known:
+            if gone not in live:
+                old = manifest.get(gone)
+                if old and old["ids"]:
+                    if dedup is not None:
+                        dedup.forget(col, old["ids"])
+                    col.delete(ids=old["ids"])
+                manifest.remove(gone)
+                stats["removed"] += 1
+        manifest.commit()
+
+        if not paths:
+            if only is None:
+                logger.warning(f"No supported documents found in {docs_dir}")
+            return stats
+
+        jobs = []
+        for pth in paths:
+            st = os.stat(pth)
+            entry = manifest.get(pth)
+            tags = folder_tags(cfg, root, pth)
+            unchanged = bool(entry) and not force and entry["size"] == st.st_size and entry["mtime_ns"] == st.st_mtime_ns
+            sha = None
+            if entry and not force and not unchanged:
+                sha = file_sha256(pth)
+                if entry["sha"] == sha:
+                    # touched but identical: just refresh the stat fingerprint
+                    manifest.put(pth, st.st_size, st.st_mtime_ns, sha, entry["ids"])
+                    unchanged = True
+            if unchanged:
+                if not manifest.has_doc(pth):
+                    # indexed before the catalog existed: add it and tag its chunks in place
+                    if tags and entry["ids"]:
+                        col.update(ids=entry["ids"], metadatas=[tag_metadata(tags)] * len(entry["ids"]))
+                    _catalog(manifest, pth, tags, len(entry["ids"]))
+                stats["unchanged"] += 1
+                continue
+            jobs.append(_Job(pth, st.st_size, st.st_mtime_ns, sha or file_sha256(pth), entry, tags,
+                             manifest.doc_id(pth, doc_type(pth))))
+        manifest.commit()  # doc ids are visible to shard routing (catalog.doc_table)
+
+        logger.info(
+            f"Found {len(paths)} files ({len(jobs)} new or changed). "
+            f"Ingesting → {cfg.db_dir} / {cfg.collection}"
+        )
+        if jobs and workers > 1:
+            from .pipeline import run_pipeline
+            run_pipeline(cfg, col, cached or ef, manifest, jobs, stats, workers, dedup, on_file, cancelled)
+        elif jobs:
+            _ingest_serial(cfg, col, cached or ef, manifest, jobs, stats, dedup, on_file, cancelled)
+        if not stats["cancelled"]:
+            # a cancelled run may have left files on the old settings
+            manifest.set_meta("chunking", chunking)
+    finally:
+        manifest.close()
+        if dedup is not None:
+            stats.update(dedup.stats())
+            dedup.close()
+        if stats["new"] or stats["changed"] or stats["removed"] or stats["failed"]:
+            bump_index_version(cfg)
+        if cached is not None:
+            stats["embed_cache_hits"] = cached.stats()["hits"]
+            stats["embed_cache_misses"] = cached.stats()["misses"]
+            cached.close()
 
     count = col.count()
-    logger.info(f"Ingestion complete. Collection size: {count}")
\ No newline at end of file
+    logger.info(
+        f"Ingestion complete. new={stats['new']} changed={stats['changed']} "
+        f"unchanged={stats['unchanged']} removed={stats['removed']} failed={stats['failed']} "
+        f"cancelled={stats['cancelled']} chunks={stats['chunks']}. Collection size: {count}"
+    )
+    if cached is not None:
+        logger.info(
+            f"Embedding cache: {stats['embed_cache_hits']} hits, {stats['embed_cache_misses']} misses"
+        )
+    if dedup is not None:
+        share = 100.0 * stats["duplicates"] / max(1, stats["chunks"])
+        logger.info(
+            f"Dedup: skipped {stats['duplicates']} near-duplicate chunks ({share:.1f}% of {stats['chunks']}); "
+            f"{stats['duplicate_chars']} characters not embedded or stored"
+        )
+    return stats
+
+
+def rebuild_shard(cfg: Config, key: str, docs_dir: Optional[str] = None,
+                  workers: Optional[int] = None) -> Dict[str, int]:
+    """Re-index one shard from scratch without touching the others: drop its
+    collection, forget its files in the manifest and ingest them again.
+
+    `docs_dir` defaults to the shard's folder (folder sharding) or `cfg.docs_dir`.
+    """
+    if not cfg.shard_by:
+        raise ValueError("rebuild_shard needs a sharded collection (set Config.shard_by)")
+    from .shards import shard_key
+
+    col, _ = get_collection(cfg)
+    manifest = Manifest(manifest_path(cfg))
+    try:
+        dropped = [p for p in manifest.paths() if shard_key(cfg, p) == key]
+        if cfg.dedup and dropped:
+            # canonical chunks in this shard may stand in for duplicates elsewhere
+            ef = get_embedding_function(cfg)
+            cached = open_embedder(cfg, ef)
+            dedup = Deduper(cfg, cached or ef)
+            try:
+                dedup.forget(col, [cid for p in dropped for cid in manifest.get(p)["ids"]])
+            finally:
+                dedup.close()
+                if cached is not None:
+                    cached.close()
+        col.drop_shard(key)
+        for pth in dropped:
+            manifest.remove(pth)
+    finally:
+        manifest.close()
+    logger.info(f"Dropped shard {key!r} ({len(dropped)} files); re-ingesting")
+    if docs_dir is None:
+        sub = os.path.join(cfg.docs_dir, key)
+        docs_dir = sub if cfg.shard_by == "folder" and os.path.isdir(sub) else cfg.docs_dir
+    return ingest_dir(cfg, docs_dir, workers=workers)
+
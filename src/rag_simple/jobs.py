@@ -0,0 +1,317 @@
+"""Background ingestion jobs.
+
+`submit` queues a job in ``{db_dir}/{collection}.jobs.sqlite``: either a list of paths
+(ingested with `ingest.ingest_paths`, nothing else is scanned) or a full sync of a docs
+directory (`ingest.ingest_dir`). A `JobWorker` thread, one per process and job store
+(`ensure_worker`), claims queued jobs one at a time and runs them with the settings
+they were submitted with, recording per-file progress (chunks, bytes, seconds) so
+`get` can report progress and throughput. Queries keep being served from the same
+collection while a job writes to it.
+
+Jobs survive restarts: a running job whose worker stopped heartbeating for
+`STALE_S` is queued again (files it finished are unchanged by then and skipped).
+Only one job runs per store at a time, even with several processes. `cancel` drops a
+queued job, or stops a running one at the next file boundary; files already ingested
+stay in the index.
+"""
+from __future__ import annotations
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+import dataclasses
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+from .config import Config
+from .logging_setup import logger
+
+
+POLL_S = 1.0  # idle worker checks for new jobs this often
+HEARTBEAT_S = 5.0
+STALE_S = 60.0  # a running job without heartbeat for this long is re-queued
+
+
+def jobs_path(cfg: Config) -> str:
+    return os.path.join(cfg.db_dir, f"{cfg.collection}.jobs.sqlite")
+
+
+class JobStore:
+    """Job queue and progress in SQLite. Every call opens its own connection, so the
+    store keeps working after "Clear index" deletes and recreates `db_dir`."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    @contextmanager
+    def _db(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id TEXT PRIMARY KEY, docs_dir TEXT, paths TEXT, config TEXT, status TEXT,"
+                " created REAL, started REAL, finished REAL, heartbeat REAL, cancel INTEGER DEFAULT 0,"
+                " files_total INTEGER, files_done INTEGER DEFAULT 0, files_failed INTEGER DEFAULT 0,"
+                " chunks INTEGER DEFAULT 0, bytes INTEGER DEFAULT 0, stats TEXT, error TEXT)"
+            )
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS job_files ("
+                " job_id TEXT, path TEXT, status TEXT, chunks INTEGER, bytes INTEGER, seconds REAL,"
+                " PRIMARY KEY (job_id, path))"
+            )
+            yield db
+        finally:
+            db.close()
+
+    def submit(self, cfg: Config, paths: Optional[List[str]] = None, docs_dir: Optional[str] = None) -> str:
+        """Queue ingesting `paths`, or (paths=None) a full sync of `docs_dir`
+        (default `cfg.docs_dir`). Returns the job id."""
+        jid = uuid.uuid4().hex[:12]
+        docs_dir = os.path.abspath(docs_dir or cfg.docs_dir)
+        paths = None if paths is None else [os.path.abspath(p) for p in paths]
+        with self._db() as db:
+            db.execute("BEGIN IMMEDIATE")
+            db.execute(
+                "INSERT INTO jobs (id, docs_dir, paths, config, status, created, files_total)"
+                " VALUES (?, ?, ?, ?, 'queued', ?, ?)",
+                (jid, docs_dir, None if paths is None else json.dumps(paths),
+                 json.dumps(dataclasses.asdict(cfg)), time.time(), None if paths is None else len(paths)),
+            )
+            db.executemany(
+                "INSERT OR IGNORE INTO job_files (job_id, path, status) VALUES (?, ?, 'pending')",
+                [(jid, p) for p in paths or []],
+            )
+            db.execute("COMMIT")
+        logger.info(f"Queued ingest job {jid}: " + (f"{len(paths)} files" if paths is not None else docs_dir))
+        return jid
+
+    def claim(self) -> Optional[Dict[str, Any]]:
+        """Start the oldest queued job, unless one is already running."""
+        now = time.time()
+        with self._db() as db:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                stale = db.execute(
+                    "UPDATE jobs SET status = 'queued' WHERE status = 'running' AND heartbeat < ?",
+                    (now - STALE_S,),
+                ).rowcount
+                if stale:
+                    logger.warning(f"Re-queued {stale} ingest job(s) whose worker stopped")
+                if db.execute("SELECT 1 FROM jobs WHERE status = 'running'").fetchone():
+                    return None
+                row = db.execute(
+                    "SELECT id FROM jobs WHERE status = 'queued' ORDER BY created LIMIT 1"
+                ).fetchone()
+                if row is None:
+                    return None
+                db.execute(
+                    "UPDATE jobs SET status = 'running', started = COALESCE(started, ?), heartbeat = ?"
+                    " WHERE id = ?", (now, now, row[0]),
+                )
+                return self._job(db.execute(
+                    f"SELECT {', '.join(self._COLS)} FROM jobs WHERE id = ?", (row[0],)
+                ).fetchone())
+            finally:
+                db.execute("COMMIT")
+
+    def heartbeat(self, jid: str) -> None:
+        with self._db() as db:
+            db.execute("UPDATE jobs SET heartbeat = ? WHERE id = ?", (time.time(), jid))
+
+    def file_done(self, jid: str, path: str, chunks: int, ok: bool, seconds: float) -> None:
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        with self._db() as db:
+            db.execute("BEGIN IMMEDIATE")
+            row = ("done" if ok else "failed", chunks, size, seconds, jid, path)
+            if not db.execute(
+                "UPDATE job_files SET status = ?, chunks = ?, bytes = ?, seconds = ? WHERE job_id = ? AND path = ?",
+                row,
+            ).rowcount:
+                db.execute(
+                    "INSERT INTO job_files (status, chunks, bytes, seconds, job_id, path) VALUES (?, ?, ?, ?, ?, ?)",
+                    row,
+                )
+            db.execute(
+                "UPDATE jobs SET files_done = files_done + 1, files_failed = files_failed + ?,"
+                " chunks = chunks + ?, bytes = bytes + ?, heartbeat = ? WHERE id = ?",
+                (0 if ok else 1, chunks, size, time.time(), jid),
+            )
+            db.execute("COMMIT")
+
+    def finish(self, jid: str, status: str, stats: Optional[Dict[str, Any]] = None,
+               error: Optional[str] = None) -> None:
+        with self._db() as db:
+            db.execute("BEGIN IMMEDIATE")
+            db.execute(
+                "UPDATE jobs SET status = ?, finished = ?, stats = ?, error = ? WHERE id = ?",
+                (status, time.time(), json.dumps(stats) if stats is not None else None, error, jid),
+            )
+            # listed files the run did not touch were unchanged (or never reached)
+            db.execute(
+                "UPDATE job_files SET status = ? WHERE job_id = ? AND status = 'pending'",
+                ("skipped" if status == "cancelled" else "unchanged", jid),
+            )
+            db.execute("COMMIT")
+
+    def cancel(self, jid: str) -> Optional[str]:
+        """Cancel a job; returns its status afterwards (None if unknown)."""
+        with self._db() as db:
+            db.execute("BEGIN IMMEDIATE")
+            db.execute(
+                "UPDATE jobs SET status = 'cancelled', finished = ? WHERE id = ? AND status = 'queued'",
+                (time.time(), jid),
+            )
+            db.execute("UPDATE jobs SET cancel = 1 WHERE id = ? AND status = 'running'", (jid,))
+            row = db.execute("SELECT status FROM jobs WHERE id = ?", (jid,)).fetchone()
+            db.execute("COMMIT")
+        return row[0] if row else None
+
+    def cancel_requested(self, jid: str) -> bool:
+        with self._db() as db:
+            row = db.execute("SELECT cancel FROM jobs WHERE id = ?", (jid,)).fetchone()
+        return bool(row and row[0])
+
+    _COLS = ("id", "docs_dir", "paths", "config", "status", "created", "started", "finished",
+             "heartbeat", "cancel", "files_total", "files_done", "files_failed", "chunks", "bytes",
+             "stats", "error")
+
+    def _job(self, row, public: bool = False) -> Dict[str, Any]:
+        job = dict(zip(self._COLS, row))
+        for k in ("paths", "config", "stats"):
+            job[k] = json.loads(job[k]) if job[k] else None
+        if public:
+            del job["config"], job["heartbeat"]
+        end = job["finished"] or time.time()
+        elapsed = max(1e-9, end - job["started"]) if job["started"] else 0.0
+        job["elapsed_s"] = round(elapsed, 3)
+        job["files_per_s"] = round(job["files_done"] / elapsed, 3) if elapsed else 0.0
+        job["chunks_per_s"] = round(job["chunks"] / elapsed, 2) if elapsed else 0.0
+        job["mb_per_s"] = round(job["bytes"] / elapsed / 1e6, 3) if elapsed else 0.0
+        return job
+
+    def get(self, jid: str) -> Optional[Dict[str, Any]]:
+        """Job status, progress, throughput and per-file results."""
+        with self._db() as db:
+            row = db.execute(f"SELECT {', '.join(self._COLS)} FROM jobs WHERE id = ?", (jid,)).fetchone()
+            if row is None:
+                return None
+            job = self._job(row, public=True)
+            job["files"] = [
+                {"path": r[0], "status": r[1], "chunks": r[2], "bytes": r[3], "seconds": r[4]}
+                for r in db.execute(
+                    "SELECT path, status, chunks, bytes, seconds FROM job_files WHERE job_id = ?"
+                    " ORDER BY rowid", (jid,),
+                )
+            ]
+        return job
+
+    def list(self, limit: int = 20) -> List[Dict[str, Any]]:
+        with self._db() as db:
+            rows = db.execute(
+                f"SELECT {', '.join(self._COLS)} FROM jobs ORDER BY created DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [self._job(r, public=True) for r in rows]
+
+
+def _config(saved: Dict[str, Any]) -> Config:
+    names = {f.name for f in dataclasses.fields(Config)}
+    return Config(**{k: v for k, v in saved.items() if k in names})
+
+
+class JobWorker:
+    """Runs queued jobs of one store on a daemon thread."""
+
+    def __init__(self, store: JobStore):
+        self.store = store
+        self.current: Optional[str] = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name="ingest-jobs", daemon=True)
+        self._beat = threading.Thread(target=self._heartbeat, name="ingest-jobs-heartbeat", daemon=True)
+
+    def start(self) -> "JobWorker":
+        self._thread.start()
+        self._beat.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _heartbeat(self) -> None:
+        while not self._stop.wait(HEARTBEAT_S):
+            jid = self.current
+            if jid is not None:
+                try:
+                    self.store.heartbeat(jid)
+                except Exception as e:
+                    logger.debug(f"Job heartbeat failed: {e}")
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            try:
+                job = self.store.claim()
+            except Exception as e:
+                logger.error(f"Could not read the ingest job queue: {e}")
+                job = None
+            if job is None:
+                self._stop.wait(POLL_S)
+                continue
+            self.current = job["id"]
+            try:
+                self._run(job)
+            finally:
+                self.current = None
+
+    def _run(self, job: Dict[str, Any]) -> None:
+        from .ingest import ingest_dir, ingest_paths
+
+        jid, cfg = job["id"], _config(job["config"])
+        last = [time.monotonic()]
+
+        def on_file(path: str, chunks: int, ok: bool) -> None:
+            now = time.monotonic()
+            self.store.file_done(jid, path, chunks, ok, round(now - last[0], 3))
+            last[0] = now
+
+        def cancelled() -> bool:
+            return self._stop.is_set() or self.store.cancel_requested(jid)
+
+        logger.info(f"Running ingest job {jid}")
+        try:
+            if job["paths"] is not None:
+                stats = ingest_paths(cfg, job["paths"], on_file=on_file, cancelled=cancelled)
+            else:
+                stats = ingest_dir(cfg, job["docs_dir"], on_file=on_file, cancelled=cancelled)
+        except Exception as e:
+            logger.exception(f"Ingest job {jid} failed")
+            self.store.finish(jid, "failed", error=f"{type(e).__name__}: {e}")
+            return
+        self.store.finish(jid, "cancelled" if stats.get("cancelled") else "done", stats)
+        logger.info(f"Ingest job {jid} finished: {stats}")
+
+
+_WORKERS: Dict[str, JobWorker] = {}
+_LOCK = threading.Lock()
+
+
+def store(cfg: Config) -> JobStore:
+    return JobStore(jobs_path(cfg))
+
+
+def ensure_worker(cfg: Config) -> JobWorker:
+    """Start this process's worker for `cfg`'s job store (once)."""
+    key = os.path.abspath(jobs_path(cfg))
+    with _LOCK:
+        w = _WORKERS.get(key)
+        if w is None or not w._thread.is_alive():
+            w = _WORKERS[key] = JobWorker(JobStore(key)).start()
+        return w
+
+
+def submit(cfg: Config, paths: Optional[List[str]] = None, docs_dir: Optional[str] = None) -> str:
+    """Queue a job and make sure a worker in this process will pick it up."""
+    jid = store(cfg).submit(cfg, paths, docs_dir)
+    ensure_worker(cfg)
+    return jid
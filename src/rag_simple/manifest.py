@@ -0,0 +1,143 @@
+from __future__ import annotations
+import os
+import json
+import time
+import sqlite3
+import hashlib
+from typing import Dict, List, Optional, Any
+from urllib.request import pathname2url
+
+from .config import Config
+
+
+def manifest_path(cfg: Config) -> str:
+    # Lives inside db_dir so "Clear index" (which deletes db_dir) also resets it
+    return os.path.join(cfg.db_dir, f"{cfg.collection}.manifest.sqlite")
+
+
+def file_sha256(path: str, bufsize: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(bufsize), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class Manifest:
+    """Per-collection record of ingested files: (path, size, mtime, sha256, chunk ids).
+
+    Used by `ingest_dir` to skip unchanged files without opening them and to know which
+    chunk ids to delete when a file changes or disappears. Also holds the document
+    catalog (`catalog.py`).
+    """
+
+    def __init__(self, path: str, readonly: bool = False):
+        self.path = path
+        if readonly:
+            # query-time catalog lookups: no schema setup, so no write lock that would
+            # compete with a running ingest
+            uri = "file:" + pathname2url(os.path.abspath(path)) + "?mode=ro"
+            self._db = sqlite3.connect(uri, uri=True, check_same_thread=False)
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            " path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, sha TEXT, ids TEXT)"
+        )
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        # document catalog (see catalog.py): one row per file. Chunk metadata refers to a
+        # document by its integer doc_id; AUTOINCREMENT keeps ids of removed files unused
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS docs ("
+            " doc_id INTEGER PRIMARY KEY AUTOINCREMENT, path TEXT UNIQUE, type TEXT, pages INTEGER,"
+            " tags TEXT, chunks INTEGER, ingested_at REAL)"
+        )
+        self._db.commit()
+
+    def get(self, path: str) -> Optional[Dict[str, Any]]:
+        row = self._db.execute(
+            "SELECT size, mtime_ns, sha, ids FROM files WHERE path = ?", (path,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {"size": row[0], "mtime_ns": row[1], "sha": row[2], "ids": json.loads(row[3])}
+
+    def put(self, path: str, size: int, mtime_ns: int, sha: str, ids: List[str]) -> None:
+        self._db.execute(
+            "INSERT OR REPLACE INTO files (path, size, mtime_ns, sha, ids) VALUES (?, ?, ?, ?, ?)",
+            (path, size, mtime_ns, sha, json.dumps(ids)),
+        )
+
+    def remove(self, path: str) -> None:
+        self._db.execute("DELETE FROM files WHERE path = ?", (path,))
+        self._db.execute("DELETE FROM docs WHERE path = ?", (path,))
+
+    def doc_id(self, path: str, type: str) -> int:
+        """The document id of `path`, allocated on first use (before its chunks are
+        written); the catalog row is completed by `put_doc` once the file is ingested."""
+        self._db.execute("INSERT OR IGNORE INTO docs (path, type) VALUES (?, ?)", (path, type))
+        return self._db.execute("SELECT doc_id FROM docs WHERE path = ?", (path,)).fetchone()[0]
+
+    def put_doc(self, path: str, type: str, pages: Optional[int], tags: List[str], chunks: int) -> int:
+        doc_id = self.doc_id(path, type)
+        self._db.execute(
+            "UPDATE docs SET type = ?, pages = ?, tags = ?, chunks = ?, ingested_at = ? WHERE doc_id = ?",
+            (type, pages, json.dumps(list(tags)), chunks, time.time(), doc_id),
+        )
+        return doc_id
+
+    def has_doc(self, path: str) -> bool:
+        row = self._db.execute("SELECT chunks FROM docs WHERE path = ?", (path,)).fetchone()
+        return row is not None and row[0] is not None
+
+    def docs(self) -> List[Dict[str, Any]]:
+        rows = self._db.execute(
+            "SELECT doc_id, path, type, pages, tags, chunks, ingested_at FROM docs"
+            " WHERE chunks IS NOT NULL ORDER BY path"
+        ).fetchall()
+        return [{"doc_id": r[0], "source": r[1], "type": r[2], "pages": r[3], "tags": json.loads(r[4]),
+                 "chunks": r[5], "ingested_at": r[6]} for r in rows]
+
+    def catalog(self) -> List[Dict[str, Any]]:
+        """Every catalog row with its file record (size, mtime, sha), for snapshots."""
+        rows = self._db.execute(
+            "SELECT d.doc_id, d.path, d.type, d.pages, d.tags, d.chunks, d.ingested_at, f.size, f.mtime_ns, f.sha"
+            " FROM docs d LEFT JOIN files f ON f.path = d.path ORDER BY d.doc_id"
+        ).fetchall()
+        keys = ("doc_id", "path", "type", "pages", "tags", "chunks", "ingested_at", "size", "mtime_ns", "sha")
+        return [dict(zip(keys, r)) for r in rows]
+
+    def restore_doc(self, row: Dict[str, Any]) -> None:
+        """Insert a `catalog` row under its original doc_id (snapshot import)."""
+        self._db.execute(
+            "INSERT OR REPLACE INTO docs (doc_id, path, type, pages, tags, chunks, ingested_at)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (row["doc_id"], row["path"], row["type"], row["pages"], row["tags"], row["chunks"], row["ingested_at"]),
+        )
+
+    def doc_paths(self) -> Dict[int, str]:
+        """doc_id -> path of every document with an id, ingested or not (yet)."""
+        return dict(self._db.execute("SELECT doc_id, path FROM docs").fetchall())
+
+    def paths(self) -> List[str]:
+        return [r[0] for r in self._db.execute("SELECT path FROM files").fetchall()]
+
+    def paths_under(self, root: str) -> List[str]:
+        prefix = os.path.join(os.path.abspath(root), "")
+        rows = self._db.execute("SELECT path FROM files").fetchall()
+        return [r[0] for r in rows if r[0].startswith(prefix)]
+
+    def get_meta(self, key: str) -> Optional[str]:
+        row = self._db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value: str) -> None:
+        self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def commit(self) -> None:
+        self._db.commit()
+
+    def close(self) -> None:
+        self._db.commit()
+        self._db.close()
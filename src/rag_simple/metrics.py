@@ -0,0 +1,184 @@
+"""Timing spans and Prometheus metrics (text exposition, no extra dependency).
+
+- `span(stage)` times a block: the duration goes into the `rag_stage_seconds`
+  histogram and, when a `trace()` is active in the current context, into that trace's
+  per-stage totals (used for the per-request breakdown of `/ask` and the per-file and
+  per-run breakdowns of ingest).
+- `observe_trace` records the totals of a trace collected elsewhere (e.g. returned by
+  an ingest worker process) as one observation per stage.
+
+Metrics are per process: with several API workers each one reports its own.
+"""
+from __future__ import annotations
+import time
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, Optional, Sequence, Tuple
+
+from .logging_setup import logger
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_LOCK = threading.Lock()
+_TRACE: ContextVar[Optional[Dict[str, float]]] = ContextVar("rag_trace", default=None)
+
+
+def _labels(names: Sequence[str], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{v}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, doc: str, labelnames: Sequence[str] = ()):
+        self.name, self.doc, self.labelnames = name, doc, tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        _REGISTRY.append(self)
+
+    def inc(self, *labels: str, n: float = 1.0) -> None:
+        with _LOCK:
+            self._values[labels] = self._values.get(labels, 0.0) + n
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.doc}"
+        yield f"# TYPE {self.name} counter"
+        for labels, v in sorted(self._values.items()):
+            yield f"{self.name}{_labels(self.labelnames, labels)} {v}"
+
+
+class Gauge:
+    def __init__(self, name: str, doc: str):
+        self.name, self.doc = name, doc
+        self._value = 0.0
+        _REGISTRY.append(self)
+
+    def set(self, value: float) -> None:
+        with _LOCK:
+            self._value = value
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.doc}"
+        yield f"# TYPE {self.name} gauge"
+        yield f"{self.name} {self._value}"
+
+
+class Histogram:
+    def __init__(self, name: str, doc: str, labelnames: Sequence[str] = (), buckets=BUCKETS):
+        self.name, self.doc, self.labelnames = name, doc, tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series: Dict[Tuple[str, ...], list] = {}  # labels -> [bucket counts..., count, sum]
+        _REGISTRY.append(self)
+
+    def observe(self, *labels: str, value: float) -> None:
+        with _LOCK:
+            s = self._series.get(labels)
+            if s is None:
+                s = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, b in enumerate(self.buckets):
+                if value <= b:
+                    s[i] += 1
+            s[-2] += 1
+            s[-1] += value
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.doc}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, s in sorted(self._series.items()):
+            for b, c in zip(self.buckets, s):
+                le = _labels(self.labelnames, labels, f'le="{b}"')
+                yield f"{self.name}_bucket{le} {c}"
+            le = _labels(self.labelnames, labels, 'le="+Inf"')
+            yield f"{self.name}_bucket{le} {s[-2]}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {s[-2]}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {s[-1]}"
+
+
+_REGISTRY: list = []
+
+STAGE_SECONDS = Histogram("rag_stage_seconds", "Time spent per pipeline stage.", ("stage",))
+REQUEST_SECONDS = Histogram("rag_request_seconds", "End-to-end API request time.", ("route",))
+REQUESTS = Counter("rag_requests_total", "API requests by route and outcome.", ("route", "outcome"))
+LLM_TOKENS = Counter("rag_llm_tokens_total", "Tokens reported by Ollama.", ("kind",))
+INGEST_FILES = Counter("rag_ingest_files_total", "Files seen by ingest, by result.", ("result",))
+INGEST_CHUNKS = Counter("rag_ingest_chunks_total", "Chunks written by ingest.")
+INDEX_LAG = Histogram("rag_index_lag_seconds", "Watch mode: time from a file change being seen to it being indexed.")
+WATCH_PENDING = Gauge("rag_watch_pending_files", "Watch mode: changed paths waiting to be indexed.")
+
+
+def add(stage: str, seconds: float) -> None:
+    tr = _TRACE.get()
+    if tr is not None:
+        with _LOCK:
+            tr[stage] = tr.get(stage, 0.0) + seconds
+
+
+def record(stage: str, seconds: float) -> None:
+    STAGE_SECONDS.observe(stage, value=seconds)
+    add(stage, seconds)
+
+
+@contextmanager
+def span(stage: str):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - t0)
+
+
+@contextmanager
+def trace():
+    """Collect per-stage totals for everything timed in this context (including
+    `asyncio.to_thread` calls made from it). Totals are folded into an enclosing
+    trace when this one ends."""
+    parent = _TRACE.get()
+    tr: Dict[str, float] = {}
+    tok = _TRACE.set(tr)
+    try:
+        yield tr
+    finally:
+        _TRACE.reset(tok)
+        if parent is not None:
+            with _LOCK:
+                for k, v in tr.items():
+                    parent[k] = parent.get(k, 0.0) + v
+
+
+def detach() -> None:
+    """Stop recording into the inherited trace (for work done on behalf of many requests)."""
+    _TRACE.set(None)
+
+
+def observe_trace(tr: Dict[str, float]) -> None:
+    """Record each stage total of `tr` (histogram and active trace)."""
+    for stage, seconds in tr.items():
+        record(stage, seconds)
+
+
+def count_tokens(resp) -> None:
+    """Count prompt/completion tokens from a final Ollama response (if reported)."""
+    for kind, key in (("prompt", "prompt_eval_count"), ("completion", "eval_count")):
+        n = resp.get(key) if resp is not None else None
+        if n:
+            LLM_TOKENS.inc(kind, n=n)
+
+
+def breakdown_ms(tr: Dict[str, float]) -> Dict[str, float]:
+    return {k: round(v * 1000.0, 3) for k, v in tr.items()}
+
+
+def log_breakdown(what: str, tr: Dict[str, float], verbose: bool = False) -> None:
+    text = " ".join(f"{k}={v:.1f}ms" for k, v in breakdown_ms(tr).items())
+    (logger.info if verbose else logger.debug)(f"{what} timings: {text}")
+
+
+def render() -> str:
+    lines = []
+    for m in _REGISTRY:
+        lines.extend(m.render())
+    return "\n".join(lines) + "\n"
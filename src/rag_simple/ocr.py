@@ -0,0 +1,179 @@
+"""OCR for text-less PDF pages and images.
+
+- Results are cached on disk, keyed by a hash of the rendered page (or the image file)
+  bytes, so re-ingesting an unchanged scan never runs Tesseract again.
+- PDF pages are first rendered at `Config.ocr_dpi_low`; only when Tesseract's mean word
+  confidence is below `Config.ocr_min_conf` is the page re-rendered at
+  `Config.ocr_dpi_high` and OCR'd again (the more confident result wins).
+- Tesseract runs on a dedicated thread pool (each call is a subprocess, so threads
+  overlap fine) with a per-page timeout, so one pathological drawing cannot stall a run.
+"""
+from __future__ import annotations
+import os
+import io
+import sqlite3
+import hashlib
+import threading
+import contextvars
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor, Future, TimeoutError as FutureTimeout
+from typing import Dict, Optional, Tuple, Union
+
+from .config import Config
+from .logging_setup import logger
+from . import metrics
+
+# pytesseract and Pillow are imported on first OCR call; only check they are present
+HAS_OCR = all(importlib.util.find_spec(m) is not None for m in ("pytesseract", "PIL"))
+if not HAS_OCR:
+    logger.warning("pytesseract/Pillow not found; OCR will be disabled.")
+
+
+# thread pools and result caches, shared by every config with the same
+# (ocr_workers, ocr_cache_dir), as `retrieve._query_cache` does for query embeddings
+_RESOURCES: Dict[Tuple[int, str], Tuple[ThreadPoolExecutor, "OcrCache"]] = {}
+_RESOURCES_LOCK = threading.Lock()
+
+
+class OcrCache:
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        # several ingest worker processes may share the file
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS ocr (key TEXT PRIMARY KEY, text TEXT, conf REAL, dpi INTEGER)"
+        )
+        self._db.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._db.execute("SELECT text FROM ocr WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def put(self, key: str, text: str, conf: float, dpi: int) -> None:
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO ocr VALUES (?, ?, ?, ?)", (key, text, conf, dpi))
+            self._db.commit()
+
+
+def _resources(cfg: Config) -> Tuple[ThreadPoolExecutor, OcrCache]:
+    key = (max(1, cfg.ocr_workers), os.path.abspath(cfg.ocr_cache_dir))
+    with _RESOURCES_LOCK:
+        res = _RESOURCES.get(key)
+        if res is None:
+            pool = ThreadPoolExecutor(max_workers=key[0], thread_name_prefix="ocr")
+            res = _RESOURCES[key] = (pool, OcrCache(os.path.join(key[1], "ocr.sqlite")))
+        return res
+
+
+def _key(data: bytes, lang: str) -> str:
+    return hashlib.sha256(data).hexdigest() + ":" + lang
+
+
+def _ocr_bytes(data: bytes, lang: str, timeout: float) -> Tuple[str, float]:
+    """Run Tesseract on encoded image bytes; returns (text, mean word confidence)."""
+    import pytesseract
+    from PIL import Image
+
+    with metrics.span("ingest_ocr"):
+        img = Image.open(io.BytesIO(data))
+        d = pytesseract.image_to_data(img, lang=lang, output_type=pytesseract.Output.DICT, timeout=timeout)
+    lines, confs = {}, []
+    for i, word in enumerate(d["text"]):
+        conf = float(d["conf"][i])
+        if conf < 0 or not word.strip():
+            continue
+        confs.append(conf)
+        key = (d["block_num"][i], d["par_num"][i], d["line_num"][i])
+        lines.setdefault(key, []).append(word.strip())
+    text = "\n".join(" ".join(ws) for _, ws in sorted(lines.items()))
+    return text, (sum(confs) / len(confs) if confs else 0.0)
+
+
+def _submit(pool: ThreadPoolExecutor, data: bytes, cfg: Config) -> Future:
+    # carry the caller's context so OCR time lands in its ingest trace
+    ctx = contextvars.copy_context()
+    return pool.submit(ctx.run, _ocr_bytes, data, cfg.ocr_lang, cfg.ocr_timeout)
+
+
+# confidence values `_wait` reports instead of a result: a timeout is a property of the
+# page and is cached; any other failure (no tesseract binary, missing module, bad image)
+# may be fixed before the next run, so it is not
+TIMED_OUT = -1.0
+FAILED = -2.0
+
+
+def _wait(fut: Future, timeout: float, what: str) -> Tuple[str, float]:
+    try:
+        return fut.result(timeout=timeout + 5)
+    except FutureTimeout as e:
+        logger.warning(f"OCR timed out on {what}: {e}")
+        return "", TIMED_OUT
+    except Exception as e:
+        # pytesseract raises a plain RuntimeError when it kills a tesseract call on
+        # timeout; its TesseractError is a RuntimeError too
+        if type(e) is RuntimeError and "timeout" in str(e).lower():
+            logger.warning(f"OCR timed out on {what}: {e}")
+            return "", TIMED_OUT
+        logger.warning(f"OCR failed on {what}: {e}")
+        return "", FAILED
+
+
+class PageOcr:
+    """Low-res OCR of one PDF page, started in the background by `submit_page`."""
+
+    def __init__(self, key: str, what: str, fut: Future):
+        self.key = key
+        self.what = what
+        self.fut = fut
+
+    def result(self, cfg: Config, page) -> str:
+        """Wait for the low-res pass and escalate to high DPI if confidence is low.
+        `page` must be the same fitz page; rendering stays on the caller's thread."""
+        pool, cache = _resources(cfg)
+        text, conf = _wait(self.fut, cfg.ocr_timeout, self.what)
+        dpi = cfg.ocr_dpi_low
+        failed = conf == FAILED
+        if 0 <= conf < cfg.ocr_min_conf and cfg.ocr_dpi_high > cfg.ocr_dpi_low:
+            png = page.get_pixmap(dpi=cfg.ocr_dpi_high).tobytes("png")
+            fut = _submit(pool, png, cfg)
+            hi_text, hi_conf = _wait(fut, cfg.ocr_timeout, self.what)
+            failed = hi_conf == FAILED
+            if hi_conf > conf:
+                text, conf, dpi = hi_text, hi_conf, cfg.ocr_dpi_high
+        # timeouts are cached too (as empty text) so re-runs skip the pathological page
+        if not failed:
+            cache.put(self.key, text, conf, dpi)
+        return text
+
+
+def submit_page(cfg: Config, page, what: str) -> Union[str, PageOcr]:
+    """Cached OCR text for `page`, or a PageOcr whose low-res pass is already running."""
+    pool, cache = _resources(cfg)
+    png = page.get_pixmap(dpi=cfg.ocr_dpi_low).tobytes("png")
+    key = _key(png, cfg.ocr_lang)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+    return PageOcr(key, what, _submit(pool, png, cfg))
+
+
+def ocr_image_file(cfg: Config, path: str) -> str:
+    pool, cache = _resources(cfg)
+    with open(path, "rb") as f:
+        data = f.read()
+    key = _key(data, cfg.ocr_lang)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+    text, conf = _wait(_submit(pool, data, cfg), cfg.ocr_timeout, path)
+    if conf != FAILED:
+        cache.put(key, text, conf, 0)
+    return text
+
+
+def window_size(cfg: Config) -> int:
+    # how many pages may be rendered and queued for OCR ahead of the one being yielded
+    return max(1, cfg.ocr_workers) * 2
@@ -0,0 +1,243 @@
+"""Pipelined ingestion: extract → chunk → embed → write.
+
+Extraction and chunking run in a process pool (PyMuPDF parsing and Tesseract OCR are
+CPU-bound); large PDFs are split into page-range shards so one big file can use several
+workers. A single embedding thread batches chunks through the resident embedding model
+(behind the persistent embedding cache, if enabled) and a single writer thread upserts
+into Chroma and updates the manifest. Stages are connected by bounded queues, so memory
+stays proportional to the queue sizes and the number of in-flight extraction tasks
+rather than to the corpus.
+"""
+from __future__ import annotations
+import queue
+import threading
+import contextvars
+import multiprocessing as mp
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from typing import Dict, List, Optional, Tuple
+
+from tqdm import tqdm
+
+from .config import Config
+from .logging_setup import logger
+from . import metrics
+from .text_extractor import pdf_page_count
+from .manifest import Manifest
+from .ingest import _Job, _iter_chunks, _record, _record_failed, _dedup_batch, _write, chunk_spec
+from .chunker import ChunkSpec
+
+
+BATCH = 128
+STREAM_TEXT_BYTES = 8 << 20  # text files above this are chunked in the parent as they stream
+_DONE = object()
+
+
+def _extract(cfg: Config, path: str, pages: Optional[Tuple[int, int]], spec: ChunkSpec,
+             tags: Tuple[str, ...] = (), doc: int = 0):
+    # Runs in a worker process: returns ([(id, chunk, meta), ...], stage timings) for one
+    # file or shard; the timings are recorded by the parent, whose metrics are served
+    with metrics.trace() as tr:
+        items = list(_iter_chunks(cfg, path, spec, pages, tags, doc))
+    return items, tr
+
+
+def _shards(path: str, shard_pages: int) -> List[Optional[Tuple[int, int]]]:
+    if shard_pages > 0 and path.lower().endswith(".pdf"):
+        try:
+            n = pdf_page_count(path)
+        except Exception:
+            return [None]  # let the worker hit (and report) the error
+        if n > shard_pages:
+            return [(s, min(n, s + shard_pages)) for s in range(0, n, shard_pages)]
+    return [None]
+
+
+def _put(q: queue.Queue, item, stop: threading.Event) -> None:
+    # Blocking put that gives up if another stage failed, so nothing deadlocks
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.5)
+            return
+        except queue.Full:
+            continue
+
+
+def _get(q: queue.Queue, stop: threading.Event):
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.5)
+        except queue.Empty:
+            continue
+    return _DONE
+
+
+def run_pipeline(
+    cfg: Config,
+    col,
+    embed,
+    manifest: Manifest,
+    jobs: List[_Job],
+    stats: Dict[str, int],
+    workers: int,
+    dedup=None,
+    on_file=None,
+    cancelled=None,
+) -> None:
+    q_embed: queue.Queue = queue.Queue(maxsize=cfg.ingest_queue_size)
+    q_write: queue.Queue = queue.Queue(maxsize=cfg.ingest_queue_size)
+    stop = threading.Event()
+    errors: List[BaseException] = []
+
+    def embed_stage():
+        ids, docs, metas, owners, marks = [], [], [], [], []
+
+        def emit():
+            # duplicates are dropped here, before embedding, but still owned by their file
+            keep_ids, keep_docs, keep_metas, changes = _dedup_batch(dedup, list(ids), list(docs), list(metas))
+            embs = []
+            if keep_docs:
+                with metrics.span("ingest_embed"):
+                    embs = embed(keep_docs)
+            _put(q_write, (keep_ids, embs, keep_docs, keep_metas, changes, list(ids), list(owners), list(marks)), stop)
+            for buf in (ids, docs, metas, owners, marks):
+                buf.clear()
+
+        try:
+            while True:
+                msg = _get(q_embed, stop)
+                if msg is _DONE:
+                    break
+                j, n_shards, items, last = msg
+                for uid, doc, meta in items or ():
+                    ids.append(uid); docs.append(doc); metas.append(meta); owners.append(j)
+                    if len(ids) >= BATCH:
+                        emit()
+                # shard-complete marker travels with the batch holding its last chunk
+                if last:
+                    marks.append((j, n_shards, items is None))
+            if (ids or marks) and not stop.is_set():
+                emit()
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            _put(q_write, _DONE, stop)
+
+    def write_stage():
+        file_ids: Dict[int, List[str]] = defaultdict(list)
+        shards_done: Counter = Counter()
+        failed = set()
+        pbar = tqdm(total=len(jobs), desc="files")
+        try:
+            while True:
+                msg = _get(q_write, stop)
+                if msg is _DONE:
+                    break
+                ids, embs, docs, metas, changes, all_ids, owners, marks = msg
+                if ids or changes is not None:
+                    with metrics.span("ingest_write"):
+                        _write(col, dedup, changes, ids, embs, docs, metas)
+                for uid, j in zip(all_ids, owners):
+                    file_ids[j].append(uid)
+                finished = []
+                for j, n_shards, shard_failed in marks:
+                    shards_done[j] += 1
+                    if shard_failed:
+                        failed.add(j)
+                    if shards_done[j] < n_shards:
+                        continue
+                    job, ids_j = jobs[j], file_ids.pop(j, [])
+                    if j in failed:
+                        _record_failed(manifest, stats, job, ids_j)
+                    else:
+                        _record(col, manifest, stats, job, ids_j, dedup)
+                    finished.append((job.path, len(ids_j), j not in failed))
+                    pbar.update(1)
+                manifest.commit()
+                if on_file is not None:
+                    for item in finished:
+                        on_file(*item)
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            pbar.close()
+
+    # stage threads share the caller's trace so the run breakdown includes them
+    threads = [
+        threading.Thread(target=contextvars.copy_context().run, args=(embed_stage,),
+                         name="ingest-embed", daemon=True),
+        threading.Thread(target=contextvars.copy_context().run, args=(write_stage,),
+                         name="ingest-write", daemon=True),
+    ]
+    for t in threads:
+        t.start()
+
+    tasks = []
+    for j, job in enumerate(jobs):
+        shards = _shards(job.path, cfg.pdf_shard_pages)
+        tasks.extend((j, pages, len(shards)) for pages in shards)
+    logger.info(f"Pipelined ingest: {len(jobs)} files as {len(tasks)} tasks on {workers} workers")
+
+    max_inflight = workers * 2
+    spec = chunk_spec(cfg)
+
+    def stream(j: int, n_shards: int) -> None:
+        # A worker would return the whole file's chunks at once; big text files are
+        # instead chunked here while they are read and handed on batch by batch
+        items = []
+        try:
+            for item in _iter_chunks(cfg, jobs[j].path, spec, tags=jobs[j].tags, doc=jobs[j].doc):
+                items.append(item)
+                if len(items) >= BATCH:
+                    _put(q_embed, (j, n_shards, items, False), stop)
+                    items = []
+        except Exception as e:
+            logger.error(f"Extraction failed for {jobs[j].path}: {e}")
+            items = None
+        _put(q_embed, (j, n_shards, items, True), stop)
+
+    # spawn, not fork: the parent may already hold torch/chroma threads
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context("spawn")) as pool:
+        it = iter(tasks)
+        inflight = {}
+        try:
+            while not stop.is_set():
+                while len(inflight) < max_inflight:
+                    task = next(it, None)
+                    if task is None:
+                        break
+                    j, pages, n_shards = task
+                    if (pages is None or pages[0] == 0) and cancelled is not None and cancelled():
+                        # stop at a file boundary so no file is left half written
+                        stats["cancelled"] = len(jobs) - j
+                        it = iter(())
+                        break
+                    if jobs[j].size > STREAM_TEXT_BYTES and jobs[j].path.lower().endswith((".txt", ".md")):
+                        stream(j, n_shards)
+                        continue
+                    fut = pool.submit(_extract, cfg, jobs[j].path, pages, spec, jobs[j].tags, jobs[j].doc)
+                    inflight[fut] = task
+                if not inflight:
+                    break
+                done, _ = wait(inflight, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    j, pages, n_shards = inflight.pop(fut)
+                    try:
+                        items, timings = fut.result()
+                        metrics.observe_trace(timings)
+                    except Exception as e:
+                        logger.error(f"Extraction failed for {jobs[j].path} (pages {pages}): {e}")
+                        items = None
+                    _put(q_embed, (j, n_shards, items, True), stop)
+        finally:
+            if stop.is_set():
+                for fut in inflight:
+                    fut.cancel()
+            _put(q_embed, _DONE, stop)
+
+    for t in threads:
+        t.join()
+    if errors:
+        raise errors[0]
@@ -1,24 +1,121 @@
 
 
 from __future__ import annotations
-from typing import List, Tuple, Dict, Any
+import json
+import time
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Tuple, Dict, Any
 
 from .config import Config
-from .store import get_collection
+from .store import get_collection, get_embedding_function
+from .catalog import Filters, attach_sources, build_where
+from . import metrics
 
 
-def retrieve(cfg: Config, question: str) -> List[Dict[str, Any]]:
-    col, _ = get_collection(cfg)
-    res = col.query(query_texts=[question], n_results=cfg.top_k)
+class QueryEmbeddingCache:
+    """Thread-safe LRU (with TTL) of question -> embedding, keyed by embedding model."""
 
-    # chroma returns lists for each query; we only do one query
-    docs = res.get("documents", [[]])[0]
-    metas = res.get("metadatas", [[]])[0]
-    dists = res.get("distances", [[]])[0]
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Tuple[str, str, str], Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and time.monotonic() - item[0] > self.ttl:
+                del self._data[key]
+                self.expired += 1
+                item = None
+            if item is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def put(self, key, vec) -> None:
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic(), vec)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "expired": self.expired,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+# One cache per (size, ttl) so configs with different settings in one process (e.g.
+# the API next to a batch run) do not resize each other's cache; keys carry the model.
+_QCACHES: Dict[Tuple[int, float], QueryEmbeddingCache] = {}
+_QCACHES_LOCK = threading.Lock()
+
+
+def _query_cache(cfg: Config) -> QueryEmbeddingCache:
+    key = (cfg.query_cache_size, cfg.query_cache_ttl)
+    with _QCACHES_LOCK:
+        cache = _QCACHES.get(key)
+        if cache is None:
+            cache = _QCACHES[key] = QueryEmbeddingCache(maxsize=key[0], ttl=key[1])
+        return cache
+
+
+def query_cache_stats(cfg: Optional[Config] = None) -> Dict[str, Any]:
+    return _query_cache(cfg or Config()).stats()
+
+
+def embed_queries(cfg: Config, questions: List[str]) -> List[Any]:
+    """Embed questions, serving repeats from the in-process LRU. All misses are
+    encoded together in a single forward pass."""
+    cache = _query_cache(cfg)
+    keys = [(cfg.embed_model, cfg.embed_backend, q.strip()) for q in questions]
+    out = [cache.get(k) for k in keys]
+    miss = [i for i, v in enumerate(out) if v is None]
+    if miss:
+        # de-duplicate within the batch so each distinct question is encoded once
+        uniq = list(dict.fromkeys(keys[i] for i in miss))
+        with metrics.span("store_load"):
+            ef = get_embedding_function(cfg)
+        with metrics.span("query_embed"):
+            vecs = ef([k[2] for k in uniq])
+        fresh = dict(zip(uniq, vecs))
+        for k, v in fresh.items():
+            cache.put(k, v)
+        for i in miss:
+            out[i] = fresh[keys[i]]
+    return out
+
+
+def _snippets(res: Dict[str, Any], qi: int) -> List[Dict[str, Any]]:
+    ids = (res.get("ids") or [[]])[qi]
+    docs = (res.get("documents") or [[]])[qi]
+    metas = (res.get("metadatas") or [[]])[qi]
+    dists = (res.get("distances") or [[]])[qi]
 
     out = []
-    for d, m, dist in zip(docs, metas, dists):
+    for cid, d, m, dist in zip(ids, docs, metas, dists):
         item = dict(m)
+        if isinstance(item.get("locations"), str):
+            # near-duplicate copies of this chunk (see dedup.py)
+            item["locations"] = json.loads(item["locations"])
+        item["id"] = cid
         item["text"] = d
         item["score"] = dist  # cosine distance; smaller is more similar
         out.append(item)
@@ -28,6 +125,29 @@ def retrieve(cfg: Config, question: str) -> List[Dict[str, Any]]:
     return out
 
 
+def retrieve_many(cfg: Config, questions: List[str],
+                  filters: Optional[Filters] = None) -> List[List[Dict[str, Any]]]:
+    """Retrieve for several questions with one batched encode and one Chroma query.
+    `filters` (see `catalog.Filters`) are pushed down into the search as `where`."""
+    if not questions:
+        return []
+    with metrics.span("store_load"):
+        col, _ = get_collection(cfg)
+    where = build_where(cfg, filters)
+    embs = embed_queries(cfg, questions)
+    with metrics.span("search"):
+        if where is None:
+            res = col.query(query_embeddings=embs, n_results=cfg.top_k)
+        else:
+            res = col.query(query_embeddings=embs, n_results=cfg.top_k, where=where)
+    # only the final top_k hits are resolved to their document paths
+    return [attach_sources(cfg, _snippets(res, i)) for i in range(len(questions))]
+
+
+def retrieve(cfg: Config, question: str, filters: Optional[Filters] = None) -> List[Dict[str, Any]]:
+    return retrieve_many(cfg, [question], filters)[0]
+
+
 def make_context(snippets: List[Dict[str, Any]], max_chars: int = 6000) -> str:
     # Concatenate snippets until reaching max_chars, keeping source header lines
     pieces = []
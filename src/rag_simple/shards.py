@@ -0,0 +1,223 @@
+"""Sharded collections (`Config.shard_by = "hash" | "folder"`).
+
+Chunks are partitioned across several collections (for the flat backend, several
+directories), routed by the path of the chunk's document (``doc`` id, looked up in the
+catalog):
+
+- ``hash``: sha1 of the path modulo `Config.shards`;
+- ``folder``: the top-level subfolder of `Config.docs_dir` the file lives in (files
+  directly in `docs_dir` go to the ``top`` shard). Shards are created as new folders
+  appear.
+
+`ShardedCollection` implements the same collection subset as a single collection
+(`store.VectorCollection`): writes are routed per chunk, deletes and lookups go to every
+shard, and `query` fans out to the shards in parallel and merges the per-shard top-k by
+distance. The shard list and the collection-level metadata live in
+``{db_dir}/{collection}.shards.json``. `drop_shard` empties one shard so it can be
+re-ingested without touching the others (see `ingest.rebuild_shard`).
+"""
+from __future__ import annotations
+import os
+import re
+import json
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from .config import Config
+from .logging_setup import logger
+from .catalog import doc_table
+
+
+SHARD_MODES = ("hash", "folder")
+
+
+def shard_key(cfg: Config, path: str) -> str:
+    """Shard a source path belongs to."""
+    path = os.path.abspath(path)
+    if cfg.shard_by == "hash":
+        h = int(hashlib.sha1(path.encode("utf-8")).hexdigest(), 16)
+        return f"s{h % max(1, cfg.shards):02d}"
+    if cfg.shard_by == "folder":
+        rel = os.path.relpath(path, os.path.abspath(cfg.docs_dir))
+        parts = rel.split(os.sep)
+        if len(parts) < 2 or parts[0] == "..":
+            return "top"
+        return parts[0]
+    raise ValueError(f"Unknown shard mode {cfg.shard_by!r}; expected one of {SHARD_MODES}")
+
+
+def collection_name(cfg: Config, key: str) -> str:
+    # collection names allow [a-zA-Z0-9._-]; keep folder names readable but unique
+    slug = re.sub(r"[^A-Za-z0-9_-]", "_", key)
+    if slug != key:
+        slug += "-" + hashlib.sha1(key.encode("utf-8")).hexdigest()[:6]
+    return f"{cfg.collection}-{slug}"
+
+
+def _registry_path(cfg: Config) -> str:
+    return os.path.join(cfg.db_dir, f"{cfg.collection}.shards.json")
+
+
+class ShardedCollection:
+    def __init__(self, cfg: Config, open_shard: Callable[[str, Dict[str, Any]], Any],
+                 drop_shard: Callable[[str], None]):
+        self.cfg = cfg
+        self.name = cfg.collection
+        self._open = open_shard
+        self._drop = drop_shard
+        self._path = _registry_path(cfg)
+        self._lock = threading.RLock()
+        self._stamp = None
+        self._reg: Dict[str, Any] = {"by": cfg.shard_by, "shards": [], "metadata": {}}
+        self._shards: Dict[str, Any] = {}
+        self._epochs: Dict[str, int] = {}
+        self._pool = ThreadPoolExecutor(max_workers=max(1, cfg.shard_workers), thread_name_prefix="shard")
+        self._sync()
+        if self._reg["by"] != cfg.shard_by:
+            raise ValueError(
+                f"Collection {cfg.collection!r} is sharded by {self._reg['by']!r}, not {cfg.shard_by!r}; "
+                f"use another collection or rebuild."
+            )
+        if cfg.shard_by == "hash":
+            for i in range(max(1, cfg.shards)):
+                self._shard(f"s{i:02d}")
+
+    # ----- registry ----------------------------------------------------------------
+
+    def _sync(self) -> None:
+        """Pick up shards created by another process (e.g. an ingest next to a server)."""
+        try:
+            st = os.stat(self._path)
+        except OSError:
+            return
+        stamp = (st.st_ino, st.st_mtime_ns, st.st_size)
+        if stamp == self._stamp:
+            return
+        with self._lock:
+            with open(self._path, "r", encoding="utf-8") as f:
+                self._reg = json.load(f)
+            self._stamp = stamp
+            epochs = self._reg.setdefault("epochs", {})
+            for key in list(self._shards):
+                # dropped (and possibly rebuilt) elsewhere: the old handle is stale
+                if key not in self._reg["shards"] or epochs.get(key, 0) != self._epochs.get(key, 0):
+                    del self._shards[key]
+            for key in self._reg["shards"]:
+                if key not in self._shards:
+                    self._shards[key] = self._open(collection_name(self.cfg, key), self._reg["metadata"])
+                    self._epochs[key] = epochs.get(key, 0)
+
+    def _save(self) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(self._path)), exist_ok=True)
+        tmp = self._path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self._reg, f, indent=2)
+        os.replace(tmp, self._path)
+        st = os.stat(self._path)
+        self._stamp = (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _shard(self, key: str):
+        with self._lock:
+            col = self._shards.get(key)
+            if col is None:
+                col = self._shards[key] = self._open(collection_name(self.cfg, key), self._reg["metadata"])
+                self._reg["shards"] = sorted(set(self._reg["shards"]) | {key})
+                self._save()
+                logger.info(f"Created shard {key!r} of {self.name!r}")
+            return col
+
+    def shards(self) -> Dict[str, int]:
+        """Chunk count per shard."""
+        self._sync()
+        return {k: c.count() for k, c in sorted(self._shards.items())}
+
+    def drop_shard(self, key: str) -> None:
+        """Delete one shard's collection and start it empty."""
+        with self._lock:
+            self._sync()
+            self._shards.pop(key, None)
+            try:
+                self._drop(collection_name(self.cfg, key))
+            except Exception as e:  # never created
+                logger.debug(f"Dropping shard {key!r}: {e}")
+            epochs = self._reg.setdefault("epochs", {})
+            epochs[key] = self._epochs[key] = epochs.get(key, 0) + 1
+            self._reg["shards"] = [k for k in self._reg["shards"] if k != key]
+            self._shard(key)
+
+    def _each(self, fn: Callable[[Any], Any]) -> List[Any]:
+        self._sync()
+        cols = list(self._shards.values())
+        if len(cols) == 1:
+            return [fn(cols[0])]
+        return list(self._pool.map(fn, cols))
+
+    # ----- collection API ----------------------------------------------------------
+
+    @property
+    def metadata(self) -> Dict[str, Any]:
+        self._sync()
+        return dict(self._reg["metadata"])
+
+    def modify(self, name: Optional[str] = None, metadata: Optional[Dict[str, Any]] = None) -> None:
+        if metadata is None:
+            return
+        with self._lock:
+            self._reg["metadata"] = dict(metadata)
+            self._save()
+        self._each(lambda c: c.modify(metadata=metadata))
+
+    def count(self) -> int:
+        return sum(self._each(lambda c: c.count()))
+
+    def upsert(self, ids: List[str], embeddings=None, documents=None, metadatas=None) -> None:
+        paths = doc_table(self.cfg).sources({m["doc"] for m in metadatas if "doc" in m})
+        groups: Dict[str, List[int]] = {}
+        for i, m in enumerate(metadatas):
+            path = m["source"] if "source" in m else paths[m["doc"]]
+            groups.setdefault(shard_key(self.cfg, path), []).append(i)
+        for key, idx in groups.items():
+            self._shard(key).upsert(
+                ids=[ids[i] for i in idx],
+                embeddings=[embeddings[i] for i in idx] if embeddings is not None else None,
+                documents=[documents[i] for i in idx] if documents is not None else None,
+                metadatas=[metadatas[i] for i in idx],
+            )
+
+    add = upsert
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs) -> None:
+        # chunk ids do not carry their shard; deleting a missing id is a no-op
+        if ids:
+            self._each(lambda c: c.delete(ids=ids, **kwargs))
+
+    def update(self, ids: List[str], **kwargs) -> None:
+        # like delete: unknown ids are ignored by every shard that does not hold them
+        if ids:
+            self._each(lambda c: c.update(ids=ids, **kwargs))
+
+    def get(self, ids: Optional[List[str]] = None, **kwargs) -> Dict[str, Any]:
+        keys = ["ids", "documents", "metadatas"] + (["embeddings"] if "embeddings" in kwargs.get("include", ()) else [])
+        out: Dict[str, Any] = {k: [] for k in keys}
+        for res in self._each(lambda c: c.get(ids=ids, **kwargs)):
+            for key in out:
+                if res.get(key) is not None:  # chroma returns embeddings as an array
+                    out[key].extend(res[key])
+        return out
+
+    def query(self, query_embeddings=None, n_results: int = 10, **kwargs) -> Dict[str, Any]:
+        parts = self._each(lambda c: c.query(query_embeddings=query_embeddings, n_results=n_results, **kwargs))
+        keys = ("ids", "documents", "metadatas", "distances")
+        out: Dict[str, Any] = {k: [] for k in keys}
+        for qi in range(len(query_embeddings)):
+            hits = []
+            for res in parts:
+                n = len(res["ids"][qi])
+                # fields left out via `include` come back as None
+                hits.extend(zip(*[res[k][qi] if res.get(k) else [None] * n for k in keys]))
+            hits.sort(key=lambda h: h[3])
+            for j, k in enumerate(keys):
+                out[k].append([h[j] for h in hits[:n_results]])
+        return out
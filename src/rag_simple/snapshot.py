@@ -0,0 +1,276 @@
+"""Portable index snapshots (``rag-export`` / ``rag-import``).
+
+A snapshot is one file with a row per stored chunk: ``id``, ``document``, ``embedding``
+(fixed-size list of float32) and ``metadata`` (the chunk's metadata as JSON). Files
+ending in ``.parquet`` are written as Parquet (zstd, one row group per batch), anything
+else as an Arrow IPC file (``.arrow`` / ``.feather``). Both sides stream record batches
+of `Config.snapshot_batch` chunks, so neither holds the collection in memory.
+
+The schema metadata carries the embedding fingerprint (model, backend, parity,
+dimension) and the chunking settings under ``rag_snapshot``, the document catalog
+(doc ids, paths, types, tags and each file's size/mtime/sha) under ``rag_catalog``
+and, for an index built with dedup, the duplicate → canonical chunk references under
+``rag_dedup_refs``. Chunks refer to their document by doc id, so the catalog is
+restored with the same ids; with the file records, a later ``rag-build`` over the same
+paths skips unchanged files.
+
+`import_snapshot` refuses a snapshot built with another model than `Config.embed_model`
+and writes the stored vectors as they are: the embedding model is never loaded. The
+target collection must be empty (import under a new `RAG_COLLECTION` to swap indexes
+without downtime). For a dedup index the signatures are recomputed from the chunk
+texts and the references restored, so a later re-ingest of a changed file still
+re-stores canonical chunks that other files' duplicates point to (see
+`dedup.Deduper.forget`). Version 1 snapshots carry no references: their duplicates are
+only reachable through the canonical chunks' ``locations`` and are lost if that
+chunk's file changes, so rebuild such an index from the documents when possible.
+"""
+from __future__ import annotations
+import os
+import re
+import json
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from .config import Config
+from .logging_setup import logger
+from .manifest import Manifest, manifest_path
+from .catalog import META_FORMAT
+from .dedup import SignatureIndex, dedup_path, read_refs, simhash
+from .store import get_vector_collection, bump_index_version
+
+
+SNAPSHOT_VERSION = 2  # 2: dedup references
+INFO_KEY = b"rag_snapshot"
+CATALOG_KEY = b"rag_catalog"
+REFS_KEY = b"rag_dedup_refs"
+_FINGERPRINT = ("embed_model", "embed_backend", "embed_parity")
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+    except ImportError as e:
+        raise ImportError("Snapshots need pyarrow: pip install -e .[snapshot]") from e
+    return pyarrow
+
+
+def _is_parquet(path: str) -> bool:
+    return path.lower().endswith((".parquet", ".pq"))
+
+
+def _schema(pa, dim: int, info: Dict[str, Any], catalog: List[Dict[str, Any]], refs: List[Any]):
+    return pa.schema(
+        [("id", pa.string()), ("document", pa.string()), ("embedding", pa.list_(pa.float32(), dim)),
+         ("metadata", pa.string())],
+        metadata={INFO_KEY: json.dumps(info), CATALOG_KEY: json.dumps(catalog), REFS_KEY: json.dumps(refs)},
+    )
+
+
+def _dedup_distance(chunking: Optional[str]) -> Optional[int]:
+    # `ingest_dir` appends ":dedup<distance>" to the chunking key of a dedup index
+    m = re.search(r":dedup(\d+)$", chunking or "")
+    return int(m.group(1)) if m else None
+
+
+def _record_batch(pa, schema, rows: Dict[str, list], n: int):
+    emb = np.asarray(rows["embeddings"][:n], dtype=np.float32).reshape(-1)
+    return pa.RecordBatch.from_arrays([
+        pa.array(rows["ids"][:n], pa.string()),
+        pa.array(rows["documents"][:n], pa.string()),
+        pa.FixedSizeListArray.from_arrays(pa.array(emb), schema.field("embedding").type.list_size),
+        pa.array([json.dumps(m, separators=(",", ":")) for m in rows["metadatas"][:n]], pa.string()),
+    ], schema=schema)
+
+
+def _writer(pa, path: str, schema, parquet: bool):
+    if parquet:
+        import pyarrow.parquet as pq
+        return pq.ParquetWriter(path, schema, compression="zstd")
+    return pa.ipc.new_file(path, schema)
+
+
+def _reader(pa, path: str, batch: int) -> Tuple[Any, Iterator[Any]]:
+    if _is_parquet(path):
+        import pyarrow.parquet as pq
+        f = pq.ParquetFile(path)
+        return f.schema_arrow, f.iter_batches(batch_size=batch)
+    r = pa.ipc.open_file(pa.memory_map(path))
+    return r.schema, (r.get_batch(i) for i in range(r.num_record_batches))
+
+
+def read_info(path: str) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    """(info, catalog) of a snapshot, from its schema metadata only."""
+    info, catalog, _ = _read_meta(path)
+    return info, catalog
+
+
+def _read_meta(path: str) -> Tuple[Dict[str, Any], List[Dict[str, Any]], Optional[List[Any]]]:
+    # (info, catalog, dedup references or None for a version 1 snapshot)
+    pa = _pyarrow()
+    schema, _ = _reader(pa, path, 1)
+    meta = schema.metadata or {}
+    if INFO_KEY not in meta:
+        raise ValueError(f"{path} is not an index snapshot")
+    info = json.loads(meta[INFO_KEY])
+    if info.get("version", 0) > SNAPSHOT_VERSION:
+        raise ValueError(f"{path} has snapshot version {info['version']}; this version reads up to "
+                         f"{SNAPSHOT_VERSION}")
+    refs = json.loads(meta[REFS_KEY]) if REFS_KEY in meta else None
+    return info, json.loads(meta.get(CATALOG_KEY, b"[]")), refs
+
+
+def export_snapshot(cfg: Config, path: str, batch: Optional[int] = None) -> Dict[str, Any]:
+    """Write the collection's chunks, embeddings and catalog to `path`. Run it while no
+    ingest is writing to the collection."""
+    pa = _pyarrow()
+    batch = max(1, batch or cfg.snapshot_batch)
+    if not os.path.exists(manifest_path(cfg)):
+        raise ValueError(f"No index for collection {cfg.collection!r} in {cfg.db_dir}")
+    t0 = time.perf_counter()
+    col, _ = get_vector_collection(cfg)
+    manifest = Manifest(manifest_path(cfg))
+    try:
+        if manifest.get_meta("chunk_meta") != META_FORMAT:
+            raise ValueError(f"Collection {cfg.collection!r} still has per-chunk source metadata; "
+                             f"run rag-build once to migrate it before exporting")
+        # files in path order, chunks in file order: the same index gives the same rows
+        chunk_ids = list(dict.fromkeys(cid for p in sorted(manifest.paths()) for cid in manifest.get(p)["ids"]))
+        catalog = manifest.catalog()
+        chunking = manifest.get_meta("chunking")
+    finally:
+        manifest.close()
+    refs = [list(r) for r in read_refs(cfg)]
+
+    stamp = dict(col.metadata or {})
+    if "embed_model" not in stamp:
+        logger.warning(f"Collection {cfg.collection!r} has no embedding stamp; recording {cfg.embed_model!r}")
+        stamp = {"embed_model": cfg.embed_model, "embed_backend": cfg.embed_backend, "embed_parity": 1.0}
+    info = {"version": SNAPSHOT_VERSION, "collection": cfg.collection,
+            **{k: stamp.get(k) for k in _FINGERPRINT},
+            "chunking": chunking, "chunk_meta": META_FORMAT, "created_at": time.time()}
+
+    rows: Dict[str, list] = {"ids": [], "documents": [], "metadatas": [], "embeddings": []}
+    writer = schema = None
+    tmp = path + ".tmp"
+    n = 0
+    try:
+        for i in range(0, len(chunk_ids), batch):
+            got = col.get(ids=chunk_ids[i:i + batch], include=["embeddings", "documents", "metadatas"])
+            for key in rows:
+                rows[key].extend(got[key])
+            if writer is None and rows["ids"]:
+                info["dim"] = len(rows["embeddings"][0])
+                schema = _schema(pa, info["dim"], info, catalog, refs)
+                writer = _writer(pa, tmp, schema, _is_parquet(path))
+            # fixed-size batches even where chunks are missing from the collection
+            while len(rows["ids"]) >= batch:
+                writer.write_batch(_record_batch(pa, schema, rows, batch))
+                rows = {k: v[batch:] for k, v in rows.items()}
+                n += batch
+        if writer is None:
+            raise ValueError(f"Collection {cfg.collection!r} is empty; nothing to export")
+        if rows["ids"]:
+            writer.write_batch(_record_batch(pa, schema, rows, len(rows["ids"])))
+            n += len(rows["ids"])
+        writer.close()
+        writer = None
+        os.replace(tmp, path)
+    finally:
+        if writer is not None:
+            writer.close()
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    secs = time.perf_counter() - t0
+    logger.info(f"Exported {n} chunks of {len(catalog)} documents ({info['embed_model']}, dim {info['dim']}) "
+                f"to {path} in {secs:.1f}s")
+    return {"path": path, "chunks": n, "documents": len(catalog), "dim": info["dim"],
+            "embed_model": info["embed_model"], "seconds": round(secs, 3)}
+
+
+def _reset_sidecars(cfg: Config) -> None:
+    # the collection is empty, so any manifest or dedup index left next to it is stale
+    for base in (manifest_path(cfg), dedup_path(cfg)):
+        for suffix in ("", "-wal", "-shm", "-journal"):
+            if os.path.exists(base + suffix):
+                os.remove(base + suffix)
+
+
+def import_snapshot(cfg: Config, path: str, batch: Optional[int] = None) -> Dict[str, Any]:
+    """Load a snapshot into the (empty) collection `cfg.collection` without embedding."""
+    pa = _pyarrow()
+    batch = max(1, batch or cfg.snapshot_batch)
+    info, catalog, refs = _read_meta(path)
+    if info["embed_model"] != cfg.embed_model:
+        raise ValueError(f"Snapshot {path} was built with {info['embed_model']!r}, not {cfg.embed_model!r}; "
+                         f"set RAG_EMBED_MODEL to the snapshot's model to import it")
+    t0 = time.perf_counter()
+    col, _ = get_vector_collection(cfg)
+    existing = col.count()
+    if existing:
+        raise ValueError(f"Collection {cfg.collection!r} already holds {existing} chunks; import into an "
+                         f"empty collection (set RAG_COLLECTION) or clear it first")
+    _reset_sidecars(cfg)
+
+    distance = _dedup_distance(info.get("chunking"))
+    if distance is not None and refs is None:
+        logger.warning(f"Snapshot {path} predates dedup references: duplicates of its canonical chunks are "
+                       f"not tracked and are dropped if a canonical chunk's file changes; rebuild the index "
+                       f"from the documents to restore them")
+    index = SignatureIndex(dedup_path(cfg), distance) if distance is not None else None
+    manifest = Manifest(manifest_path(cfg))
+    try:
+        # before the chunks: sharded collections route them by their document's path
+        for row in catalog:
+            manifest.restore_doc(row)
+        manifest.commit()
+
+        dim = info["dim"]
+        by_doc: Dict[int, List[str]] = {}
+        n = 0
+        _, batches = _reader(pa, path, batch)
+        for rb in batches:
+            cols = dict(zip(rb.schema.names, rb.columns))
+            ids = cols["id"].to_pylist()
+            metas = [json.loads(m) for m in cols["metadata"].to_pylist()]
+            docs = cols["document"].to_pylist()
+            emb = cols["embedding"].flatten().to_numpy(zero_copy_only=False).reshape(len(ids), dim)
+            col.upsert(ids=ids, embeddings=list(emb), documents=docs, metadatas=metas)
+            for cid, m in zip(ids, metas):
+                by_doc.setdefault(m.get("doc"), []).append(cid)
+            if index is not None:
+                # every stored chunk of a dedup index is canonical
+                for cid, doc in zip(ids, docs):
+                    sig = simhash(doc)
+                    if sig is not None:
+                        index.add(cid, sig)
+            n += len(ids)
+
+        if index is not None:
+            # skipped duplicates are part of their file's chunk ids, as after an ingest
+            for cid, canon, m in refs or []:
+                index.set_ref(cid, canon, m)
+                by_doc.setdefault(m.get("doc"), []).append(cid)
+
+        for row in catalog:
+            if row.get("sha") is not None:
+                manifest.put(row["path"], row["size"], row["mtime_ns"], row["sha"], by_doc.get(row["doc_id"], []))
+        if info.get("chunking"):
+            manifest.set_meta("chunking", info["chunking"])
+        manifest.set_meta("chunk_meta", META_FORMAT)
+        manifest.commit()
+    finally:
+        manifest.close()
+        if index is not None:
+            index.close()
+
+    meta = dict(col.metadata or {})
+    meta.update({k: info[k] for k in _FINGERPRINT if info.get(k) is not None})
+    col.modify(metadata=meta)
+    bump_index_version(cfg)
+    secs = time.perf_counter() - t0
+    logger.info(f"Imported {n} chunks of {len(catalog)} documents from {path} into {cfg.collection!r} "
+                f"in {secs:.1f}s")
+    return {"path": path, "chunks": n, "documents": len(catalog), "dim": dim,
+            "embed_model": info["embed_model"], "seconds": round(secs, 3)}
@@ -1,22 +1,214 @@
 from __future__ import annotations
 import os
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Protocol, Tuple
+
 import chromadb
 from chromadb.utils import embedding_functions
 
 from .config import Config
+from .logging_setup import logger
+from .embeddings import make_embedding_function, check_compatible
 
 
-def get_collection(cfg: Config):
-    os.makedirs(cfg.db_dir, exist_ok=True)
-    client = chromadb.PersistentClient(path=cfg.db_dir)  # 0.5+
+VECTOR_BACKENDS = ("chroma", "flat")
 
-    ef = embedding_functions.SentenceTransformerEmbeddingFunction(
-        model_name=cfg.embed_model,
-        normalize_embeddings=True,
-    )
 
-    col = client.get_or_create_collection(
+class VectorCollection(Protocol):
+    """What `ingest`, `retrieve` and the UI need from a collection. Chroma's
+    `Collection` satisfies it; `flat_store.FlatCollection` implements the same subset.
+    Writes always pass precomputed embeddings."""
+
+    metadata: Optional[Dict[str, Any]]
+
+    def upsert(self, ids: List[str], embeddings: Any, documents: List[str],
+               metadatas: List[Dict[str, Any]]) -> None: ...
+    def update(self, ids: List[str], metadatas: List[Dict[str, Any]]) -> None: ...
+    def delete(self, ids: List[str]) -> None: ...
+    def get(self, ids: Optional[List[str]] = None, **kwargs) -> Dict[str, Any]: ...
+    def query(self, query_embeddings: Any, n_results: int, **kwargs) -> Dict[str, Any]: ...
+    def count(self) -> int: ...
+    def modify(self, metadata: Dict[str, Any]) -> None: ...
+
+
+# Process-wide registry so the vector-store client and the embedding model stay
+# resident across requests. Clients are shared per (db_dir, vector_backend), embedding
+# functions per (embed_model, embed_backend), and collection handles per
+# (db_dir, collection, embed_model, embed_backend, vector_backend, shard_by).
+_LOCK = threading.RLock()
+_CLIENTS: Dict[Tuple[str, str], Any] = {}
+_EMBEDDERS: Dict[Tuple[str, str], Any] = {}
+_COLLECTIONS: Dict[Tuple[str, str, str, str, str, str], Any] = {}
+_LOADS: Deque[Dict[str, Any]] = deque(maxlen=64)  # most recent loads only
+_STATS = {"hits": 0, "misses": 0}
+
+
+def _key(cfg: Config) -> Tuple[str, str, str, str, str, str]:
+    return (os.path.abspath(cfg.db_dir), cfg.collection, cfg.embed_model, cfg.embed_backend,
+            cfg.vector_backend, cfg.shard_by)
+
+
+def _record_load(kind: str, name: str, started: float) -> None:
+    secs = time.perf_counter() - started
+    _LOADS.append({"kind": kind, "name": name, "seconds": round(secs, 4), "at": time.time()})
+    logger.info(f"Loaded {kind} {name} in {secs:.2f}s")
+
+
+def _get_client(cfg: Config):
+    key = (os.path.abspath(cfg.db_dir), cfg.vector_backend)
+    client = _CLIENTS.get(key)
+    if client is None:
+        t0 = time.perf_counter()
+        os.makedirs(key[0], exist_ok=True)
+        if cfg.vector_backend == "chroma":
+            client = chromadb.PersistentClient(path=key[0])  # 0.5+
+        elif cfg.vector_backend == "flat":
+            from .flat_store import FlatClient
+            client = FlatClient(key[0], dtype=cfg.flat_dtype, rescore=cfg.flat_rescore)
+        else:
+            raise ValueError(f"Unknown vector backend {cfg.vector_backend!r}; expected one of {VECTOR_BACKENDS}")
+        _CLIENTS[key] = client
+        _record_load(f"{cfg.vector_backend} client", key[0], t0)
+    return client
+
+
+def _get_embedder(cfg: Config):
+    key = (cfg.embed_model, cfg.embed_backend)
+    ef = _EMBEDDERS.get(key)
+    if ef is None:
+        t0 = time.perf_counter()
+        ef = make_embedding_function(cfg)
+        _EMBEDDERS[key] = ef
+        _record_load("embedder", f"{cfg.embed_model} [{cfg.embed_backend}]", t0)
+    return ef
+
+
+def _open_collection(cfg: Config, client, ef):
+    if cfg.shard_by:
+        from .shards import ShardedCollection
+
+        def open_shard(name: str, metadata: Dict[str, Any]):
+            shard = client.get_or_create_collection(name=name, embedding_function=ef)
+            if metadata and not shard.metadata:
+                shard.modify(metadata=metadata)  # new shards inherit the collection stamp
+            return shard
+
+        return ShardedCollection(cfg, open_shard, client.delete_collection)
+    return client.get_or_create_collection(
         name=cfg.collection,
         embedding_function=ef,
     )
-    return col, client
\ No newline at end of file
+
+
+def get_collection(cfg: Config):
+    key = _key(cfg)
+    with _LOCK:
+        cached = _COLLECTIONS.get(key)
+        if cached is not None:
+            _STATS["hits"] += 1
+            return cached
+        _STATS["misses"] += 1
+        client = _get_client(cfg)
+        ef = _get_embedder(cfg)
+        col = _open_collection(cfg, client, ef)
+        check_compatible(col, cfg, ef)
+        _COLLECTIONS[key] = (col, client)
+        return col, client
+
+
+def get_vector_collection(cfg: Config):
+    """The collection without an embedding function, for moving stored vectors in and
+    out (`snapshot.py`) without loading the model. Not cached and not checked against
+    `cfg.embed_model`: the caller compares fingerprints itself."""
+    with _LOCK:
+        client = _get_client(cfg)
+        return _open_collection(cfg, client, None), client
+
+
+def get_embedding_function(cfg: Config):
+    """The resident embedding function for `cfg.embed_model`, for callers that embed
+    outside of Chroma (e.g. the ingest pipeline)."""
+    with _LOCK:
+        return _get_embedder(cfg)
+
+
+def _version_path(cfg: Config) -> str:
+    return os.path.join(cfg.db_dir, f"{cfg.collection}.version")
+
+
+def index_version(cfg: Config) -> str:
+    """Opaque token that changes whenever the collection's contents change (see
+    `bump_index_version`); "" for an index that has never been stamped."""
+    try:
+        with open(_version_path(cfg), "r", encoding="utf-8") as f:
+            return f.read().strip()
+    except OSError:
+        return ""
+
+
+def bump_index_version(cfg: Config) -> str:
+    version = uuid.uuid4().hex
+    os.makedirs(cfg.db_dir, exist_ok=True)
+    tmp = _version_path(cfg) + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(tmp, _version_path(cfg))
+    return version
+
+
+def warmup(cfg: Config) -> Dict[str, Any]:
+    """Load the client and embedding model up front (e.g. at server start) and run one
+    tiny encode so the first real request does not pay for lazy initialisation."""
+    t0 = time.perf_counter()
+    col, _ = get_collection(cfg)
+    get_embedding_function(cfg)(["warmup"])
+    logger.info(f"Store warm-up finished in {time.perf_counter() - t0:.2f}s ({col.count()} chunks)")
+    return load_stats()
+
+
+def _release_client(client) -> None:
+    close = getattr(client, "close", None)  # chromadb >= 1.0, FlatClient
+    try:
+        if close is not None:
+            close()
+        else:
+            client.clear_system_cache()
+    except Exception as e:
+        logger.debug(f"Releasing Chroma client failed: {e}")
+
+
+def invalidate(db_dir: Optional[str] = None, embed_model: Optional[str] = None) -> None:
+    """Drop cached handles. With no arguments everything is released; otherwise only
+    the client for `db_dir` and/or the model for `embed_model` (and every collection
+    handle that uses them) are dropped."""
+    db = os.path.abspath(db_dir) if db_dir else None
+    drop_all = db is None and embed_model is None
+    with _LOCK:
+        for key in list(_COLLECTIONS):
+            if drop_all or key[0] == db or key[2] == embed_model:
+                del _COLLECTIONS[key]
+        for d in list(_CLIENTS):
+            if drop_all or d[0] == db:
+                _release_client(_CLIENTS.pop(d))
+        for m in list(_EMBEDDERS):
+            if drop_all or m[0] == embed_model:
+                del _EMBEDDERS[m]
+                # chroma keeps its own class-level model cache as well
+                embedding_functions.SentenceTransformerEmbeddingFunction.models.pop(m[0], None)
+
+
+def load_stats() -> Dict[str, Any]:
+    with _LOCK:
+        return {
+            "hits": _STATS["hits"],
+            "misses": _STATS["misses"],
+            "loads": list(_LOADS),
+            "resident": {
+                "clients": [list(k) for k in sorted(_CLIENTS)],
+                "embedders": [list(k) for k in sorted(_EMBEDDERS)],
+                "collections": [list(k) for k in _COLLECTIONS],
+            },
+        }
@@ -1,23 +1,24 @@
 from __future__ import annotations
 import os
-import io
+import mmap
+import codecs
+from collections import deque
 import hashlib
-from typing import Iterable, Tuple, Dict
+from typing import Iterable, Iterator, Tuple, Dict, Optional, Union
 
+from .config import Config
 from .logging_setup import logger
+from . import ocr
+from .ocr import HAS_OCR as _HAS_TESS
 
-try:
-    import fitz  # PyMuPDF
-except Exception as e:
-    raise RuntimeError("PyMuPDF (pymupdf) is required. Please install it.") from e
 
-try:
-    import pytesseract
-    from PIL import Image
-    _HAS_TESS = True
-except Exception:
-    _HAS_TESS = False
-    logger.warning("pytesseract/Pillow not found; OCR will be disabled.")
+def _fitz():
+    # PyMuPDF is only needed once a PDF is actually opened
+    try:
+        import fitz  # PyMuPDF
+    except Exception as e:
+        raise RuntimeError("PyMuPDF (pymupdf) is required to read PDFs. Please install it.") from e
+    return fitz
 
 
 def _clean_text(s: str) -> str:
@@ -27,45 +28,88 @@ def _clean_text(s: str) -> str:
     return '\n'.join(lines)
 
 
-def iter_docs(path: str) -> Iterable[Tuple[str, str, Dict]]:
+TEXT_BLOCK_BYTES = 1 << 20
+
+
+def iter_text(path: str, block_bytes: int = TEXT_BLOCK_BYTES) -> Iterator[str]:
+    """Stream a text file through a memory map as cleaned pieces (see `_clean_text`)
+    that concatenate to the whole text. Runs of blank lines are kept as one paragraph
+    break ("\n\n"), which the token chunker cuts on."""
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if not size:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            dec = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+            sep = ""  # owed before the next non-empty line
+            pos = 0
+            while pos < size:
+                # blocks end on a newline, so no line (or CRLF) straddles two blocks
+                end = mm.find(b"\n", min(size, pos + block_bytes))
+                end = size if end < 0 else end + 1
+                block = dec.decode(mm[pos:end], final=end >= size)
+                pos = end
+                lines = block.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+                if block.endswith("\n"):
+                    lines.pop()
+                out = []
+                for ln in lines:
+                    ln = ln.strip()
+                    if not ln:
+                        sep = "\n\n" if sep else ""
+                        continue
+                    out.append(sep + ln)
+                    sep = "\n"
+                if out:
+                    yield "".join(out)
+
+
+def pdf_page_count(path: str) -> int:
+    with _fitz().open(path) as doc:
+        return len(doc)
+
+
+def iter_docs(path: str, pages: Optional[Tuple[int, int]] = None, cfg: Optional[Config] = None
+              ) -> Iterable[Tuple[str, Union[str, Iterator[str]], Dict]]:
     """
     Yield (unit_id, text, metadata) for each logical unit:
-    - For PDFs: each page becomes a unit
+    - For PDFs: each page becomes a unit; `pages=(start, stop)` restricts to a
+      0-based, stop-exclusive page range so large PDFs can be split across workers
     - For images: entire image is a unit (OCR if available)
-    - For .txt/.md: whole file is one unit
+    - For .txt/.md: whole file is one unit, its text a lazy stream of pieces
+      (`iter_text`) so large files are never loaded whole; read errors surface
+      while the stream is consumed
+
+    OCR settings (cache, workers, DPIs, timeout) come from `cfg` (default: `Config()`).
     """
+    cfg = cfg or Config()
     path = os.path.abspath(path)
     ext = os.path.splitext(path)[1].lower()
 
     if ext in {".pdf"}:
-        with fitz.open(path) as doc:
-            for i, page in enumerate(doc):
-                text = page.get_text("text") or ""
-                text = _clean_text(text)
+        with _fitz().open(path) as doc:
+            start, stop = pages if pages else (0, len(doc))
+            # Text-less pages are OCR'd in the background; keep a small window of pages
+            # in flight and yield them in page order.
+            window = deque()
+            for i in range(start, min(stop, len(doc))):
+                page = doc[i]
+                text = _clean_text(page.get_text("text") or "")
                 if not text and _HAS_TESS:
                     # Light OCR only if page has no text
-                    try:
-                        pix = page.get_pixmap(dpi=150)
-                        img = Image.open(io.BytesIO(pix.tobytes("png")))
-                        text = _clean_text(pytesseract.image_to_string(img))
-                    except Exception as e:
-                        logger.debug(f"OCR failed on {path} page {i+1}: {e}")
-                meta = {
-                    "source": path,
-                    "type": "pdf",
-                    "page": i + 1,
-                    "pages": len(doc),
-                }
-                if text:
-                    yield (_unit_id(path, i), text, meta)
+                    text = ocr.submit_page(cfg, page, f"{path} page {i+1}")
+                window.append((i, page, text))
+                while window and (isinstance(window[0][2], str) or len(window) > ocr.window_size(cfg)):
+                    yield from _pdf_unit(cfg, path, len(doc), *window.popleft())
+            while window:
+                yield from _pdf_unit(cfg, path, len(doc), *window.popleft())
 
     elif ext in {".png", ".jpg", ".jpeg", ".tif", ".tiff"}:
         if not _HAS_TESS:
             logger.info(f"Skipping image without OCR: {path}")
             return
         try:
-            img = Image.open(path)
-            text = _clean_text(pytesseract.image_to_string(img))
+            text = _clean_text(ocr.ocr_image_file(cfg, path))
         except Exception as e:
             logger.debug(f"OCR failed on image {path}: {e}")
             return
@@ -74,21 +118,28 @@ def iter_docs(path: str) -> Iterable[Tuple[str, str, Dict]]:
             yield (_unit_id(path, 0), text, meta)
 
     elif ext in {".txt", ".md"}:
-        try:
-            with open(path, "r", encoding="utf-8", errors="ignore") as f:
-                text = _clean_text(f.read())
-        except Exception as e:
-            logger.debug(f"Read failed {path}: {e}")
-            return
-        if text:
-            meta = {"source": path, "type": "text"}
-            yield (_unit_id(path, 0), text, meta)
+        meta = {"source": path, "type": "text"}
+        yield (_unit_id(path, 0), iter_text(path), meta)
 
     else:
         # Unsupported types are silently ignored
         return
 
 
+def _pdf_unit(cfg: Config, path: str, n_pages: int, i: int, page, text) -> Iterable[Tuple[str, str, Dict]]:
+    if isinstance(text, ocr.PageOcr):
+        text = text.result(cfg, page)
+    text = _clean_text(text)
+    meta = {
+        "source": path,
+        "type": "pdf",
+        "page": i + 1,
+        "pages": n_pages,
+    }
+    if text:
+        yield (_unit_id(path, i), text, meta)
+
+
 def _unit_id(path: str, idx: int) -> str:
     h = hashlib.sha1(f"{path}:{idx}".encode("utf-8")).hexdigest()[:12]
     return f"{os.path.basename(path)}::{idx+1}::{h}"
\ No newline at end of file
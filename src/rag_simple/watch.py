@@ -0,0 +1,300 @@
+"""Watch mode: keep the index in sync with the docs directory (``rag-build --watch``).
+
+Changes are picked up with inotify on Linux (one watch per directory, added as
+directories appear) and otherwise by rescanning the directory every
+`Config.watch_poll_s` and comparing size and mtime; ``--poll`` forces the scan, which
+is also what network shares need since inotify does not see changes made by other
+hosts. A changed path is indexed once it has been quiet for `Config.watch_debounce_s`
+(so a file being copied is ingested once, after the copy), or at the latest
+`Config.watch_max_delay_s` after its first change. Each batch goes through
+`ingest.ingest_paths`, which only touches the chunks of the listed files: new and
+modified files are re-chunked, deleted and moved-away ones are purged.
+
+The time from a change being seen to it being indexed is recorded in the
+``rag_index_lag_seconds`` histogram, and ``rag_watch_pending_files`` counts what is
+still waiting; ``--metrics-port`` serves them for Prometheus.
+"""
+from __future__ import annotations
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import ctypes
+import threading
+from dataclasses import replace
+from typing import Dict, List, Optional, Set, Tuple
+
+from .config import Config
+from .logging_setup import logger
+from .ingest import SUPPORTED_EXTS, _doc_paths, ingest_dir, ingest_paths
+from .manifest import Manifest, manifest_path
+from . import metrics
+
+
+IDLE_WAIT_S = 1.0  # longest wait for changes when nothing is pending
+
+# inotify(7)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_DELETE_SELF | IN_ONLYDIR)
+_EVENT = struct.Struct("iIII")  # wd, mask, cookie, len; followed by the name
+
+
+def _hidden(root: str, path: str) -> bool:
+    # glob (and so _doc_paths) skips dot files and dot directories
+    return any(p.startswith(".") for p in os.path.relpath(path, root).split(os.sep))
+
+
+class _Inotify:
+    """Recursive inotify watch; `changes` returns the paths touched since the last call,
+    or None when the kernel queue overflowed and events were lost."""
+
+    def __init__(self, root: str):
+        self.root = root
+        if not sys.platform.startswith("linux"):
+            raise OSError(errno.ENOSYS, "inotify is Linux-only")
+        self._libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._dirs: Dict[int, str] = {}
+        self._add_tree(root)
+
+    def _add_tree(self, top: str) -> None:
+        for d, subdirs, _ in os.walk(top):
+            subdirs[:] = [s for s in subdirs if not s.startswith(".")]
+            wd = self._libc.inotify_add_watch(self.fd, os.fsencode(d), WATCH_MASK)
+            if wd < 0:
+                err = ctypes.get_errno()
+                if err == errno.ENOENT:  # removed while walking
+                    continue
+                raise OSError(err, f"inotify_add_watch failed for {d} (raise fs.inotify.max_user_watches "
+                                   f"or use --poll)")
+            self._dirs[wd] = d
+
+    def _drop_tree(self, top: str) -> None:
+        prefix = os.path.join(top, "")
+        for wd, d in list(self._dirs.items()):
+            if d == top or d.startswith(prefix):
+                self._libc.inotify_rm_watch(self.fd, wd)
+                del self._dirs[wd]
+
+    def changes(self, timeout: float) -> Optional[Set[str]]:
+        out: Set[str] = set()
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return out
+        while True:
+            try:
+                buf = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return out
+            off = 0
+            while off < len(buf):
+                wd, mask, _, n = _EVENT.unpack_from(buf, off)
+                name = os.fsdecode(buf[off + _EVENT.size: off + _EVENT.size + n].rstrip(b"\0"))
+                off += _EVENT.size + n
+                if mask & IN_Q_OVERFLOW:
+                    return None
+                if mask & IN_IGNORED:
+                    self._dirs.pop(wd, None)
+                    continue
+                d = self._dirs.get(wd)
+                if d is None or not name:
+                    continue
+                path = os.path.join(d, name)
+                if _hidden(self.root, path):
+                    continue
+                if mask & IN_ISDIR:
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        # files may land in the directory before its watch exists; the
+                        # directory path itself is expanded to its documents later
+                        try:
+                            self._add_tree(path)
+                        except OSError as e:
+                            logger.warning(f"Watch: {e}")
+                    elif mask & IN_MOVED_FROM:
+                        self._drop_tree(path)
+                    out.add(path)
+                elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO | IN_MOVED_FROM | IN_DELETE):
+                    out.add(path)
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class _Poller:
+    """Polling fallback: rescan the docs directory and diff (size, mtime) snapshots."""
+
+    def __init__(self, root: str, interval: float):
+        self.root = root
+        self.interval = interval
+        self._snap = self._scan()
+        self._next = time.monotonic() + interval
+
+    def _scan(self) -> Dict[str, Tuple[int, int]]:
+        snap = {}
+        for p in _doc_paths(self.root):
+            try:
+                st = os.stat(p)
+            except OSError:
+                continue
+            snap[p] = (st.st_size, st.st_mtime_ns)
+        return snap
+
+    def changes(self, timeout: float) -> Optional[Set[str]]:
+        wait = self._next - time.monotonic()
+        if wait > timeout:
+            time.sleep(max(timeout, 0.0))
+            return set()
+        time.sleep(max(wait, 0.0))
+        snap = self._scan()
+        self._next = time.monotonic() + self.interval
+        changed = {p for p in snap.keys() | self._snap.keys() if snap.get(p) != self._snap.get(p)}
+        self._snap = snap
+        return changed
+
+    def close(self) -> None:
+        pass
+
+
+def _open_source(cfg: Config, root: str, poll: bool):
+    if not poll:
+        try:
+            src = _Inotify(root)
+            logger.info(f"Watching {root} with inotify ({len(src._dirs)} directories)")
+            return src
+        except (OSError, AttributeError) as e:  # AttributeError: libc without inotify
+            logger.warning(f"inotify unavailable ({e}); falling back to polling")
+    logger.info(f"Watching {root} by polling every {cfg.watch_poll_s:g}s")
+    return _Poller(root, cfg.watch_poll_s)
+
+
+def _expand(cfg: Config, paths: List[str]) -> List[str]:
+    """Document paths affected by changes to `paths`: directories that appeared stand for
+    the documents inside them, vanished directories for the indexed files under them."""
+    out: Set[str] = set()
+    gone = []
+    for p in paths:
+        if os.path.isdir(p):
+            out.update(_doc_paths(p))
+        elif p.lower().endswith(SUPPORTED_EXTS):
+            out.add(p)
+        elif not os.path.exists(p):
+            gone.append(p)
+    if gone and os.path.exists(manifest_path(cfg)):
+        m = Manifest(manifest_path(cfg))
+        try:
+            for p in gone:
+                out.update(m.paths_under(p))
+        finally:
+            m.close()
+    return sorted(out)
+
+
+def _serve_metrics(port: int) -> None:
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = metrics.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", metrics.CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+    threading.Thread(target=server.serve_forever, name="rag-watch-metrics", daemon=True).start()
+    logger.info(f"Serving watch metrics on :{port}/metrics")
+
+
+def _apply(cfg: Config, due: Dict[str, float], workers: Optional[int],
+           pending: Dict[str, Tuple[float, float, float]], backoff: float) -> bool:
+    """Index the `due` paths (path -> when its change was first seen); False if that
+    failed, in which case they are pending again and retried in `backoff` seconds."""
+    paths = _expand(cfg, list(due))
+    if paths:
+        try:
+            stats = ingest_paths(cfg, paths, workers=workers)
+        except Exception as e:
+            logger.error(f"Watch: indexing {len(paths)} changed files failed: {e}; retrying in {backoff:g}s")
+            # debounce and max delay count from the retry time, not the first change,
+            # which would make the paths due again immediately
+            retry = time.monotonic() + backoff
+            for p, seen in due.items():
+                pending[p] = (retry, retry - cfg.watch_debounce_s, seen)
+            return False
+    else:
+        stats = {}
+    done = time.monotonic()
+    lags = [done - seen for seen in due.values()]
+    for lag in lags:
+        metrics.INDEX_LAG.observe(value=lag)
+    if paths:
+        logger.info(f"Watch: {len(paths)} files ({stats.get('new', 0)} new, {stats.get('changed', 0)} changed, "
+                    f"{stats.get('removed', 0)} removed), lag {max(lags):.1f}s")
+    return True
+
+
+def watch(cfg: Config, docs_dir: str, workers: Optional[int] = None, poll: bool = False,
+          metrics_port: Optional[int] = None, stop: Optional[threading.Event] = None) -> None:
+    """Sync `docs_dir` once, then apply changes as they happen until `stop` is set
+    (or the process is interrupted)."""
+    root = os.path.abspath(docs_dir)
+    # tags are folder names relative to the watched directory, as with ingest_dir(root)
+    cfg = replace(cfg, docs_dir=root)
+    stop = stop or threading.Event()
+    if metrics_port:
+        _serve_metrics(metrics_port)
+    # start watching before the initial sync so that nothing changed during it is missed
+    source = _open_source(cfg, root, poll)
+    # path -> (first seen, last seen, first seen for the lag metric); a failed batch is
+    # re-queued with a later "first seen" and retried with exponential backoff
+    pending: Dict[str, Tuple[float, float, float]] = {}
+    failures = 0
+    try:
+        ingest_dir(cfg, root, workers=workers)
+        while not stop.is_set():
+            now = time.monotonic()
+            wait = IDLE_WAIT_S
+            if pending:
+                due_at = min(min(last + cfg.watch_debounce_s, first + cfg.watch_max_delay_s)
+                             for first, last, _ in pending.values())
+                wait = min(max(due_at - now, 0.0), IDLE_WAIT_S)
+            changed = source.changes(wait)
+            now = time.monotonic()
+            if changed is None:
+                logger.warning("Watch: change events were lost; rescanning the docs directory")
+                pending.clear()
+                metrics.WATCH_PENDING.set(0)
+                ingest_dir(cfg, root, workers=workers)
+                continue
+            for p in changed:
+                first, last, seen = pending.get(p, (now, now, now))
+                pending[p] = (first, max(now, last), seen)  # last > now: backing off
+            due = {p: seen for p, (first, last, seen) in pending.items()
+                   if now - last >= cfg.watch_debounce_s or now - first >= cfg.watch_max_delay_s}
+            metrics.WATCH_PENDING.set(len(pending))
+            if not due:
+                continue
+            for p in due:
+                del pending[p]
+            backoff = min(max(cfg.watch_debounce_s, IDLE_WAIT_S) * 2 ** failures, cfg.watch_max_delay_s)
+            failures = 0 if _apply(cfg, due, workers, pending, backoff) else failures + 1
+            metrics.WATCH_PENDING.set(len(pending))
+    finally:
+        source.close()
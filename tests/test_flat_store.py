@@ -0,0 +1,38 @@
+import numpy as np
+
+from rag_simple.flat_store import FlatCollection
+
+
+def _collection(tmp_path, n=10, dim=16):
+    col = FlatCollection(str(tmp_path / "c.flat"), "c", dtype="int8")
+    col.upsert(ids=[f"r{i}" for i in range(n)], embeddings=np.eye(n, dim, dtype=np.float32),
+               documents=[f"doc {i}" for i in range(n)], metadatas=[{"i": i} for i in range(n)])
+    return col
+
+
+def test_query_resolves_rows_against_its_own_view(tmp_path, monkeypatch):
+    col = _collection(tmp_path)
+    rows = FlatCollection._rows
+
+    def compact_first(self, *args, **kwargs):
+        # a write lands between scoring and row lookup and renumbers the rows
+        monkeypatch.setattr(FlatCollection, "_rows", rows)
+        self.delete(ids=[f"r{i}" for i in range(5)])
+        self.compact()
+        return rows(self, *args, **kwargs)
+
+    monkeypatch.setattr(FlatCollection, "_rows", compact_first)
+    res = col.query(query_embeddings=[np.eye(1, 16, 7)[0]], n_results=1)
+    assert res["ids"] == [["r7"]]
+    assert res["documents"] == [["doc 7"]]
+    assert res["metadatas"] == [[{"i": 7}]]
+    assert col.count() == 5
+
+
+def test_get_after_compaction(tmp_path):
+    col = _collection(tmp_path)
+    col.delete(ids=["r1", "r3"])
+    col.compact()
+    got = col.get(ids=["r4", "r1"], include=["documents", "metadatas"])
+    assert got["ids"] == ["r4"]
+    assert got["documents"] == ["doc 4"]